@@ -0,0 +1,197 @@
+# basic imports
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+# user defined imports
+from ingest import get_vector_store
+from model import route_queries, generate_response_with_retries, max_request_retries
+from utils.answer_cache import normalize_prompt
+from utils.compliance import extract
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# local HTTP service for other tools that need answers, start it with `python api.py`
+api_host = os.environ.get("RFP_API_HOST", "127.0.0.1")
+api_port = int(os.environ.get("RFP_API_PORT", 8000))
+# questions that arrive within this many seconds of each other are routed as one batch,
+# one embedding call, one cascade pass and one retrieval pass for the whole batch
+api_batch_wait = float(os.environ.get("RFP_API_BATCH_WAIT", 0.02))
+api_max_batch = int(os.environ.get("RFP_API_MAX_BATCH", 64))
+# batches routed at the same time, the collector keeps gathering the next batch meanwhile
+api_batch_workers = 2
+# LLM calls in flight for all requests together, keep it within the OpenAI rate limits
+api_llm_workers = int(os.environ.get("RFP_API_LLM_WORKERS", 8))
+# seconds a request waits for its answer
+api_request_timeout = 600
+
+
+def answer_pending(query, db, confidence):
+    response = generate_response_with_retries(query, db, max_request_retries)
+    if confidence is not None:
+        response["confidence"] = confidence
+    return response
+
+
+def route_with_store(queries):
+    """
+    The batched part of answering a batch of questions. Returns (answered, pending): (index, response)
+    pairs of the questions answered without the LLM and (index, function) pairs whose function
+    returns the response of a question that needs the LLM.
+    """
+    db = get_vector_store()
+    answered, pending, confidences = route_queries(queries, db)
+    return answered, [(index, partial(answer_pending, queries[index], db, confidences[index])) for index in pending]
+
+
+class AnswerBatcher:
+    """
+    Collects the questions of concurrent requests into micro-batches, every batch goes through
+    route_batch once (see route_with_store) and the questions that need the LLM are answered by a
+    shared pool of llm_workers threads. A question that is already being answered is not sent
+    again, the requests share its answer.
+    """
+
+    def __init__(self, route_batch=route_with_store, batch_wait=api_batch_wait, max_batch=api_max_batch,
+                 num_workers=api_batch_workers, llm_workers=api_llm_workers):
+        self.route_batch = route_batch
+        self.batch_wait = batch_wait
+        self.max_batch = max_batch
+        self.questions = queue.Queue()
+        # normalized question -> Future of its answer, while it's being answered
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.batch_executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_workers)
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, question):
+        # returns a Future with the response, shared with every other request for the same question
+        key = normalize_prompt(question)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self.in_flight[key] = future
+        self.questions.put((key, question, future))
+        return future
+
+    def collect(self):
+        while True:
+            batch = [self.questions.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.questions.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.batch_executor.submit(self.run_batch, batch)
+
+    def run_batch(self, batch):
+        logging.info(f"Routing a batch of {len(batch)} questions")
+        try:
+            answered, pending = self.route_batch([question for _, question, _ in batch])
+        except Exception as error:
+            logging.exception("Routing a batch of questions failed")
+            for key, _, future in batch:
+                self.finish(key, future, error=error)
+            return
+        for index, response in answered:
+            key, _, future = batch[index]
+            self.finish(key, future, response=response)
+        for index, answer in pending:
+            key, _, future = batch[index]
+            self.llm_executor.submit(self.run_answer, key, future, answer)
+
+    def run_answer(self, key, future, answer):
+        try:
+            response = answer()
+        except Exception as error:
+            logging.exception("Answering a question failed")
+            self.finish(key, future, error=error)
+            return
+        self.finish(key, future, response=response)
+
+    def finish(self, key, future, response=None, error=None):
+        # later requests for the question start a new answer, e.g. after the data was re-ingested
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+
+def response_to_json(question, response):
+    confidence = response.get("confidence")
+    return {
+        "question": question,
+        "answer": response["result"],
+        # Yes, No or N/A, as in the app's compliance score
+        "compliance": extract(response["result"]),
+        "sources": sorted(set(doc.metadata.get("source", "") for doc in response["source_documents"])),
+        "route": response.get("route", ""),
+        "confidence": confidence,
+    }
+
+
+def create_app(batcher=None):
+    app = Flask(__name__)
+    app.config["batcher"] = batcher or AnswerBatcher()
+
+    def answer_all(questions):
+        futures = [app.config["batcher"].submit(question) for question in questions]
+        return [response_to_json(question, future.result(timeout=api_request_timeout))
+                for question, future in zip(questions, futures)]
+
+    @app.get("/health")
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.post("/answer")
+    def answer():
+        # {"question": "connect to ERP"} -> the answer of "Does software connect to ERP?"
+        question = (request.get_json(silent=True) or {}).get("question")
+        if not isinstance(question, str) or not question.strip():
+            return jsonify({"error": 'expected a JSON body like {"question": "..."}'}), 400
+        return jsonify(answer_all([question])[0])
+
+    @app.post("/answer/bulk")
+    def answer_bulk():
+        # {"questions": [...]} -> {"answers": [...]} in the same order
+        questions = (request.get_json(silent=True) or {}).get("questions")
+        if not isinstance(questions, list) or not all(isinstance(question, str) and question.strip() for question in questions):
+            return jsonify({"error": 'expected a JSON body like {"questions": ["...", "..."]}'}), 400
+        return jsonify({"answers": answer_all(questions)})
+
+    @app.errorhandler(TimeoutError)
+    def timeout(error):
+        return jsonify({"error": "timed out waiting for the answer"}), 504
+
+    @app.errorhandler(Exception)
+    def failed(error):
+        if isinstance(error, HTTPException):
+            return error
+        logging.exception("Answering the request failed")
+        return jsonify({"error": f"{error.__class__.__name__}: {error}"}), 500
+
+    return app
+
+
+if __name__ == "__main__":
+    # open (or ingest) the vector store before the first request
+    get_vector_store()
+    create_app().run(host=api_host, port=api_port, threaded=True)
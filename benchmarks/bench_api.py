@@ -0,0 +1,127 @@
+# basic imports
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from langchain.schema import Document
+from werkzeug.serving import make_server
+
+# run from the repository root: python benchmarks/bench_api.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# user defined imports
+from api import AnswerBatcher, create_app, api_batch_workers, api_llm_workers
+
+
+def percentile_ms(timings, percent):
+    return round(float(np.percentile(timings, percent)) * 1000, 3)
+
+
+class StubRouter:
+    """
+    Stands in for route_with_store without the OpenAI API: one embedding call per batch
+    (embed_seconds, plus retrieve_seconds per question), then llm_seconds per question for the
+    LLM call, which runs on the shared LLM pool of the batcher.
+    """
+
+    def __init__(self, embed_seconds, retrieve_seconds, llm_seconds):
+        self.embed_seconds = embed_seconds
+        self.retrieve_seconds = retrieve_seconds
+        self.llm_seconds = llm_seconds
+        self.lock = threading.Lock()
+        self.batches = []
+        self.llm_calls = 0
+
+    def answer(self, query):
+        time.sleep(self.llm_seconds)
+        with self.lock:
+            self.llm_calls += 1
+        return {"query": query, "result": "Yes, the software does.", "route": "llm",
+                "source_documents": [Document(page_content="", metadata={"source": "stub"})]}
+
+    def __call__(self, queries):
+        with self.lock:
+            self.batches.append(len(queries))
+        time.sleep(self.embed_seconds + self.retrieve_seconds * len(queries))
+        return [], [(index, partial(self.answer, query)) for index, query in enumerate(queries)]
+
+
+def post(url, body):
+    data = json.dumps(body).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as response:
+        return json.load(response)
+
+
+def run_load(args, batch_wait, max_batch, num_workers):
+    stub = StubRouter(args.embed_ms / 1000, args.retrieve_ms / 1000, args.llm_ms / 1000)
+    batcher = AnswerBatcher(stub, batch_wait=batch_wait, max_batch=max_batch, num_workers=num_workers,
+                            llm_workers=args.llm_workers)
+    app = create_app(batcher)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/answer"
+
+    # a share of the requests repeats questions that are asked by other clients at the same time
+    rng = np.random.default_rng(0)
+    num_distinct = max(1, int(args.requests * (1 - args.duplicates)))
+    questions = [f"support requirement number {rng.integers(num_distinct)}" for _ in range(args.requests)]
+
+    def timed_request(question):
+        started = time.perf_counter()
+        post(url, {"question": question})
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        timings = list(clients.map(timed_request, questions))
+    seconds = time.perf_counter() - started
+    server.shutdown()
+    return {
+        "batch_wait_ms": batch_wait * 1000,
+        "max_batch": max_batch,
+        "p50_ms": percentile_ms(timings, 50),
+        "p95_ms": percentile_ms(timings, 95),
+        "p99_ms": percentile_ms(timings, 99),
+        "requests_per_second": round(len(timings) / seconds, 2),
+        "batches": len(stub.batches),
+        "mean_batch_size": round(float(np.mean(stub.batches)), 2),
+        "llm_calls": stub.llm_calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the answering API under concurrent load, with a stub LLM")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32, help="clients sending requests at the same time")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="share of requests that repeat another question")
+    parser.add_argument("--embed-ms", type=float, default=80, help="latency of one embedding call")
+    parser.add_argument("--retrieve-ms", type=float, default=5, help="retrieval time per question")
+    parser.add_argument("--llm-ms", type=float, default=400, help="latency of one LLM call")
+    parser.add_argument("--llm-workers", type=int, default=api_llm_workers, help="LLM calls in flight")
+    parser.add_argument("--batch-wait-ms", type=float, default=20)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--batch-workers", type=int, default=api_batch_workers, help="batches answered at the same time")
+    args = parser.parse_args()
+
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duplicates": args.duplicates,
+        # one question per batch and one batch per client: every request is embedded and retrieved on its own
+        "unbatched": run_load(args, batch_wait=0, max_batch=1, num_workers=args.concurrency),
+        "micro_batched": run_load(args, batch_wait=args.batch_wait_ms / 1000, max_batch=args.max_batch,
+                                  num_workers=args.batch_workers),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# basic imports
+import argparse
+import collections
+import datetime
+import gc
+import hashlib
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# run from the repository root: python benchmarks/bench_pipeline.py --out benchmarks/results/baseline.json
+repository_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_path)
+
+# user defined imports
+import ingest
+import model
+from benchmarks.synthetic import write_dataset, HashEmbeddings, FakeChatLLM
+from utils.compliance import extract, calc_compliance
+from utils.csv_reader import read_csv
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_pipeline import embed_in_batches, batched
+from utils.migrate import iter_apply_nlp, parse_airtable
+from utils.nlp import load_nlp
+from utils.rfp_processor import answer_rows, write_response_file, append_to_history
+
+# every stage of the app on synthetic data, with HashEmbeddings and FakeChatLLM in place of the OpenAI API,
+# the report of one run can be compared with an earlier one with benchmarks/compare_reports.py
+megabyte = 1024 * 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repository_path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRecorder:
+    """
+    Runs the stages one after the other and records their time and, with tracemalloc on, the peak
+    of memory allocated by the stage on top of what was allocated before it.
+    """
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        if trace_memory:
+            tracemalloc.start()
+
+    def run(self, name, function):
+        # function returns (result, number of items the stage worked on)
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result, items = function()
+        seconds = time.perf_counter() - started
+        stage = {"seconds": round(seconds, 4), "items": items,
+                 "items_per_second": round(items / seconds, 2) if seconds else None}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stage["peak_mb"] = round((peak - before) / megabyte, 3)
+            stage["retained_mb"] = round((current - before) / megabyte, 3)
+        self.stages[name] = stage
+        print(f"{name}: {stage}", file=sys.stderr)
+        return result
+
+    def skip(self, name, reason):
+        self.stages[name] = {"skipped": reason}
+        print(f"{name}: skipped, {reason}", file=sys.stderr)
+
+
+def run_pipeline(args, workspace):
+    write_dataset(workspace, args.pages, args.page_sentences, args.records, args.prompts, seed=args.seed)
+    # every relative path of the app (chroma_persist, cache, responses) ends up in the workspace
+    os.chdir(workspace)
+    os.makedirs("responses", exist_ok=True)
+
+    embedding_function = CachedEmbeddings(
+        HashEmbeddings(args.dimension, args.embed_call_ms / 1000, args.embed_text_ms / 1000),
+        model_name=f"hash-{args.dimension}")
+    ingest.load_embedding_function = lambda: embedding_function
+    model.load_embedding_function = lambda: embedding_function
+    model.load_llm = lambda *_args, **_kwargs: FakeChatLLM(call_seconds=args.llm_ms / 1000)
+
+    recorder = StageRecorder(args.memory)
+
+    # Airtable requirements to statements, written to airtable.json like sync_airtable() does
+    with open(os.path.join("Airtable_data", "records.json")) as file:
+        records = json.load(file)
+    try:
+        load_nlp()
+    except OSError as error:
+        # airtable.json keeps the statements write_dataset() made without spaCy
+        recorder.skip("nlp", f"the spaCy pipeline can't be loaded ({error.__class__.__name__})")
+    else:
+        recorder.run("nlp", lambda: (parse_airtable(iter_apply_nlp(records), ingest.airtable_file_path), len(records)))
+
+    def load():
+        documents = list(ingest.iter_documents([ingest.manual_file_path, ingest.airtable_file_path]))
+        return documents, len(documents)
+
+    documents = recorder.run("load", load)
+
+    def split():
+        chunks = list(ingest.iter_chunks(documents, ingest.load_text_splitter()))
+        return chunks, len(chunks)
+
+    chunks = recorder.run("split", split)
+
+    def embed():
+        texts = [chunk.page_content for chunk in chunks]
+        batches = ((None, batch) for batch in batched(texts))
+        return None, sum(len(vectors) for _, vectors in embed_in_batches(batches, embedding_function))
+
+    recorder.run("embed", embed)
+
+    def index():
+        # the vectors are cached by the embed stage, this is chroma, the BM25 index and, with RFP_VECTOR_BACKEND=numpy, the numpy index
+        db = ingest.build_store(chunks, os.path.join(ingest.chromadb_path, "bench"), embedding_function)
+        return db, len(chunks)
+
+    db = recorder.run("index", index)
+    rows = read_csv(os.path.join("rfps", "rfp_0.csv"))
+
+    def retrieve():
+        retriever = model.get_qa_chain(db).retriever
+        queries = list(dict.fromkeys(rows))
+        for query in queries:
+            retriever.get_relevant_documents(query)
+        return None, len(queries)
+
+    recorder.run("retrieve", retrieve)
+    history_file_path = os.path.join("responses", "history.csv")
+
+    def answer():
+        answered = dict(answer_rows(rows, db, history_file_path))
+        return [answered[row_index] for row_index in range(len(rows))], len(rows)
+
+    responses = recorder.run("answer", answer)
+
+    def extract_all():
+        short_responses = [extract(response_data["result"]) for response_data in responses]
+        return calc_compliance(short_responses), len(short_responses)
+
+    compliance_score = recorder.run("extract", extract_all)
+
+    def write():
+        write_response_file(responses, os.path.join("responses", "bench_responses.csv"))
+        append_to_history(responses, history_file_path)
+        return None, len(responses)
+
+    recorder.run("write", write)
+
+    # the same settings must give the same answers, a different hash means the outputs changed
+    answers_hash = hashlib.sha256()
+    for response_data in responses:
+        answers_hash.update(f"{response_data['query']}\x00{response_data['result']}\x00".encode("utf-8"))
+    return {
+        "stages": recorder.stages,
+        "chunks": len(chunks),
+        "routes": dict(collections.Counter(response_data.get("route") or "llm" for response_data in responses)),
+        "compliance_score": round(compliance_score[0], 2),
+        "answers_sha256": answers_hash.hexdigest(),
+    }
+
+
+def merge_stages(runs):
+    # the median time and the largest memory peak of every stage over the runs
+    stages = {}
+    for name, stage in runs[0].items():
+        if "skipped" in stage:
+            stages[name] = stage
+            continue
+        seconds = statistics.median(run[name]["seconds"] for run in runs)
+        stages[name] = dict(stage, seconds=round(seconds, 4),
+                            items_per_second=round(stage["items"] / seconds, 2) if seconds else None)
+        for key in ("peak_mb", "retained_mb"):
+            if key in stage:
+                stages[name][key] = max(run[name][key] for run in runs)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the app on synthetic data without any API")
+    parser.add_argument("--name", default="bench", help="name of the run in the report")
+    parser.add_argument("--out", help="write the JSON report to this file as well")
+    parser.add_argument("--pages", type=int, default=200, help="manual pages")
+    parser.add_argument("--page-sentences", type=int, default=40)
+    parser.add_argument("--records", type=int, default=1000, help="Airtable records")
+    parser.add_argument("--prompts", type=int, default=200, help="prompts of the RFP file")
+    parser.add_argument("--dimension", type=int, default=256, help="dimension of the fake embeddings")
+    parser.add_argument("--embed-call-ms", type=float, default=0, help="latency of one embedding call")
+    parser.add_argument("--embed-text-ms", type=float, default=0, help="latency per embedded text")
+    parser.add_argument("--llm-ms", type=float, default=0, help="latency of one LLM call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="run the pipeline this many times, report the median stage times")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="don't trace memory, tracemalloc slows the stages down")
+    parser.add_argument("--log-level", default="WARNING", help="level of the app's logs, DEBUG logs every step")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    if args.out:
+        args.out = os.path.abspath(args.out)
+
+    started = time.perf_counter()
+    working_directory = os.getcwd()
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        # every run starts from empty caches and an empty store
+        with tempfile.TemporaryDirectory() as workspace:
+            try:
+                runs.append(run_pipeline(args, workspace))
+            finally:
+                os.chdir(working_directory)
+    results = dict(runs[-1], stages=merge_stages([run["stages"] for run in runs]))
+
+    report = {
+        "name": args.name,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("name", "out", "log_level")},
+        # the RFP_ settings change how the app answers, runs are only comparable with the same ones
+        "environment": {key: value for key, value in sorted(os.environ.items()) if key.startswith("RFP_")},
+        **results,
+        "total_seconds": round(time.perf_counter() - started, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        directory = os.path.dirname(args.out)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# basic imports
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from langchain.vectorstores import Chroma
+
+# run from the repository root: python benchmarks/bench_vector_backends.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# user defined imports
+from ingest import collection_name, get_current_store_path
+from utils.numpy_index import build_numpy_index, load_numpy_index
+
+
+def percentile_ms(timings, percent):
+    return round(float(np.percentile(timings, percent)) * 1000, 3)
+
+
+def timed(function, items):
+    timings = []
+    for item in items:
+        started = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - started)
+    return {"mean_ms": round(float(np.mean(timings)) * 1000, 3), "p50_ms": percentile_ms(timings, 50),
+            "p95_ms": percentile_ms(timings, 95)}
+
+
+def create_synthetic_store(directory_path, num_chunks, dimension, seed=0):
+    # random vectors with the shape of the real store, no embedding API calls needed
+    rng = np.random.default_rng(seed)
+    client = chromadb.PersistentClient(path=directory_path)
+    collection = client.create_collection(collection_name)
+    for start in range(0, num_chunks, 5000):
+        count = min(5000, num_chunks - start)
+        collection.add(
+            ids=[f"chunk-{start + offset}" for offset in range(count)],
+            embeddings=rng.standard_normal((count, dimension)).astype(np.float32).tolist(),
+            documents=[f"synthetic chunk {start + offset}" for offset in range(count)],
+            metadatas=[{"source": "synthetic", "title": ""} for _ in range(count)],
+        )
+    build_numpy_index(collection, directory_path)
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query latency of the chroma and numpy vector backends")
+    parser.add_argument("--store", default=None, help="ingested store to benchmark (default the live version in chroma_persist)")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark a synthetic store with this many chunks instead")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.synthetic:
+        tmp_dir = tempfile.TemporaryDirectory()
+        client = create_synthetic_store(tmp_dir.name, args.synthetic, args.dimension)
+        store_path = tmp_dir.name
+    else:
+        store_path = args.store or get_current_store_path()
+        client = chromadb.PersistentClient(path=store_path)
+
+    started = time.perf_counter()
+    index = load_numpy_index(store_path)
+    load_seconds = time.perf_counter() - started
+    if index is None:
+        sys.exit(f"No numpy index in {store_path}, run ingest.py with RFP_VECTOR_BACKEND=numpy first")
+    db = Chroma(client=client, collection_name=collection_name)
+
+    # perturbed stored vectors stand in for query embeddings
+    rng = np.random.default_rng(1)
+    rows = rng.integers(0, len(index), args.queries)
+    queries = np.asarray(index.vectors[rows]) + rng.normal(0, 0.01, (args.queries, index.vectors.shape[1])).astype(np.float32)
+    query_lists = queries.tolist()
+
+    def numpy_mmr(query):
+        candidates, _ = index.search(query, args.fetch_k)
+        index.mmr(query, candidates[0], args.k)
+
+    def numpy_batched(batch):
+        candidates, _ = index.search(batch, args.fetch_k)
+        for query, rows in zip(batch, candidates):
+            index.mmr(query, rows, args.k)
+
+    started = time.perf_counter()
+    numpy_batched(queries)
+    batched_seconds = time.perf_counter() - started
+
+    report = {
+        "chunks": len(index),
+        "dimension": int(index.vectors.shape[1]),
+        "queries": args.queries,
+        "numpy_load_ms": round(load_seconds * 1000, 3),
+        "chroma_top_k": timed(lambda query: db._collection.query(query_embeddings=[query], n_results=args.k), query_lists),
+        "numpy_top_k": timed(lambda query: index.search(query, args.k), queries),
+        "chroma_mmr": timed(lambda query: db.max_marginal_relevance_search_by_vector(query, k=args.k, fetch_k=args.fetch_k), query_lists),
+        "numpy_mmr": timed(numpy_mmr, queries),
+        "numpy_mmr_batched_ms_per_query": round(batched_seconds * 1000 / args.queries, 3),
+    }
+    print(json.dumps(report, indent=2))
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
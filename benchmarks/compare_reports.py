@@ -0,0 +1,72 @@
+# basic imports
+import argparse
+import json
+import sys
+
+# compares two reports of benchmarks/bench_pipeline.py stage by stage, exits with 1 on a regression:
+#   python benchmarks/compare_reports.py benchmarks/results/baseline.json new.json
+
+
+def load_report(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def change(before, after):
+    return (after - before) / before if before else 0.0
+
+
+def compare(baseline, candidate, threshold, min_seconds, min_mb):
+    """
+    Returns (lines, regressions): one line per stage and metric, and the lines of the stages that got
+    slower or allocate more than threshold (a share, 0.2 is 20%) and by more than the noise floor.
+    """
+    lines = []
+    regressions = []
+    for name, before in baseline["stages"].items():
+        after = candidate["stages"].get(name)
+        if after is None or "skipped" in before or "skipped" in after:
+            lines.append(f"{name:10} not compared (skipped or missing in one of the reports)")
+            continue
+        for metric, floor in (("seconds", min_seconds), ("peak_mb", min_mb)):
+            if metric not in before or metric not in after:
+                continue
+            relative = change(before[metric], after[metric])
+            line = f"{name:10} {metric:8} {before[metric]:>10.3f} -> {after[metric]:>10.3f} ({relative:+.1%})"
+            if relative > threshold and after[metric] - before[metric] > floor:
+                line += "  REGRESSION"
+                regressions.append(line)
+            lines.append(line)
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports and fail on regressions")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown or memory growth, 0.25 is 25%%")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="smaller slowdowns are noise")
+    parser.add_argument("--min-mb", type=float, default=1.0, help="smaller memory growth is noise")
+    args = parser.parse_args()
+
+    baseline = load_report(args.baseline)
+    candidate = load_report(args.candidate)
+    # reports of different settings measure different work
+    for key in ("settings", "environment"):
+        if baseline.get(key) != candidate.get(key):
+            print(f"warning: the {key} of the two runs differ", file=sys.stderr)
+    if baseline.get("answers_sha256") != candidate.get("answers_sha256"):
+        print("warning: the answers differ between the two runs", file=sys.stderr)
+
+    lines, regressions = compare(baseline, candidate, args.threshold, args.min_seconds, args.min_mb)
+    print(f"{baseline.get('name')} ({(baseline.get('commit') or '')[:10]}) -> {candidate.get('name')} ({(candidate.get('commit') or '')[:10]})")
+    for line in lines:
+        print(line)
+    if regressions:
+        print(f"{len(regressions)} regressions", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
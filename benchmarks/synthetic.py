@@ -0,0 +1,197 @@
+# basic imports
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+
+# run from the repository root: python benchmarks/synthetic.py --out bench_data
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# synthetic manual, Airtable data and RFP files plus stand-ins for the embedding API and the LLM,
+# everything is derived from a seed so two runs with the same settings get the same data and answers
+
+verbs = ["connect", "track", "export", "import", "schedule", "monitor", "configure", "report", "integrate",
+         "validate", "archive", "notify", "approve", "audit", "synchronize", "display", "calculate", "record"]
+nouns = ["work orders", "equipment", "operators", "ERP data", "XML files", "production lines", "batches",
+         "quality checks", "maintenance tasks", "dashboards", "inventory", "shift reports", "alarms",
+         "user roles", "recipes", "labels", "sensors", "training records", "documents", "KPIs"]
+qualifiers = ["in real time", "across sites", "with an audit trail", "through the REST API", "per shift",
+              "for every station", "without custom code", "from the mobile app", "by role", "on a schedule"]
+
+
+def make_requirement(rng):
+    return f"{rng.choice(verbs)} {rng.choice(nouns)} {rng.choice(qualifiers)}"
+
+
+def make_sentence(rng):
+    return f"ION can {make_requirement(rng)}, and administrators {rng.choice(verbs)} {rng.choice(nouns)} {rng.choice(qualifiers)}."
+
+
+def make_manual(num_pages, page_sentences, seed=0):
+    # pages in the shape crawl_manual() writes to manual.json
+    rng = random.Random(seed)
+    pages = []
+    for number in range(num_pages):
+        paragraphs = []
+        for _ in range(max(1, page_sentences // 5)):
+            paragraphs.append(" ".join(make_sentence(rng) for _ in range(5)))
+        pages.append({
+            "page_content": "\n\n".join(paragraphs),
+            "metadata": {"source": f"https://docs.example.com/ion/page-{number}", "title": f"Page {number}"},
+        })
+    return pages
+
+
+def make_airtable_records(num_records, seed=0):
+    # raw records in the shape the Airtable API returns, about two thirds of them are opted in
+    rng = random.Random(seed + 1)
+    records = []
+    for number in range(num_records):
+        fields = {"Requirement": make_requirement(rng)}
+        if rng.random() < 0.66:
+            fields["Opt In"] = True
+        records.append({"id": f"rec{number:08d}", "fields": fields})
+    return records
+
+
+def make_airtable_statements(records):
+    # the processed statements without spaCy, the verb is always the first word of a requirement
+    for record in records:
+        if record["fields"].get("Opt In") is not None:
+            yield f"ION does {record['fields']['Requirement']}"
+        else:
+            yield f"ION does not {record['fields']['Requirement']}"
+
+
+def make_prompts(num_prompts, records, duplicate_share=0.2, airtable_share=0.2, seed=0):
+    # new requirements, requirements already in Airtable and repeats of earlier rows of the file
+    rng = random.Random(seed + 2)
+    prompts = []
+    for _ in range(num_prompts):
+        draw = rng.random()
+        if prompts and draw < duplicate_share:
+            prompts.append(rng.choice(prompts))
+        elif records and draw < duplicate_share + airtable_share:
+            prompts.append(rng.choice(records)["fields"]["Requirement"])
+        else:
+            prompts.append(make_requirement(rng))
+    return prompts
+
+
+def write_rfp_csv(prompts, file_path):
+    # the format read_csv() expects: a header, then one prompt per row ending with a comma
+    with open(file_path, "w", newline="") as file:
+        file.write("prompt\n")
+        for prompt in prompts:
+            file.write(f"{prompt},\n")
+
+
+def write_json(data, file_path):
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump(data, file)
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words vectors: every word is hashed to one of dimension buckets, so texts
+    that share words get similar vectors and retrieval, dedup and the cascade behave like they do
+    with real embeddings. Every call sleeps call_seconds plus text_seconds per text.
+    """
+
+    def __init__(self, dimension=256, call_seconds=0.0, text_seconds=0.0):
+        self.dimension = dimension
+        self.call_seconds = call_seconds
+        self.text_seconds = text_seconds
+        self.buckets = {}
+
+    def bucket(self, word):
+        if word not in self.buckets:
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            self.buckets[word] = (int.from_bytes(digest[:4], "little") % self.dimension, 1.0 if digest[4] & 1 else -1.0)
+        return self.buckets[word]
+
+    def vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            index, sign = self.bucket(word)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.call_seconds + self.text_seconds * len(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatLLM(LLM):
+    """
+    Answers every prompt after call_seconds with a Yes or No that depends only on the question, not
+    on the retrieved context, whose order can change from run to run with the order of the chroma inserts.
+    """
+
+    call_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None,
+              **kwargs: Any) -> str:
+        time.sleep(self.call_seconds)
+        question = prompt.rsplit("Question:", 1)[-1]
+        if hashlib.blake2b(question.encode("utf-8"), digest_size=1).digest()[0] % 3:
+            text = "Yes, according to the manual the software supports this."
+        else:
+            text = "No, the manual does not mention this."
+        if run_manager is not None:
+            for token in text.split(" "):
+                run_manager.on_llm_new_token(token + " ")
+        return text
+
+
+def write_dataset(out_dir, num_pages, page_sentences, num_records, num_prompts, num_files=1, seed=0):
+    # manual.json, the raw Airtable records, airtable.json (processed without spaCy) and RFP files
+    pages = make_manual(num_pages, page_sentences, seed)
+    records = make_airtable_records(num_records, seed)
+    write_json(pages, os.path.join(out_dir, "ION-manual", "manual.json"))
+    write_json(records, os.path.join(out_dir, "Airtable_data", "records.json"))
+    statements = [{"page_content": statement, "metadata": {"source": "", "title": "Airtable data"}}
+                  for statement in make_airtable_statements(records)]
+    write_json(statements, os.path.join(out_dir, "Airtable_data", "airtable.json"))
+    os.makedirs(os.path.join(out_dir, "rfps"), exist_ok=True)
+    for number in range(num_files):
+        prompts = make_prompts(num_prompts, records, seed=seed + number)
+        write_rfp_csv(prompts, os.path.join(out_dir, "rfps", f"rfp_{number}.csv"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic manual, Airtable data and RFP files")
+    parser.add_argument("--out", required=True, help="directory laid out like the repository's data directories")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--page-sentences", type=int, default=40)
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--prompts", type=int, default=200, help="prompts per RFP file")
+    parser.add_argument("--files", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_dataset(args.out, args.pages, args.page_sentences, args.records, args.prompts, args.files, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 # basic imports
+import fcntl
 import json
+import hashlib
 import os
 import shutil
 import logging
+import threading
+import time
+import datetime
+import weakref
+from contextlib import contextmanager
+from functools import lru_cache
 import chromadb
 
 # langchain imports
-from langchain.document_loaders import GitbookLoader
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -17,92 +24,676 @@ from dotenv import load_dotenv
 
 # user defined imports
 from utils.migrate import process_airtable
+from utils.gitbook_crawler import crawl_manual
+from utils.bm25 import BM25Builder, load_bm25_index
+from utils.numpy_index import build_numpy_index, load_numpy_index, remove_numpy_index, vector_backend
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_pipeline import embed_in_batches, batched
 
 # setting configs
 load_dotenv()
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
 
-def clear_chromadb(directory_path):
-    # clear all files in the directory
-    for root, dirs, files in os.walk(directory_path, topdown=False):
-        logging.info("clearing chromadb...")
-        for file_name in files:
-            logging.info("clearing files...")
-            file_path = os.path.join(root, file_name)
-            os.remove(file_path)
-        for dir_name in dirs:
-            logging.info("clearing sqlite")
-            dir_path = os.path.join(root, dir_name)
-            shutil.rmtree(dir_path)
-
-
-def get_or_create_chromadb(file_path, collection_name, documents, embedding_function):
-
-    # the directory is empty, create a new chromadb
-    if not os.listdir(file_path):
-        logging.info("Creating the chroma vector DB...")
-        db = Chroma.from_documents(
-            documents=documents,
-            embedding=embedding_function,
-            collection_name=collection_name,
-            persist_directory=file_path,
-        )
+# common file paths
+manual_file_path = "ION-manual/manual.json"
+airtable_file_path = "Airtable_data/airtable.json"
+chromadb_path = "chroma_persist"
+collection_name = "ion-manual"
+manifest_file_name = "manifest.json"
+# chunks added and removed since the manifest was last saved, one JSON line per finished batch
+manifest_log_file_name = "manifest.log"
+# every ingest builds a new version directory inside chromadb_path, this file names the one queries use
+current_version_file_name = "CURRENT"
+# when every version stopped being live, old versions are removed a while after that
+retired_versions_file_name = "RETIRED"
+# store version a version directory is built for, an interrupted ingest of the same data continues in that directory
+target_version_file_name = "TARGET"
+# locked while a version directory is built, so no other process continues or removes it meanwhile
+build_lock_file_name = "BUILD.lock"
+# versions that stopped being live less than this many hours ago are kept, jobs and API batches of this
+# or another process (the app, the command line, the API) may still be reading them
+store_version_retention_hours = float(os.environ.get("RFP_STORE_VERSION_RETENTION_HOURS", 24))
+# "openai" or "huggingface", switching re-embeds the whole corpus since the vectors are not comparable
+embedding_backend = os.environ.get("RFP_EMBEDDINGS", "openai")
+huggingface_embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+# number of chunks deleted from chroma at once
+ingest_batch_size = 256
+# a stored vector queried against a new store version has to come back this close to itself
+smoke_test_max_distance = 1e-4
+
+# (path, size, mtime) of the ingested files -> corpus version, so the files are only hashed when they change
+corpus_version_cache = {}
+# (path, mtime) of the manifest -> store version, so the manifest is only read when it changes
+store_version_cache = {}
+
+# process-level handle to the vector store shared by every streamlit session: (store version, db)
+# it's replaced as a whole after an ingest, so readers never need a lock
+vector_store = None
+vector_store_lock = threading.RLock()
+# every store handle opened by this process, the versions they were opened on are never removed
+open_store_handles = weakref.WeakSet()
+# only one ingest at a time
+ingest_lock = threading.Lock()
+# thread that builds a new store version when get_vector_store() finds the data files changed
+background_ingest = None
+# a failed background ingest is retried after this many seconds, not on every call
+background_ingest_retry_interval = 60
+background_ingest_failed_at = None
+# number of "Parse Data" runs rewriting the data files, no background ingest is started meanwhile
+data_updates = 0
+data_updates_lock = threading.Lock()
+
+
+def get_corpus_version(file_paths=(manual_file_path, airtable_file_path)):
+    # hash of the ingested manual and airtable data, changes whenever either file is re-parsed
+    stats = tuple((path, os.path.getsize(path), os.path.getmtime(path)) for path in file_paths)
+    if stats not in corpus_version_cache:
+        corpus_hash = hashlib.sha256()
+        for path in file_paths:
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    corpus_hash.update(block)
+        corpus_version_cache.clear()
+        corpus_version_cache[stats] = corpus_hash.hexdigest()
+    return corpus_version_cache[stats]
+
+
+@lru_cache(maxsize=None)
+def load_embedding_function():
+    # vectors are cached on disk per model, so rebuilding the db does not embed the same text twice
+    if embedding_backend == "huggingface":
+        # for the local llama version, runs on the CPU without an API key
+        embedding_function = HuggingFaceEmbeddings(model_name=huggingface_embedding_model)
+        return CachedEmbeddings(embedding_function, model_name=f"huggingface-{huggingface_embedding_model}")
+
+    # OpenAI's model works best with OpenAI's embedding
+    embedding_function = OpenAIEmbeddings(openai_api_key=os.environ["OPENAI_API_KEY"])
+    return CachedEmbeddings(embedding_function, model_name=f"openai-{embedding_function.model}")
+
+
+def get_current_store_path(directory_path=chromadb_path):
+    # directory of the live store version, the store files directly in directory_path are the layout before versioning
+    try:
+        with open(os.path.join(directory_path, current_version_file_name), "r") as file:
+            version_name = file.read().strip()
+    except FileNotFoundError:
+        return directory_path
+    return os.path.join(directory_path, version_name) if version_name else directory_path
+
+
+def set_current_store_version(directory_path, version_name):
+    # os.replace() is atomic, readers see either the old version or the new one, never a half-written pointer
+    current_path = os.path.join(directory_path, current_version_file_name)
+    tmp_path = current_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        file.write(version_name)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, current_path)
+
+
+def lock_store_version(version_path):
+    # returns the open lock file, closing it releases the lock; None if another build holds it
+    lock_file = open(os.path.join(version_path, build_lock_file_name), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def read_target_version(version_path):
+    try:
+        with open(os.path.join(version_path, target_version_file_name), "r") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def find_unfinished_store_versions(directory_path, version):
+    # versions that were never live and were built for version, newest first
+    current_path = os.path.abspath(get_current_store_path(directory_path))
+    retired = load_retired_versions(directory_path)
+    names = []
+    for name in sorted(os.listdir(directory_path), reverse=True):
+        path = os.path.join(directory_path, name)
+        if not name.startswith("v") or not os.path.isdir(path) or name in retired:
+            continue
+        if os.path.abspath(path) != current_path and read_target_version(path) == version:
+            names.append(name)
+    return names
+
+
+def create_store_version(directory_path=chromadb_path, version=None):
+    """
+    Create the directory of a new store version as a copy of the live one, so the ingest only has to
+    embed the chunks that changed while queries keep reading the live version. If an earlier ingest
+    of the same version failed, its directory is used instead and the ingest continues from the
+    checkpoints in its manifest log.
+    Returns (version name, version path, build lock), close the build lock once the version is live.
+    """
+    os.makedirs(directory_path, exist_ok=True)
+    if version is not None:
+        for version_name in find_unfinished_store_versions(directory_path, version):
+            version_path = os.path.join(directory_path, version_name)
+            build_lock = lock_store_version(version_path)
+            # another process may be building it right now
+            if build_lock is None:
+                continue
+            logging.info(f"Continuing the unfinished vector store version {version_path}")
+            # the retention of leftovers counts from their last use
+            os.utime(version_path)
+            return version_name, version_path, build_lock
+
+    version_name = datetime.datetime.now().strftime("v%Y%m%d%H%M%S%f")
+    version_path = os.path.join(directory_path, version_name)
+    current_path = get_current_store_path(directory_path)
+    if os.path.exists(os.path.join(current_path, manifest_file_name)):
+        logging.info(f"Copying the vector store from {current_path} to {version_path}")
+        # the unversioned layout keeps its files next to the version directories, only copy the store itself
+        ignore = shutil.ignore_patterns("v[0-9]*", current_version_file_name + "*", retired_versions_file_name + "*",
+                                        target_version_file_name, build_lock_file_name)
+        shutil.copytree(current_path, version_path, ignore=ignore)
     else:
-        logging.info("DB already exists, creating an instance from it")
-        # if the db already exists create a Chroma instance from a collection
-        client = chromadb.PersistentClient(path=file_path)
-        db = Chroma(
-            client=client,
-            collection_name=collection_name,
-            embedding_function=embedding_function
-        )
+        os.makedirs(version_path)
+    build_lock = lock_store_version(version_path)
+    if version is not None:
+        with open(os.path.join(version_path, target_version_file_name), "w") as file:
+            file.write(version)
+    return version_name, version_path, build_lock
+
+
+def reuse_live_store_version(documents, embedding_function, version, directory_path=chromadb_path):
+    """
+    When documents are exactly the chunks of the live version (e.g. the data was parsed again and
+    nothing changed), record version in the live manifest instead of copying the store.
+    Returns the live store, or None if a new version has to be built.
+    """
+    current_path = get_current_store_path(directory_path)
+    manifest = load_manifest(current_path)
+    if manifest is None or manifest.get("collection") != collection_name:
+        return None
+    if manifest.get("embedding_model") != getattr(embedding_function, "model_name", None):
+        return None
+    if load_bm25_index(current_path) is None or (vector_backend == "numpy" and load_numpy_index(current_path) is None):
+        return None
+    chunk_ids = set(chunk_id for chunk_id, _, _ in iter_chunk_ids(documents))
+    if chunk_ids != set(manifest["chunks"]):
+        return None
+    logging.info(f"No chunk changed, {current_path} stays the live vector store version")
+    manifest["version"] = version
+    save_manifest(current_path, manifest)
+    current = vector_store
+    if current is not None and os.path.abspath(get_store_path(current[1])) == os.path.abspath(current_path):
+        db = current[1]
+    else:
+        db = open_vector_store(current_path)
+    publish_vector_store(version, db)
     return db
 
 
-def create_docs_from_json(json_objects_list):
+def check_store_version(db, version_path):
+    # smoke test before the new version goes live: a stored vector has to find itself, the indexes have to load
+    stored = db._collection.get(limit=1, include=["embeddings", "documents"])
+    if not stored["ids"]:
+        raise RuntimeError(f"The new vector store in {version_path} is empty")
+    # identical chunks (repeated footers, duplicate Airtable statements) have identical vectors and any of
+    # them can come back first, so look for the stored id among the top results or for the same text at distance 0
+    result = db._collection.query(query_embeddings=[stored["embeddings"][0]], n_results=min(10, db._collection.count()),
+                                  include=["documents", "distances"])
+    found = stored["ids"][0] in result["ids"][0] or (
+        result["documents"][0][0] == stored["documents"][0] and result["distances"][0][0] <= smoke_test_max_distance)
+    if not found:
+        raise RuntimeError(f"The smoke query against the new vector store in {version_path} failed")
+    if load_bm25_index(version_path) is None or (vector_backend == "numpy" and load_numpy_index(version_path) is None):
+        raise RuntimeError(f"The indexes of the new vector store in {version_path} can't be loaded")
+
+
+def load_retired_versions(directory_path):
+    # version name ("" for the unversioned layout) -> time it stopped being live
+    try:
+        with open(os.path.join(directory_path, retired_versions_file_name), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_retired_versions(directory_path, retired):
+    retired_path = os.path.join(directory_path, retired_versions_file_name)
+    tmp_path = retired_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(retired, file)
+    os.replace(tmp_path, retired_path)
+
+
+def retire_store_version(directory_path, version_name):
+    retired = load_retired_versions(directory_path)
+    retired[version_name] = time.time()
+    save_retired_versions(directory_path, retired)
+
+
+def store_versions_in_use(directory_path):
+    # names of the versions the store handles of this process were opened on, "" for the unversioned layout
+    root = os.path.abspath(directory_path)
+    names = set()
+    for db in list(open_store_handles):
+        name = os.path.relpath(os.path.abspath(get_store_path(db)), root)
+        names.add("" if name == "." else name)
+    return names
+
+
+def remove_old_store_versions(directory_path, live_name, retention_hours=store_version_retention_hours):
+    """
+    Remove the versions that stopped being live more than retention_hours ago and the leftovers of
+    interrupted ingests, except the versions store handles of this process are still open on.
+    A version another process is still reading is covered by the retention time.
+    """
+    now = time.time()
+    retired = load_retired_versions(directory_path)
+    in_use = store_versions_in_use(directory_path)
+
+    def removable(name, path):
+        if name == live_name or name in in_use:
+            return False
+        # a version that was never live is left over from an interrupted ingest, or is being built right now
+        retired_at = retired.get(name)
+        if retired_at is None:
+            retired_at = os.path.getmtime(path) if os.path.exists(path) else 0
+        return now - retired_at > retention_hours * 3600
+
+    # the files of the unversioned layout stay until the unversioned store can be removed as a whole
+    remove_unversioned = removable("", os.path.join(directory_path, manifest_file_name))
+    removed = []
+    for name in sorted(os.listdir(directory_path)):
+        path = os.path.join(directory_path, name)
+        if name.startswith(current_version_file_name) or name.startswith(retired_versions_file_name):
+            continue
+        build_lock = None
+        if name.startswith("v") and os.path.isdir(path):
+            if not removable(name, path):
+                continue
+            # a version another process is still building (or continuing) stays
+            build_lock = lock_store_version(path)
+            if build_lock is None:
+                continue
+            removed.append(name)
+        elif not remove_unversioned:
+            continue
+        logging.info(f"Removing the old vector store version {path}")
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        if build_lock is not None:
+            build_lock.close()
+    if remove_unversioned:
+        removed.append("")
+    if any(name in retired for name in removed):
+        save_retired_versions(directory_path, {name: retired_at for name, retired_at in retired.items() if name not in removed})
+
+
+def load_manifest(directory_path):
+    # the manifest records which chunks (id -> source and content hash) are stored in the collection
+    manifest_path = os.path.join(directory_path, manifest_file_name)
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # replay the checkpoints of an ingest that was interrupted before it saved the manifest
+    try:
+        with open(os.path.join(directory_path, manifest_log_file_name), "r") as file:
+            for line in file:
+                # the last line may be cut short by the interruption
+                if not line.endswith("\n"):
+                    break
+                checkpoint = json.loads(line)
+                manifest["chunks"].update(checkpoint["added"])
+                for chunk_id in checkpoint["removed"]:
+                    manifest["chunks"].pop(chunk_id, None)
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def append_manifest_checkpoint(directory_path, added=None, removed=None):
+    # a checkpoint costs the size of its batch, not of the whole manifest
+    with open(os.path.join(directory_path, manifest_log_file_name), "a") as file:
+        file.write(json.dumps({"added": added or {}, "removed": removed or []}) + "\n")
+
+
+def save_manifest(directory_path, manifest):
+    # write to a temporary file first so a crash never leaves a half-written manifest behind
+    manifest_path = os.path.join(directory_path, manifest_file_name)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+    # the saved manifest includes every checkpoint, replaying them again would change nothing
+    try:
+        os.remove(os.path.join(directory_path, manifest_log_file_name))
+    except FileNotFoundError:
+        pass
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_chunk_ids(documents):
+    """
+    Give every chunk a stable id derived from its source and content, so the same chunk gets the
+    same id on every ingest no matter where it appears in the files. Identical chunks of the same
+    source are told apart by their occurrence count.
+    Yields (id, document, content hash) in document order.
+    """
+    occurrences = {}
+    for doc in documents:
+        chunk_hash = content_hash(doc.page_content)
+        base = f"{doc.metadata.get('source', '')}\x00{doc.metadata.get('title', '')}\x00{chunk_hash}"
+        base_id = hashlib.sha1(base.encode("utf-8")).digest()
+        occurrence = occurrences.get(base_id, 0)
+        occurrences[base_id] = occurrence + 1
+        chunk_id = hashlib.sha1(f"{base}\x00{occurrence}".encode("utf-8")).hexdigest()
+        yield chunk_id, doc, chunk_hash
 
-    # create document objects from json objects
-    raw_documents = []
-    for obj in json_objects_list:
-        raw_documents.append(
-            Document(page_content=obj["page_content"], metadata=obj["metadata"])
+
+def get_or_create_chromadb(file_path, collection_name, documents, embedding_function, progress_callback=None, on_chunk=None,
+                           version=None):
+    """
+    Open the chroma collection and bring it in sync with documents: only chunks that are not in the
+    collection yet are embedded and added, chunks that are no longer in the documents are removed.
+    documents can be any iterable of chunks (e.g. a generator), it is read once and only one batch
+    of new chunks per embedding worker is held in memory.
+    on_chunk, if given, is called with (chunk id, document) for every chunk, new or not.
+    version, if given, is recorded in the manifest once the collection is in sync.
+    """
+    os.makedirs(file_path, exist_ok=True)
+    client = chromadb.PersistentClient(path=file_path)
+    manifest = load_manifest(file_path)
+    embedding_model = getattr(embedding_function, "model_name", None)
+    if manifest is not None and manifest.get("embedding_model", embedding_model) != embedding_model:
+        logging.info("The embedding model changed, rebuilding the chroma vector DB...")
+        manifest = None
+    if manifest is None or manifest.get("collection") != collection_name:
+        # the collection was built without ids we know about (or with another embedding model), rebuild it from scratch
+        logging.info("No ingest manifest found, creating the chroma vector DB...")
+        try:
+            client.delete_collection(collection_name)
+        except ValueError:
+            pass
+        manifest = {"collection": collection_name, "chunks": {}}
+        # the checkpoints of this ingest start from the empty collection
+        save_manifest(file_path, manifest)
+    manifest["embedding_model"] = embedding_model
+
+    db = Chroma(
+        client=client,
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        persist_directory=file_path
+    )
+    open_store_handles.add(db)
+
+    stored_ids = set(manifest["chunks"])
+    seen_ids = set()
+
+    def new_chunks():
+        for chunk_id, doc, chunk_hash in iter_chunk_ids(documents):
+            seen_ids.add(chunk_id)
+            if on_chunk is not None:
+                on_chunk(chunk_id, doc)
+            if chunk_id not in stored_ids:
+                yield chunk_id, doc, chunk_hash
+
+    def new_chunk_batches():
+        for batch in batched(new_chunks()):
+            yield batch, [doc.page_content for _, doc, _ in batch]
+
+    # embed the new chunks in parallel batches and store every batch as soon as it's done
+    new_count = 0
+    for batch, vectors in embed_in_batches(new_chunk_batches(), embedding_function, progress_callback=progress_callback):
+        db._collection.upsert(
+            ids=[chunk_id for chunk_id, _, _ in batch],
+            embeddings=vectors,
+            metadatas=[doc.metadata for _, doc, _ in batch],
+            documents=[doc.page_content for _, doc, _ in batch],
         )
-    return raw_documents
+        # record every finished batch so an interrupted ingest does not embed them again
+        added = {chunk_id: {"source": doc.metadata.get("source", ""), "hash": chunk_hash} for chunk_id, doc, chunk_hash in batch}
+        manifest["chunks"].update(added)
+        append_manifest_checkpoint(file_path, added=added)
+        new_count += len(batch)
+
+    # chunks that were not seen in the documents belong to deleted or changed pages
+    removed_ids = [chunk_id for chunk_id in stored_ids if chunk_id not in seen_ids]
+    for start in range(0, len(removed_ids), ingest_batch_size):
+        batch_ids = removed_ids[start:start + ingest_batch_size]
+        db.delete(ids=batch_ids)
+        for chunk_id in batch_ids:
+            del manifest["chunks"][chunk_id]
+        append_manifest_checkpoint(file_path, removed=batch_ids)
+    logging.info(f"{len(seen_ids)} chunks, {new_count} new or changed, {len(removed_ids)} removed")
+
+    if version is not None:
+        manifest["version"] = version
+    # compact the checkpoints into the manifest once the collection is in sync
+    save_manifest(file_path, manifest)
+    return db
 
 
-def load_from_file(file_path):
-    # load from file and convert to a list of json objects
+def iter_json_objects(file_path, read_size=1 << 16):
+    """
+    Yield the objects of a JSON array file (or a JSON Lines file) one at a time, only one read_size
+    block of the file and the object being decoded are held in memory.
+    """
+    decoder = json.JSONDecoder()
     with open(file_path, "r") as file:
-        json_object_string = file.read()
-        json_object_list = json.loads(json_object_string)
-    return json_object_list
+        buffer = ""
+        position = 0
+        at_end = False
+        in_array = None
+        while True:
+            # skip whitespace and the separators between the objects
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                if at_end:
+                    return
+                buffer = file.read(read_size)
+                position = 0
+                at_end = not buffer
+                continue
+            if in_array is None:
+                in_array = buffer[position] == "["
+                if in_array:
+                    position += 1
+                continue
+            if in_array and buffer[position] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                obj, end = None, None
+            # an object that ends exactly at the end of the buffer may be cut short, read more to be sure
+            if end is None or (end == len(buffer) and not at_end):
+                more = file.read(read_size)
+                if not more:
+                    if end is None:
+                        raise json.JSONDecodeError("Unexpected end of file", buffer, position)
+                    at_end = True
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield obj
+            position = end
+
+
+def iter_documents(file_paths):
+    # create document objects from the json objects of every file, one at a time
+    for file_path in file_paths:
+        for obj in iter_json_objects(file_path):
+            yield Document(page_content=obj["page_content"], metadata=obj["metadata"])
+
+
+def iter_chunks(documents, text_splitter):
+    # split one document at a time, so only the chunks of the current document are in memory
+    for doc in documents:
+        yield from text_splitter.split_documents([doc])
 
 
 def parse_manual(file_path):
-    loader = GitbookLoader("https://manual.company_name.io/", load_all_paths=True)
-    all_pages_data = loader.load()
-    json_list = []
-    for page in all_pages_data:
-        json_object = {
-            "page_content": page.page_content,
-            "metadata": {
-                "source": page.metadata["source"],
-                "title": page.metadata["title"],
-            },
-        }
-        json_list.append(json_object)
-
-    with open(file_path, "w") as file:
-        json.dump(json_list, file)
-
-
-def ingest_docs():
-  
-    openai_api_key = os.environ["OPENAI_API_KEY"]
-    manual_file_path = "ION-manual/manual.json"
-    airtable_file_path = "Airtable_data/airtable.json"
-    chromadb_path = "chroma_persist"
-    collection_name = "ion-manual"
+    # pages are fetched in parallel, pages that did not change since the last crawl are not downloaded again
+    pages = crawl_manual()
+
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(pages, file)
+    os.replace(tmp_path, file_path)
+
+
+def get_expected_store_version():
+    # the store is up to date if it was built from the current data files with the current embedding model
+    return f"{get_corpus_version()}:{load_embedding_function().model_name}"
+
+
+def get_store_version(directory_path=None):
+    # version recorded in the manifest of the live store by the last complete ingest, None if there is none
+    directory_path = directory_path or get_current_store_path()
+    manifest_path = os.path.join(directory_path, manifest_file_name)
+    try:
+        stats = (manifest_path, os.stat(manifest_path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if stats not in store_version_cache:
+        manifest = load_manifest(directory_path) or {}
+        store_version_cache.clear()
+        store_version_cache[stats] = manifest.get("version")
+    return store_version_cache[stats]
+
+
+def open_vector_store(directory_path=None):
+    directory_path = directory_path or get_current_store_path()
+    client = chromadb.PersistentClient(path=directory_path)
+    # persist_directory tells the retrievers where the BM25 and numpy indexes of this version are
+    db = Chroma(client=client, collection_name=collection_name, embedding_function=load_embedding_function(),
+                persist_directory=directory_path)
+    open_store_handles.add(db)
+    return db
+
+
+def get_store_path(db):
+    # directory of the store version db was opened on
+    return getattr(db, "_persist_directory", None) or get_current_store_path()
+
+
+def publish_vector_store(version, db):
+    global vector_store
+    with vector_store_lock:
+        vector_store = (version, db)
+
+
+def get_vector_store(wait_for_ingest=False):
+    """
+    Process-level handle to the vector store, opened once and shared by every session and rerun.
+    Costs two stat calls when nothing changed. When the data files changed since the last ingest,
+    a new store version is built in a background thread and the current handle is returned until
+    the new version is switched in; only when there is no store yet (or wait_for_ingest is set)
+    does the caller wait for the ingest.
+    """
+    expected = get_expected_store_version()
+    current = vector_store
+    if current is not None and current[0] == expected:
+        return current[1]
+    with vector_store_lock:
+        # another session may have opened or ingested the store while this one waited
+        if vector_store is not None and vector_store[0] == expected:
+            return vector_store[1]
+        if get_store_version() == expected:
+            logging.info("Opening the vector store")
+            publish_vector_store(expected, open_vector_store())
+        elif not wait_for_ingest and (vector_store is not None or get_store_version() is not None):
+            # queries keep running on the live version while the new one is built
+            if vector_store is None:
+                logging.info("Opening the vector store")
+                publish_vector_store(get_store_version(), open_vector_store())
+            start_background_ingest()
+        else:
+            logging.info("Ingesting the data")
+            ingest_docs()
+        return vector_store[1]
+
+
+@contextmanager
+def updating_data():
+    # while the data files are rewritten one after another, a background ingest would build a version of half-updated data
+    global data_updates
+    with data_updates_lock:
+        data_updates += 1
+    try:
+        yield
+    finally:
+        with data_updates_lock:
+            data_updates -= 1
+
+
+def start_background_ingest():
+    # one background ingest at a time, an ingest that is already running picks up the latest data when it's done
+    global background_ingest
+    if background_ingest is not None and background_ingest.is_alive():
+        return
+    # the parse ingests the data itself once the files are written
+    if data_updates:
+        return
+    if background_ingest_failed_at is not None and time.monotonic() - background_ingest_failed_at < background_ingest_retry_interval:
+        return
+    logging.info("The vector store is out of date, building a new version in the background")
+    background_ingest = threading.Thread(target=run_background_ingest, daemon=True)
+    background_ingest.start()
+
+
+def run_background_ingest():
+    global background_ingest_failed_at
+    try:
+        ingest_docs()
+        background_ingest_failed_at = None
+    except Exception:
+        logging.exception("The background ingest failed, the live vector store version stays in use")
+        background_ingest_failed_at = time.monotonic()
+
+
+def load_text_splitter():
+    # for llama cpp version chunk_size=600, chunk_overlap=100 work best
+    # start_index (the position of the chunk in its page) lets the context assembly merge neighbouring chunks
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500, chunk_overlap=100, separators=["\n\n", "\n", " ", ""], add_start_index=True
+    )
+
+
+def build_store(documents, directory_path, embedding_function, version=None, progress_callback=None):
+    """
+    Bring the chroma collection in directory_path in sync with documents, build the BM25 and numpy
+    indexes next to it and smoke test the result. Returns the chroma db.
+    """
+    # the BM25 index for hybrid retrieval is built from the same chunks as they stream into chroma
+    bm25_builder = BM25Builder()
+    db = get_or_create_chromadb(collection_name=collection_name, file_path=directory_path, documents=documents,
+                                embedding_function=embedding_function, progress_callback=progress_callback,
+                                on_chunk=lambda chunk_id, doc: bm25_builder.add(chunk_id, doc.page_content),
+                                version=version)
+    bm25_builder.build().save(directory_path)
+    # the same vectors as one memory-mapped matrix for the numpy retriever backend, only when it's used
+    if vector_backend == "numpy":
+        build_numpy_index(db._collection, directory_path)
+    else:
+        remove_numpy_index(directory_path)
+    check_store_version(db, directory_path)
+    return db
+
+
+def ingest_docs(progress_callback=None):
+    # progress_callback, if given, receives status messages while new chunks are being embedded
     # parse the manual only if the file is empty
     if not os.path.getsize(manual_file_path) or not os.path.getsize(airtable_file_path):
         # if the manual file is empty:
@@ -113,40 +704,43 @@ def ingest_docs():
         if not os.path.getsize(airtable_file_path):
             process_airtable(airtable_file_path)
         
-        # clear chromadb to trigger get_or_create_chromadb() to create a new db based on newly parsed manual
-        logging.info("Resetting ChromaDB")
-        clear_chromadb(chromadb_path)
-        logging.info("Cleared ChromaDB")
-
-    # read the manual json file
-    json_object_list = load_from_file(manual_file_path)
-    # load the airtable json file
-    airtable_json_list = load_from_file(airtable_file_path)
-    # concatenate the two lists
-    json_object_list.extend(airtable_json_list)
-    
-    # create a list of Document objects based on the saved json objects
-    # for llama cpp version chunk_size=600, chunk_overlap=100 work best
-    raw_documents = create_docs_from_json(json_object_list)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500, chunk_overlap=100, separators=["\n\n", "\n", " ", ""]
-    )
-    # split the manual into chunks
-    documents = text_splitter.split_documents(raw_documents)
+        # get_or_create_chromadb() only embeds the chunks that changed in the newly parsed data
 
-    # for llama cpp version, use huggingface's embedding
-    # embedding_function = HuggingFaceEmbeddings(
-    #     model_name="sentence-transformers/all-MiniLM-L6-v2"
-    # )
+    def load_documents():
+        # stream the manual and airtable json files as Document objects
+        raw_documents = iter_documents([manual_file_path, airtable_file_path])
+        # split the manual into chunks lazily, get_or_create_chromadb() reads them batch by batch
+        return iter_chunks(raw_documents, load_text_splitter())
 
-    # OpenAI's model works best with OpenAI's embedding
-    embedding_function = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    embedding_function = load_embedding_function()
+    version = get_expected_store_version()
 
-    # create the db only if it's not already saved to the disk
-    # if you need to save updated data in the db and reset it, delete the two files inside the chroma_persist directory and run ingest.py
-    db = get_or_create_chromadb(collection_name=collection_name, file_path=chromadb_path, documents=documents,
-                                embedding_function=embedding_function)
-    logging.info("Finished creating the chroma vector DB...")
+    # only new or changed chunks are embedded, chunks of deleted pages are removed
+    # the new version is built next to the live one, queries keep using the live version until the switch
+    with ingest_lock:
+        # the files were written again without a change to the chunks, there is nothing to copy or embed
+        db = reuse_live_store_version(load_documents(), embedding_function, version)
+        if db is not None:
+            return db
+        previous_path = get_current_store_path()
+        version_name, version_path, build_lock = create_store_version(chromadb_path, version)
+        try:
+            try:
+                db = build_store(load_documents(), version_path, embedding_function, version=version,
+                                 progress_callback=progress_callback)
+            except Exception:
+                # the next ingest of the same data continues in version_path from its checkpoints
+                logging.exception(f"Building the vector store version {version_name} failed, keeping the live version")
+                raise
+            set_current_store_version(chromadb_path, version_name)
+            logging.info(f"Switched the vector store to {version_name}")
+            # sessions pick up the new store on their next get_vector_store() call
+            publish_vector_store(version, db)
+        finally:
+            build_lock.close()
+        previous_name = os.path.relpath(previous_path, chromadb_path)
+        retire_store_version(chromadb_path, "" if previous_name == "." else previous_name)
+        remove_old_store_versions(chromadb_path, version_name)
     # # uncomment the following for testing purposes
     # docs = db.similarity_search(
     #     query="login to MES for accountability and tracking",
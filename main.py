@@ -1,6 +1,5 @@
 # basic imports
 import datetime
-import csv
 import os.path
 import time
 import shutil
@@ -15,11 +14,13 @@ from streamlit_elements import elements, mui, nivo
 
 
 # user defined imports
-from ingest import ingest_docs, parse_manual
-from model import generate_response
+from ingest import ingest_docs, get_vector_store, parse_manual, updating_data
 from utils.csv_reader import read_csv
-from utils.response_analysis import extract, calc_compliance, create_piechart
+from utils.response_analysis import extract, extract_partial, calc_compliance, create_piechart
 from utils.input_file_cleanup import input_apply_nlp
+from utils.migrate import sync_airtable
+from utils.jobs import start_job_runner, submit_job, resume_job, get_job, get_job_responses, get_partial_answers
+from utils.rfp_processor import write_response_file
 
 # setting configs
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
@@ -34,42 +35,25 @@ response_folder_path = "responses"
 history_file_path=os.path.join(response_folder_path, "history.csv")
 manual_file_path = "ION-manual/manual.json"
 airtable_file_path = "Airtable_data/airtable.json"
+# seconds between two looks at the progress of a running job
+job_poll_interval = 0.5
 
 
 
-def append_to_csv(file_path, data):
-    with open(file_path, mode='a', newline='') as f:
-        writerr = csv.writer(f)
-        writerr.writerow(data)
-    f.close()
-
-def is_history_empty(history_file_path):
-    history_is_empty=True
-    try:
-        with open(history_file_path, 'r', newline='') as file:
-            csv_reader = csv.reader(file)
-            first_row = next(csv_reader)
-            # Check if the first row contains strings (header)
-            if len(first_row)!=0 and first_row[0].replace(" ","") != "":
-                history_is_empty = False
-    except (FileNotFoundError, StopIteration):
-        history_is_empty=True
-
-    file.close()
-    return history_is_empty
-
-
 def parse_manual_airtable():
     
     logging.info("Parsing manual and airtable")
     placeholder = st.empty()
-    # clear manual and airtable so that when ingest_docs() is called, it will detect files are empty and will call parsers
-    with open(manual_file_path, 'w') as file:
-        pass
-    file.close()
-    with open(airtable_file_path, 'w') as file:
-        pass
-    ingest_docs()
+    # jobs keep running on the live store version, they don't start an ingest of the half-updated files
+    with updating_data():
+        # re-crawl the manual, only pages that changed since the last crawl are downloaded
+        placeholder.info("Crawling the manual...", icon="⏳")
+        parse_manual(manual_file_path)
+        # airtable only downloads the records that changed since the last sync (a full sync on the first run)
+        placeholder.info("Syncing Airtable data...", icon="⏳")
+        sync_airtable(airtable_file_path)
+        # the new store replaces the shared one once it's complete, the QA chains are rebuilt on it
+        ingest_docs(progress_callback=lambda message: placeholder.info(message, icon="⏳"))
     placeholder.empty()
     # clear flag once it's done
     st.session_state["parsing_manual_airtable"] = False
@@ -78,6 +62,9 @@ def parse_manual_airtable():
 def delete_response_files():
     logging.info("Deleting response files")
     file_to_retain = "history.csv"
+    # keep the response file of this session's job
+    job = get_job(st.session_state["job_id"]) if st.session_state.get("job_id") else None
+    unique_file_name = os.path.basename(job["response_file_path"]) if job else None
     for filename in os.listdir(response_folder_path):
         file_path = os.path.join(response_folder_path, filename)
         if filename != file_to_retain and filename != unique_file_name:
@@ -102,88 +89,98 @@ def clear_history():
     file.close()
     logging.info('Clearing history file.')
 
-def start_process(db, response_file_path):
-    short_responses=[]
-    logging.info('Starting the RFP processor')
-    for num, prompt in enumerate(rows):
-        response_data = generate_response(prompt, db)
-
-        # store unique sources only
-        sources = set(doc.metadata['source'] for doc in response_data["source_documents"])
+def follow_job(job_id, progress_bar):
+    """
+    Show the answers of a job in row order while it runs in the background, answers that are still
+    being generated are streamed into their rows. Returns the Yes/No of every row once the job is
+    done, or None if it failed. The job keeps running if this script run is stopped.
+    """
+    logging.info(f'Following job {job_id[:12]}')
+    job = get_job(job_id)
+    # one slot per row, streamed answers are replaced by the final answer once every row before it is shown
+    slots = [st.empty() for _ in range(job["total"])]
+    short_responses = []
+    next_to_show = 0
+    # the page shows the job from its first row again, e.g. after switching tabs
+    st.session_state["prompts"] = []
+    st.session_state["responses"] = []
+    while True:
+        job = get_job(job_id)
+        for index, response_data in get_job_responses(job_id, next_to_show):
+            if index != next_to_show:
+                break
+            with slots[index].container():
+                short_responses.append(show_response(response_data))
+            next_to_show += 1
+        for index, text in get_partial_answers(job_id).items():
+            if index >= next_to_show:
+                display_partial_response(slots[index], rows[index], text)
 
-        # extract prompt, response and sources
-        response = response_data["result"]
-        query = response_data["query"]
-
-        # store responses and prompts in session for persistence
-        st.session_state["prompts"].append(query)
-        st.session_state["responses"].append(response_data)
+        # update the progress bar
+        percentage = (job["answered"] / job["total"]) * 100 if job["total"] else 100
+        progress_bar.progress(percentage / 100, text=f"Progress: {'{:.2f}'.format(percentage)}%")
+        if job["status"] == "failed":
+            return None
+        if job["status"] == "done" and next_to_show == job["total"]:
+            return short_responses
+        time.sleep(job_poll_interval)
+
+
+def show_response(response_data):
+    # store responses and prompts in session for persistence
+    st.session_state["prompts"].append(response_data["query"])
+    st.session_state["responses"].append(response_data)
+    display_response(response_data)
+    return extract(response_data["result"])
+
+
+def display_response(resp_data):
+    srcs = set(doc.metadata['source'] for doc in resp_data["source_documents"])
+    resp = resp_data["result"]
+    q = resp_data["query"]
+    left_col, right_col = st.columns([0.9,0.1])
+    # display the results as they get processed
+    with left_col:
+        with st.expander(f"Doessoftware{q} ?"):
+            st.write(resp)
+            st.write("Sources:")
+            for source in srcs:
+                st.write(source)
+            if resp_data.get("reused_from"):
+                st.caption(f"Answer reused from {resp_data['reused_from']}")
+            if resp_data.get("route") == "classifier":
+                st.caption(f"Answered from the Airtable requirements (confidence {resp_data['confidence']:.2f})")
+    with right_col:
+        res = extract(resp)
+        if res == "Yes":
+            st.write(f":green[{extract(resp)}]")
+        elif res == "No":
+            st.write(f":red[{extract(resp)}]")
+        else:
+            st.write(f":orange[{extract(resp)}]")
+
+
+def display_partial_response(slot, query, text):
+    # an answer that is still being generated, shown open with the Yes/No as soon as its first word is complete
+    with slot.container():
         left_col, right_col = st.columns([0.9,0.1])
-        # display the results as they get processed
         with left_col:
-            with st.expander(f"Doessoftware{query} ?"):
-                st.write(response)
-                st.write("Sources:")
-                for source in sources:
-                    st.write(source)
+            with st.expander(f"Doessoftware{query} ?", expanded=True):
+                st.write(text + "▌")
         with right_col:
-            res = extract(response)
-            short_responses.append(res)
+            res = extract_partial(text)
             if res == "Yes":
-                st.write(f":green[{extract(response)}]")
+                st.write(":green[Yes]")
             elif res == "No":
-                st.write(f":red[{extract(response)}]")
-            else:
-                st.write(f":orange[{extract(response)}]")
-        
-        # check if history file is empty, if so, add header
-        history_is_empty = is_history_empty(history_file_path=history_file_path)
-
-        # if history file is empty, write the header first
-        if history_is_empty:
-            with open(history_file_path, mode='a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(['prompt', 'response', 'sources'])
-            file.close()
-
-        # store the responses in the csv file and also append them to the history file
-        data=[f"Doessoftware{query} ?", response, sources]
-        append_to_csv(response_file_path, data)
-        append_to_csv(history_file_path, data)
-        # update the progress bar
-        percentage = ((num + 1) / total_num_prompts) * 100
-        progress_bar.progress((num + 1) / total_num_prompts,
-                              text=f"Progress: {'{:.2f}'.format(percentage)}%")
-        
-    # add time date/time to seperate each session
-    data = ["-----------------",f"End of file ----- {str(datetime.datetime.now())}","-----------------"]
-    append_to_csv(history_file_path, data)
-        
-    return short_responses
+                st.write(":red[No]")
+            elif res:
+                st.write(f":orange[{res}]")
 
 
 def load_processed_from_session():
     logging.info('Loading prompts, responses and sources from the streamlit\'s session_state')
     for resp_data in st.session_state["responses"]:
-        srcs = set(doc.metadata['source'] for doc in resp_data["source_documents"])
-        resp = resp_data["result"]
-        q = resp_data["query"]
-        left_col, right_col = st.columns([0.9,0.1])
-        # display the results as they get processed
-        with left_col:
-            with st.expander(f"Doessoftware{q} ?"):
-                st.write(resp)
-                st.write("Sources:")
-                for source in srcs:
-                    st.write(source)
-        with right_col:
-            res = extract(resp)
-            if res == "Yes":
-                st.write(f":green[{extract(resp)}]")
-            elif res == "No":
-                st.write(f":red[{extract(resp)}]")
-            else:
-                st.write(f":orange[{extract(resp)}]")
+        display_response(resp_data)
 
 
 if __name__ == "__main__":
@@ -192,7 +189,8 @@ if __name__ == "__main__":
     #this section contains thenentire code for UI and frontend logic for streamlit 
     
     logging.info('Starting program')
-    file_path = "rfps/rfps.csv" #the path for input file
+    # RFP files are answered by background jobs shared by every session, started once per process
+    start_job_runner(get_vector_store, history_file_path)
     # to preserve the prompts and the corresponding responses on button clicks
     if "prompts" not in st.session_state:
         st.session_state["prompts"] = []
@@ -204,17 +202,16 @@ if __name__ == "__main__":
         st.session_state["unique_file_name"] = str(datetime.datetime.now()).replace(" ", "_")
     if "uploaded_file" not in st.session_state:
         st.session_state["uploaded_file"] = None
-    if "stopped_midway" not in st.session_state:
-        st.session_state["stopped_midway"] = False
+    if "job_id" not in st.session_state:
+        st.session_state["job_id"] = None
     if "parsing_manual_airtable" not in st.session_state:
         st.session_state["parsing_manual_airtable"] = False
     if "response_results" not in st.session_state:
         st.session_state["response_results"]=[]
 
 
-    # create filename for the response file (unique so that it does not overwrite an existing response file)
-    unique_file_name = st.session_state["unique_file_name"] + ".csv"
-    response_file_path = os.path.join(response_folder_path, unique_file_name)
+    # the input file is stored per session so that users uploading at the same time don't overwrite each other
+    file_path = os.path.join("rfps", st.session_state["unique_file_name"] + ".csv")
     st.markdown('<style>' + open('style/style.css').read() + '</style>', unsafe_allow_html=True)
     st.title("<I🟢N> RFP Processor")
 
@@ -245,7 +242,7 @@ if __name__ == "__main__":
 
     if tabs =='Home':
         # enable upload button
-        if st.session_state["uploaded_file"] is None and not st.session_state["parsing_manual_airtable"]:
+        if st.session_state["uploaded_file"] is None:
             uploaded_file = browser_placeholder.file_uploader('Upload your RFP CSV file to begin processing',
                                                             accept_multiple_files=False, key="enabled", disabled=False,
                                                             type=['csv'])
@@ -258,16 +255,12 @@ if __name__ == "__main__":
 
         # disable download before process completion
         download_button = placeholder.download_button(label='Download Responses', key='download_btn',
-                                                        data=response_file_path, mime="text/csv",
+                                                        data="", mime="text/csv",
                                                         disabled=True, file_name="processed_rfps.csv")
         # disable start_over button before process completion
         start_over = start_over_placeholder.button(label='Start Over', key='start_over', disabled=True)
-        # ingest data and recreate the chromadb only when necessary
-        # clearing the manual.json file will trigger manual parsing and recreation of chromadb
-        db = ingest_docs()
-
-        # if the file is uploaded and we are not parsing the manual or airtable
-        if st.session_state["uploaded_file"] is not None and not st.session_state["parsing_manual_airtable"] :
+        # if the file is uploaded, a parse that is running or was interrupted doesn't matter, the live store version stays usable
+        if st.session_state["uploaded_file"] is not None:
             # read the input file (the uploaded_file) and write it to the file_path in order to later read from it
             with open(file_path, "wb") as file:
                 # check that the file is still uploaded
@@ -280,22 +273,21 @@ if __name__ == "__main__":
                 # with st.spinner("Processing the uploaded file..."):
                 #     rows = input_apply_nlp(rows)
             except StopIteration:
-                # the following except block applies to the case where llama2 is used as the LLM 
-                # this does actually not quit the metal runner, program may crash if the user does not refresh the page and instead uploads a new file
+                # the uploaded file has no rows
                 st.session_state.clear()
-                warnings_placeholder = st.empty()
-                with st.spinner("Stopping the program, this may take upto 60 seconds..."):
-                    warnings_placeholder.warning(
-                        "File was removed. Please wait for the program to stop. Refreshing the page before the program stops may cause it to crash.",
-                        icon="⚠️")
-                    # make the program sleep for 60 seconds until Metal stops execution
-                    # this is mainly used if we are using a local LLM
-                    time.sleep(60)
-                    warnings_placeholder.empty()
-                    st.stop()
-
-            # if the data is already stored in the session, don't run the model
-            if st.session_state["stopped_midway"] or len(st.session_state["prompts"]) != 0 and len(st.session_state["responses"]) != 0:
+                warnings_placeholder.warning("The uploaded file is empty. Please upload a CSV file with one prompt per row.", icon="⚠️")
+                st.stop()
+            finally:
+                os.remove(file_path)
+
+            # the same file uploaded again (after a reload, or by another user) attaches to its existing job
+            if st.session_state["job_id"] is None:
+                st.session_state["job_id"] = submit_job(rows, response_folder_path)
+            job_id = st.session_state["job_id"]
+            response_file_path = get_job(job_id)["response_file_path"]
+
+            # if the data is already stored in the session, don't follow the job again
+            if st.session_state["doneProcessing"]:
                 # disable the upload button
                 browser_placeholder.file_uploader('Upload your RFP CSV file to begin processing',
                                                 accept_multiple_files=False, key="done", disabled=True,
@@ -305,55 +297,47 @@ if __name__ == "__main__":
                 create_piechart(compliance_score[1], compliance_score[2], percentage_placeholder,piechart_placeholder, compliance_score)
 
             else:
-                # create a new csv file for responses with a unique filename
-                with open(response_file_path, mode='w', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(['prompt', 'response', 'sources'])
-                file.close()
                 with st.spinner("Generating the response document..."):
 
                     # disable the upload button
                     browser_placeholder.file_uploader('Upload your RFP CSV file to begin processing',
                                                     accept_multiple_files=False, disabled=True, type=['csv'],
                                                     key="disabled", )
-                    warnings_placeholder.warning(
-                        "Please wait for the program to complete its execution. If you click on menu options before the program completes, it will cause the program to terminate the process at the current prompt.",
-                        icon="⚠️")
+                    warnings_placeholder.info(
+                        "The file is processed in the background, switching tabs or reloading the page won't stop it. After a reload, upload the same file again to see its progress.",
+                        icon="ℹ️")
                     progress_bar = st.progress(0.0, text="Progress: 0%")
-                    st.session_state["stopped_midway"] = True
-                    response_results = start_process(db, response_file_path)
+                    response_results = follow_job(job_id, progress_bar)
+                    if response_results is None:
+                        # the answered rows are kept, Retry resumes the job from them
+                        with warnings_placeholder.container():
+                            st.error(f"Processing failed: {get_job(job_id)['error']}. Retry to resume from the last answered prompt.", icon="🚨")
+                            st.button(label='Retry', key='retry_job', on_click=resume_job, args=(job_id,))
+                        st.stop()
                     compliance_score = calc_compliance(response_results)
                     st.session_state["response_results"] = response_results
                     create_piechart(compliance_score[1], compliance_score[2], percentage_placeholder,piechart_placeholder,  compliance_score)
 
 
-            file.close()
             # update states
             st.session_state["doneProcessing"] = True
-            st.session_state["stopped_midway"] = False
             # clear the warnings
             warnings_placeholder.empty()
             # enable download button
             if st.session_state.doneProcessing :
+                # the response file may have been removed with "Delete Responses", write it again from the job
+                if not os.path.exists(response_file_path):
+                    write_response_file([response for _, response in get_job_responses(job_id)], response_file_path)
                 with open(response_file_path, "r") as file:
                     if st.session_state["uploaded_file"]:
                         placeholder.download_button(label='Download Responses', key='download_btn_2', data=file,
                                                     mime="text/csv", disabled=False, file_name="processed_rfps.csv")
                         
                     # enable start over button
-                    if not st.session_state["parsing_manual_airtable"]:
-                        start_over = start_over_placeholder.button(label='Start Over', key='start_over_2',
-                                                                disabled=False, on_click=start_over_fn)
+                    start_over = start_over_placeholder.button(label='Start Over', key='start_over_2',
+                                                            disabled=False, on_click=start_over_fn)
                 file.close()
 
-        # do not let user upload an RFP file for processing if manual and airtable parsing are not completed
-        elif st.session_state["parsing_manual_airtable"]:
-            st.warning( 'Please go back to "Parse Data" tab and click on "Start Parsing". Make sure to wait until parsing is done before switching back to "Home" tab.',
-                        icon="⚠️")
-            uploaded_file = browser_placeholder.file_uploader('Upload your RFP CSV file to begin processing',
-                                                accept_multiple_files=False, key="enabled", disabled=True,
-                                                type=['csv'])
-
 
     elif tabs == 'Download History':
         st.info('The history file contains all the processed RFPs in CSV format.', icon="ℹ️")
@@ -376,8 +360,8 @@ if __name__ == "__main__":
         st.info('Clicking "Start Parsing" will overwrite the current manual/Airtable data with the latest version data.', icon="ℹ️")
         placeholder = st.empty()
 
-        # allow user to click on parse_manual button only if the processing of prompts is done or if there's no files uploaded (the program was just started or reloaded)
-        if (st.session_state["uploaded_file"] is None or st.session_state["doneProcessing"]) and placeholder.button(label="Start Parsing", disabled = False, key="btn4"):
+        # the new data is ingested into a new store version next to the live one, files that are being processed keep using the live version
+        if placeholder.button(label="Start Parsing", disabled = False, key="btn4"):
             st.session_state["parsing_manual_airtable"]=True
             if st.session_state["parsing_manual_airtable"]:
                 with st.spinner("Parsing the manual..."):
@@ -392,11 +376,6 @@ if __name__ == "__main__":
             placeholder.button(label="Start Parsing", disabled = False, key="btn5")
 
 
-        # if the user has uploaded a file, wait for the RFP processor to complete its task
-        # the RFP processor uses the manual data, so it should not be interrupted while it processing the rfps and querying the manual data
-        elif st.session_state["uploaded_file"] is not None and not st.session_state["doneProcessing"]:
-            st.warning("Please wait for the program to complete processing the file. After it's complete, you can procceed.",icon="⚠️")
-            placeholder.button(label="Start Parsing", disabled = True, key="btn2")
         # st.session_state["parsing_manual_airtable"]= False
 
 
@@ -2,11 +2,18 @@
 import sys
 import os
 import logging
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import chromadb
+from openai.error import RateLimitError, ServiceUnavailableError, Timeout
 
 # langchain imports
 from langchain import PromptTemplate, LlamaCpp
 from langchain.callbacks import StreamingStdOutCallbackHandler
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.callbacks.manager import CallbackManager
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import HuggingFaceEmbeddings
@@ -14,19 +21,62 @@ from langchain.vectorstores import Chroma
 from langchain.llms import CTransformers
 from langchain.chains import RetrievalQA
 from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.schema import Document
 # from langchain.embeddings.openai import OpenAIEmbeddings
 
 # user defined imports
-from ingest import ingest_docs
+from ingest import ingest_docs, get_corpus_version, load_embedding_function, get_store_path, get_store_version
+from utils.answer_cache import make_cache_key, get_cached_answer, store_answer
+from utils.bm25 import load_bm25_index
+from utils.hybrid_retriever import HybridRetriever
+from utils.numpy_index import NumpyRetriever, load_numpy_index, vector_backend
+from utils.context_budget import ContextBudgetRetriever, context_token_budget
+from utils.cascade import build_statement_index, classify
+from utils.local_llm import LocalLLM, local_model_path, local_max_k, local_context_token_budget
+from utils.tokens import count_tokens
 from dotenv import load_dotenv
 
 
 # setting configs
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
 load_dotenv()
-openai_api_key = os.environ["OPENAI_API_KEY"]
+# not needed when both the LLM and the embeddings run locally
+openai_api_key = os.environ.get("OPENAI_API_KEY")
 chromadb_path = "chroma_persist"
 
+# "openai" uses ChatOpenAI, "local" sends the prompts to a llama model running in a worker process on the CPU
+llm_backend = os.environ.get("RFP_LLM", "openai")
+
+# model and retriever settings, the QA chain registry below is keyed by these
+llm_model_name = "gpt-3.5-turbo"
+llm_temperature = 0
+retriever_k = int(os.environ.get("RFP_RETRIEVER_K", 6))
+if llm_backend == "local":
+    llm_model_name = f"llama-cpp:{os.path.basename(local_model_path)}"
+    # the local model crashes 16GB machines with too much context, the chunks and the answer have to fit into n_ctx
+    retriever_k = min(retriever_k, local_max_k)
+    context_token_budget = min(context_token_budget or local_context_token_budget, local_context_token_budget)
+retriever_search_type = "mmr"
+# "hybrid" fuses the vector search with the BM25 index built at ingest time, "vector" only uses chroma
+retriever_type = os.environ.get("RFP_RETRIEVER", "hybrid")
+
+# batch answering settings, the number of prompts answered at once and the retries per prompt
+max_concurrent_requests = int(os.environ.get("RFP_MAX_CONCURRENT_REQUESTS", 4))
+max_request_retries = int(os.environ.get("RFP_MAX_REQUEST_RETRIES", 5))
+# "cascade" answers prompts that closely match an Airtable statement without calling the LLM, "llm" sends every prompt to the LLM
+answer_mode = os.environ.get("RFP_ANSWER_MODE", "llm")
+# number of prompts embedded per request when the prompts of a file are embedded up front
+query_embedding_batch_size = 500
+retry_base_delay = 2 # seconds, doubled after every rate-limited attempt
+
+# process-wide registry of QA chains, shared by every streamlit session
+# maps (id(db), model name, temperature, k, search type) -> (db, chain)
+# the db is kept in the value so its id can't be reused while the entry is alive
+qa_chain_registry = {}
+qa_chain_registry_lock = threading.Lock()
+# id(db) -> (db, Airtable statement index) for the cascade, rebuilt when a new vector store is ingested
+statement_index_registry = {}
+
 # better prompts ==  better responses
 custom_prompt_template = """
     Use the following pieces of context to answer the question at the end.
@@ -49,7 +99,8 @@ def set_custom_prompt():
     return prompt
 
 
-def load_llm():
+@lru_cache(maxsize=None)
+def load_llm(model_name=llm_model_name, temperature=llm_temperature):
 
     # callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
     # n_gpu_layers = 32 # Metal set to 1 is enough.
@@ -67,11 +118,26 @@ def load_llm():
     # )
 
 
+    if llm_backend == "local":
+        # the model itself is loaded once by the worker process, this is only a handle to it
+        logging.info('Loading the local LLM')
+        return LocalLLM()
+
     logging.info('Loading LLM')
-    llm=ChatOpenAI(verbose=True, temperature=0, openai_api_key=openai_api_key)
+    # streaming lets the UI show the answer token by token, see TokenStreamHandler
+    # max_retries counts attempts here: one attempt, generate_response_with_retries does the retrying
+    llm=ChatOpenAI(verbose=True, model_name=model_name, temperature=temperature, openai_api_key=openai_api_key,
+                   streaming=True, max_retries=1)
     return llm
 
-def retrieval_qa_chain(llm, prompt, db):
+
+def load_embeddings():
+    # the same cached embedding function is used for ingesting and for querying
+    logging.info('Loading the embedding function')
+    return load_embedding_function()
+
+
+def retrieval_qa_chain(llm, prompt, db, k=retriever_k, search_type=retriever_search_type):
 
     # k=7 ,the retriever will get the 7 most relevant pieces of data from the chromadb, however apple M2 16GB RAM often crashes with k=7, works fine with k=5 but less accuracy
     # for llama cpp version, set k =5
@@ -82,28 +148,280 @@ def retrieval_qa_chain(llm, prompt, db):
     # )
     logging.info('Creating the QA chain')
 
-    # OpenAI's model works best with OpenAI's embedding
-    embedding_function = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    embedding_function = load_embeddings()
+    vector_index = load_numpy_index(get_store_path(db)) if vector_backend == "numpy" else None
+    if vector_index is not None:
+        retriever = NumpyRetriever(index=vector_index, embedding_function=embedding_function, k=k, search_type=search_type)
+    else:
+        if vector_backend == "numpy":
+            logging.warning("No numpy vector index found, falling back to chroma. Re-ingest the data with RFP_VECTOR_BACKEND=numpy to build it")
+        retriever = db.as_retriever(search_kwargs={"k": k}, search_type=search_type, embedding=embedding_function)
+    lexical_index = load_bm25_index(get_store_path(db)) if retriever_type == "hybrid" else None
+    if lexical_index is not None:
+        retriever = HybridRetriever(vector_retriever=retriever, lexical_index=lexical_index,
+                                    collection=db._collection, k=k)
+    elif retriever_type == "hybrid":
+        logging.warning("No BM25 index found, falling back to vector retrieval. Re-ingest the data to build it")
+    # drop repeated chunks, merge neighbouring ones and trim the context before it's stuffed into the prompt
+    retriever = ContextBudgetRetriever(retriever=retriever, max_tokens=context_token_budget, model_name=llm_model_name)
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=db.as_retriever(search_kwargs={"k": 6}, search_type="mmr", embedding=embedding_function),
+        retriever=retriever,
         return_source_documents=True,
         chain_type_kwargs={"prompt": prompt},
     )
     return qa_chain
 
 
-def qa_bot(db):
+def find_retriever(retriever, retriever_class):
+    # the retrievers are nested (context budget -> hybrid -> vector), look for retriever_class among them
+    while retriever is not None and not isinstance(retriever, retriever_class):
+        retriever = getattr(retriever, "retriever", None) or getattr(retriever, "vector_retriever", None)
+    return retriever
+
+
+def qa_bot(db, model_name=llm_model_name, temperature=llm_temperature, k=retriever_k, search_type=retriever_search_type):
     logging.info("Calling retrieval QA chain")
-    llm = load_llm()
+    llm = load_llm(model_name, temperature)
     qa_prompt = set_custom_prompt()
-    qa = retrieval_qa_chain(llm, qa_prompt, db)
+    qa = retrieval_qa_chain(llm, qa_prompt, db, k=k, search_type=search_type)
     return qa
 
 
-def generate_response(query, db):
+def get_qa_chain(db, model_name=llm_model_name, temperature=llm_temperature, k=retriever_k, search_type=retriever_search_type):
+    # build the chain once per vector store and config, then reuse it for every prompt
+    key = (id(db), model_name, temperature, k, search_type)
+    with qa_chain_registry_lock:
+        entry = qa_chain_registry.get(key)
+        if entry is None:
+            # a new vector store was ingested, chains built on the old one are stale
+            stale_keys = [stale_key for stale_key, (stale_db, _) in qa_chain_registry.items() if stale_db is not db]
+            for stale_key in stale_keys:
+                logging.info("Dropping QA chain built on an older vector store")
+                del qa_chain_registry[stale_key]
+            entry = (db, qa_bot(db, model_name, temperature, k, search_type))
+            qa_chain_registry[key] = entry
+    return entry[1]
+
+
+def get_statement_index(db):
+    with qa_chain_registry_lock:
+        entry = statement_index_registry.get(id(db))
+        if entry is None:
+            statement_index_registry.clear()
+            entry = (db, build_statement_index(db._collection))
+            statement_index_registry[id(db)] = entry
+    return entry[1]
+
+
+def statement_response(query, statement, polarity, confidence):
+    # the answer of the first stage of the cascade, in the shape of a RetrievalQA response
+    answer = "Yes" if polarity else "No"
+    return {
+        "query": query,
+        "result": f"{answer}, according to the requirements list: {statement['page_content']}",
+        "source_documents": [Document(page_content=statement["page_content"], metadata=statement["metadata"])],
+        "route": "classifier",
+        "confidence": confidence,
+    }
+
+
+def response_to_json(response):
+    # RetrievalQA responses hold Document objects, store them as plain dicts in the answer cache
+    return {
+        "query": response["query"],
+        "result": response["result"],
+        "source_documents": [
+            {"page_content": doc.page_content, "metadata": doc.metadata} for doc in response["source_documents"]
+        ],
+    }
+
+
+def response_from_json(cached):
+    return {
+        "query": cached["query"],
+        "result": cached["result"],
+        "source_documents": [
+            Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in cached["source_documents"]
+        ],
+    }
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Passes the answer of one prompt to on_token(text so far) while the LLM generates it,
+    and logs the time to the first token.
+    """
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self.text = ""
+        self.started = time.monotonic()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        # a retried prompt starts over
+        self.text = ""
+        self.started = time.monotonic()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not self.text:
+            logging.info(f'First token after {time.monotonic() - self.started:.2f}s')
+        self.text += token
+        self.on_token(self.text)
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    Counts the prompt and completion tokens of the LLM calls of one prompt. OpenAI does not report
+    the usage of streamed completions, so the tokens are counted from the prompt and the streamed text.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.text = ""
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        # chat messages arrive as one string per prompt ("System: ...\nHuman: ...")
+        self.prompt_tokens += sum(count_tokens(prompt, llm_model_name) for prompt in prompts)
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+
+    def on_llm_end(self, response, **kwargs):
+        # backends that don't stream only return the whole text at the end
+        text = self.text or "".join(generation.text for generations in response.generations for generation in generations)
+        self.completion_tokens += count_tokens(text, llm_model_name) if text else 0
+
+
+def get_answer_version(db):
+    # the version of the store db was opened on, while a new version is built db is still the previous one
+    return get_store_version(get_store_path(db)) or get_corpus_version()
+
+
+def generate_response(query, db, use_cache=True, callbacks=None):
     logging.info('Generating response')
-    qa_result = qa_bot(db)
-    response = qa_result({"query": query})
+    # repeated prompts are answered from the cache, re-ingesting the corpus or changing the prompt/model invalidates them
+    store_version = get_answer_version(db)
+    cache_key = make_cache_key(query, store_version, custom_prompt_template, llm_model_name,
+                               llm_temperature, retriever_k, retriever_search_type, retriever_type,
+                               context_token_budget)
+    if use_cache:
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            logging.info('Found the response in the answer cache')
+            cached["query"] = query
+            response = response_from_json(cached)
+            response["route"] = "cache"
+            return response
+
+    qa_result = get_qa_chain(db)
+    usage = TokenUsageHandler()
+    response = qa_result({"query": query}, callbacks=(callbacks or []) + [usage])
+    logging.info(f'Prompt used {usage.prompt_tokens} prompt tokens and {usage.completion_tokens} completion tokens')
+    store_answer(cache_key, query, response_to_json(response))
+    response["route"] = "llm"
     return response
+
+
+def prefetch_query_embeddings(queries, batch_size=query_embedding_batch_size):
+    """
+    Embed all the prompts in a few batched calls and return their vectors. The vectors are kept in
+    the in-memory query cache of the embedding function, so when the retriever embeds a prompt it
+    finds the vector there instead of making a round trip to the embedding API.
+    """
+    logging.info(f'Embedding {len(queries)} prompts in batches of {batch_size}')
+    embedding_function = load_embeddings()
+    vectors = []
+    for start in range(0, len(queries), batch_size):
+        vectors.extend(embedding_function.embed_queries(list(queries[start:start + batch_size])))
+    return vectors
+
+
+def generate_response_with_retries(query, db, max_retries=max_request_retries, callbacks=None):
+    # retry rate-limited and overloaded requests with exponential backoff and jitter
+    attempt = 0
+    while True:
+        try:
+            return generate_response(query, db, callbacks=callbacks)
+        except (RateLimitError, ServiceUnavailableError, Timeout) as error:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            delay = retry_base_delay * 2 ** (attempt - 1) + random.uniform(0, 1)
+            logging.warning(f"Request for prompt failed ({error.__class__.__name__}), retrying in {delay:.1f}s (attempt {attempt}/{max_retries})")
+            time.sleep(delay)
+
+
+def route_queries(queries, db):
+    """
+    The part of answering that is done for all prompts at once: one embedding call, the first stage
+    of the cascade and, for the numpy backend, the retrieval of the prompts left for the LLM.
+    Returns (answered, pending, confidences): (index, response) pairs of the prompts the cascade
+    answered, the indexes of the prompts that need the LLM and the statement match of every prompt.
+    """
+    # build the shared chain before the workers start so they don't race to create it
+    qa_chain = get_qa_chain(db)
+    # one embedding call per batch of prompts instead of one per prompt
+    query_vectors = prefetch_query_embeddings(queries)
+
+    # first stage of the cascade, prompts that closely match an Airtable statement are answered right away
+    answered = []
+    pending = list(range(len(queries)))
+    confidences = [None] * len(queries)
+    if answer_mode == "cascade":
+        statements, polarities, statement_vectors = get_statement_index(db)
+        pending = []
+        for index, (statement, polarity, confidence) in enumerate(classify(query_vectors, statements, polarities, statement_vectors)):
+            confidences[index] = confidence
+            if statement is None:
+                pending.append(index)
+            else:
+                answered.append((index, statement_response(queries[index], statement, polarity, confidence)))
+        logging.info(f'Cascade answered {len(queries) - len(pending)} of {len(queries)} prompts without the LLM')
+
+    # the numpy backend searches for all prompts at once, the workers then pick the results up
+    retriever = find_retriever(qa_chain.retriever, NumpyRetriever)
+    if retriever is not None:
+        retriever.prefetch([queries[index] for index in pending], [query_vectors[index] for index in pending])
+    return answered, pending, confidences
+
+
+def generate_responses(queries, db, max_workers=max_concurrent_requests, max_retries=max_request_retries,
+                       on_token=None, initializer=None):
+    """
+    Answer many prompts at once, at most max_workers prompts are in flight at any time.
+    Yields (index, response) pairs as the prompts finish, so the caller can update its
+    progress as soon as possible; index is the position of the prompt in queries.
+    Every response records its route ("classifier", "cache" or "llm") and, in cascade mode,
+    the confidence of the statement match.
+    on_token, if given, is called with (index, text so far) from the worker threads while an
+    answer is generated; initializer runs in every worker thread before it starts.
+    """
+    logging.info(f'Generating responses for {len(queries)} prompts with {max_workers} workers')
+    answered, pending, confidences = route_queries(queries, db)
+    yield from answered
+
+    def callbacks(index):
+        if on_token is None:
+            return None
+        return [TokenStreamHandler(lambda text: on_token(index, text))]
+
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+        futures = {
+            executor.submit(generate_response_with_retries, queries[index], db, max_retries, callbacks(index)): index
+            for index in pending
+        }
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                response = future.result()
+                if confidences[index] is not None:
+                    response["confidence"] = confidences[index]
+                yield index, response
+        finally:
+            # the caller stopped early (e.g. the streamlit script was interrupted), drop queued prompts
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,147 @@
+# basic imports
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# user defined imports
+from ingest import get_vector_store
+from utils.answer_cache import clear_answer_cache
+from utils.csv_reader import read_csv
+from utils.compliance import extract, calc_compliance
+from utils.rfp_processor import answer_rows, ResponseWriter
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# command line version of the app for batches of RFP files, e.g. from cron:
+#   python -m rfp process rfps/*.csv --out responses/batch --workers 4
+#   python -m rfp clear-cache
+# the logs go to stderr, the stats of the run are printed to stdout as JSON
+
+# common file paths
+response_folder_path = "responses"
+history_file_path = os.path.join(response_folder_path, "history.csv")
+# number of files processed at the same time, every file already answers several prompts at once
+default_file_workers = 2
+
+# the history file is appended to by several files at once
+history_lock = threading.Lock()
+
+
+def output_paths(input_path, out_dir):
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(out_dir, f"{name}_responses.csv"), os.path.join(out_dir, f"{name}_summary.json")
+
+
+def compliance_summary(responses):
+    # the same Yes/No counts and compliance score the app shows in its pie chart
+    short_responses = [extract(response_data["result"]) for response_data in responses]
+    percentage, yes_count, no_count = calc_compliance(short_responses)
+    routes = collections.Counter(response_data.get("route") or "llm" for response_data in responses)
+    return {
+        "prompts": len(responses),
+        "yes": yes_count,
+        "no": no_count,
+        "n/a": len(responses) - yes_count - no_count,
+        "compliance_score": round(percentage, 2),
+        "routes": dict(routes),
+    }
+
+
+def process_file(input_path, out_dir, db, history_file_path):
+    """
+    Answer every prompt of one RFP file and write its response file (the same columns as the
+    app's download) and a JSON compliance summary next to it. Returns the summary.
+    """
+    started = time.perf_counter()
+    response_file_path, summary_file_path = output_paths(input_path, out_dir)
+    try:
+        rows = read_csv(input_path)
+    except StopIteration:
+        raise ValueError("the file is empty") from None
+    logging.info(f"Processing {input_path} with {len(rows)} prompts")
+
+    # rows are written as they are answered, a run that is stopped leaves the answered rows behind
+    writer = ResponseWriter(response_file_path, history_file_path, history_lock=history_lock)
+    answered = {}
+    for index, response_data in answer_rows(rows, db, history_file_path):
+        answered[index] = response_data
+        writer.add(index, response_data)
+    writer.close()
+    responses = [answered[index] for index in range(len(rows))]
+
+    summary = {"input": input_path, "output": response_file_path, **compliance_summary(responses),
+               "seconds": round(time.perf_counter() - started, 3)}
+    tmp_path = summary_file_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(summary, file, indent=2)
+    os.replace(tmp_path, summary_file_path)
+    logging.info(f"Finished {input_path} in {summary['seconds']}s")
+    return summary
+
+
+def process_files(input_paths, out_dir, num_workers=default_file_workers, history_file_path=history_file_path):
+    # files that fail are reported in the stats, the other files are still processed
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    if os.path.dirname(history_file_path):
+        os.makedirs(os.path.dirname(history_file_path), exist_ok=True)
+    # the vector store is opened (or ingested) once and shared by every file
+    # a batch waits for the ingest of changed data files instead of answering from the previous store version
+    db = get_vector_store(wait_for_ingest=True)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(process_file, input_path, out_dir, db, history_file_path): input_path
+                   for input_path in input_paths}
+        for future in as_completed(futures):
+            input_path = futures[future]
+            try:
+                results[input_path] = future.result()
+            except Exception as error:
+                logging.exception(f"Processing {input_path} failed")
+                results[input_path] = {"input": input_path, "error": f"{error.__class__.__name__}: {error}"}
+
+    files = [results[input_path] for input_path in input_paths]
+    seconds = time.perf_counter() - started
+    prompts = sum(result.get("prompts", 0) for result in files)
+    return {
+        "files": len(files),
+        "failed": sum(1 for result in files if "error" in result),
+        "prompts": prompts,
+        "seconds": round(seconds, 3),
+        "prompts_per_second": round(prompts / seconds, 3) if seconds else None,
+        "results": files,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m rfp", description="Answer RFP files without the streamlit app")
+    commands = parser.add_subparsers(dest="command", required=True)
+    process = commands.add_parser("process", help="answer the prompts of one or more RFP CSV files")
+    process.add_argument("files", nargs="+", help="RFP CSV files, one prompt per row after the header")
+    process.add_argument("--out", default=response_folder_path, help="directory for the response files and summaries")
+    process.add_argument("--workers", type=int, default=default_file_workers, help="number of files processed at the same time")
+    process.add_argument("--history", default=history_file_path, help="history file the answers are appended to")
+    commands.add_parser("clear-cache", help="delete every answer in the answer cache, the next run asks the LLM again")
+    args = parser.parse_args(argv)
+
+    if args.command == "clear-cache":
+        clear_answer_cache()
+        return 0
+
+    stats = process_files(args.files, args.out, max(1, args.workers), args.history)
+    json.dump(stats, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    # non-zero when any file failed, so cron and CI notice
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
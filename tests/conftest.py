@@ -0,0 +1,87 @@
+# basic imports
+import os
+import re
+import sys
+
+import pytest
+
+# the tests import the app's modules the way the app does, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# user defined imports
+from utils import migrate
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise migrate.requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeAirtable:
+    """
+    Stands in for the pooled session of the Airtable API: pages of page_size records, the
+    LAST_MODIFIED_TIME() filter of the delta sync, the fields[] id listing and queued errors.
+    """
+
+    def __init__(self, records, page_size=2):
+        # record id -> (fields, last modified time as an ISO string)
+        self.records = records
+        self.page_size = page_size
+        self.errors = []
+        self.requests = []
+
+    def fail(self, status_code=None, headers=None, error=None):
+        # queue an error response (or a raised error, e.g. a dropped connection) for the next request
+        self.errors.append(error if error is not None else FakeResponse(status_code, headers=headers))
+
+    def get(self, endpoint, params=None, timeout=None):
+        params = params or {}
+        self.requests.append(params)
+        if self.errors:
+            error = self.errors.pop(0)
+            if isinstance(error, Exception):
+                raise error
+            return error
+        records = [{"id": record_id, "fields": dict(fields)} for record_id, (fields, _) in sorted(self.records.items())]
+        if "filterByFormula" in params:
+            since = re.search(r"'(.+)'", params["filterByFormula"]).group(1).replace(".000Z", "+00:00")
+            records = [record for record in records if self.records[record["id"]][1] > since]
+        if "fields[]" in params:
+            records = [{"id": record["id"], "fields": {key: value for key, value in record["fields"].items()
+                                                      if key == params["fields[]"]}} for record in records]
+        start = int(params.get("offset", 0))
+        page = {"records": records[start:start + self.page_size]}
+        if start + self.page_size < len(records):
+            page["offset"] = str(start + self.page_size)
+        return FakeResponse(200, page)
+
+
+@pytest.fixture
+def airtable(monkeypatch):
+    table = FakeAirtable({
+        "rec1": ({"Requirement": "track work orders", "Opt In": True}, "2026-01-01T00:00:00+00:00"),
+        "rec2": ({"Requirement": "export XML files"}, "2026-01-01T00:00:00+00:00"),
+        "rec3": ({"Requirement": "monitor alarms", "Opt In": True}, "2026-01-01T00:00:00+00:00"),
+    })
+    monkeypatch.setattr(migrate, "get_session", lambda: table)
+    monkeypatch.setattr(migrate, "wait_for_rate_limit", lambda: None)
+    sleeps = []
+    monkeypatch.setattr(migrate.time, "sleep", sleeps.append)
+    table.sleeps = sleeps
+
+    # the spaCy model is not needed to test the sync, every record becomes one statement
+    def fake_nlp(records):
+        for record in records:
+            yield record, f"ION does {record['fields']['Requirement']}"
+
+    monkeypatch.setattr(migrate, "iter_apply_nlp_with_records", fake_nlp)
+    return table
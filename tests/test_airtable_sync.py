@@ -0,0 +1,98 @@
+# basic imports
+import json
+import os
+
+import pytest
+
+# user defined imports
+from utils import migrate
+
+later = "2999-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "airtable.json"), str(tmp_path / "sync_state.json")
+
+
+def read_statements(file_path):
+    with open(file_path) as file:
+        return sorted(obj["page_content"] for obj in json.load(file))
+
+
+def read_state(state_path):
+    with open(state_path) as file:
+        return json.load(file)
+
+
+def test_delta_sync_only_downloads_changed_records(airtable, paths):
+    airtable_file_path, state_path = paths
+    assert migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path) == (3, 0)
+    assert read_statements(airtable_file_path) == ["ION does export XML files", "ION does monitor alarms",
+                                                   "ION does track work orders"]
+    last_sync = read_state(state_path)["last_sync"]
+
+    # one record changed and one added after the first sync
+    airtable.records["rec2"] = ({"Requirement": "export CSV files"}, later)
+    airtable.records["rec4"] = ({"Requirement": "schedule batches"}, later)
+    airtable.requests.clear()
+
+    assert migrate.sync_airtable(airtable_file_path, state_path=state_path) == (2, 0)
+    assert read_statements(airtable_file_path) == ["ION does export CSV files", "ION does monitor alarms",
+                                                   "ION does schedule batches", "ION does track work orders"]
+    # only the modified records were downloaded, the ids of the table were not listed
+    assert airtable.requests and all("filterByFormula" in params for params in airtable.requests)
+    state = read_state(state_path)
+    assert sorted(state["records"]) == ["rec1", "rec2", "rec3", "rec4"]
+    assert state["last_sync"] > last_sync
+
+
+def test_deleted_records_are_dropped_by_the_periodic_reconcile(airtable, paths, monkeypatch):
+    airtable_file_path, state_path = paths
+    monkeypatch.setattr(migrate, "airtable_reconcile_every", 3)
+    migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path)
+    del airtable.records["rec3"]
+
+    # the first delta syncs don't notice the deleted record
+    for _ in range(2):
+        assert migrate.sync_airtable(airtable_file_path, state_path=state_path) == (0, 0)
+    assert "ION does monitor alarms" in read_statements(airtable_file_path)
+    assert not any("fields[]" in params for params in airtable.requests)
+
+    # the third one lists the ids and drops it
+    assert migrate.sync_airtable(airtable_file_path, state_path=state_path) == (0, 1)
+    assert read_statements(airtable_file_path) == ["ION does export XML files", "ION does track work orders"]
+    assert read_state(state_path)["runs_since_reconcile"] == 0
+    airtable.requests.clear()
+    migrate.sync_airtable(airtable_file_path, state_path=state_path)
+    assert not any("fields[]" in params for params in airtable.requests)
+
+
+def test_full_sync_drops_deleted_records(airtable, paths):
+    airtable_file_path, state_path = paths
+    migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path)
+    migrate.sync_airtable(airtable_file_path, state_path=state_path)
+    del airtable.records["rec1"]
+    assert migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path) == (2, 0)
+    assert read_statements(airtable_file_path) == ["ION does export XML files", "ION does monitor alarms"]
+    assert read_state(state_path)["runs_since_reconcile"] == 0
+
+
+def test_emptied_requirement_is_removed(airtable, paths):
+    airtable_file_path, state_path = paths
+    migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path)
+    airtable.records["rec1"] = ({"Opt In": True}, later)
+
+    assert migrate.sync_airtable(airtable_file_path, state_path=state_path) == (0, 1)
+    assert read_statements(airtable_file_path) == ["ION does export XML files", "ION does monitor alarms"]
+
+
+def test_missing_output_file_forces_a_full_sync(airtable, paths):
+    airtable_file_path, state_path = paths
+    migrate.sync_airtable(airtable_file_path, full=True, state_path=state_path)
+    airtable.records["rec2"] = ({"Requirement": "export CSV files"}, "2000-01-01T00:00:00+00:00")
+    os.remove(airtable_file_path)
+    airtable.requests.clear()
+    assert migrate.sync_airtable(airtable_file_path, state_path=state_path) == (3, 0)
+    assert "filterByFormula" not in airtable.requests[0]
+    assert "ION does export CSV files" in read_statements(airtable_file_path)
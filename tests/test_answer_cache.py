@@ -0,0 +1,103 @@
+# basic imports
+import pytest
+
+# user defined imports
+import rfp
+from utils import answer_cache
+from utils.answer_cache import evict, get_cached_answer, make_cache_key, store_answer
+
+
+class Clock:
+    # stands in for time.time so entries can be aged without waiting
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "time", clock)
+    monkeypatch.setattr(answer_cache, "answer_cache_enabled", True)
+    monkeypatch.setattr(answer_cache, "writes_since_eviction", 0)
+    return clock
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "answer_cache.sqlite3")
+
+
+def stored_keys(cache_path):
+    connection = answer_cache.connect(cache_path)
+    try:
+        return sorted(key for (key,) in connection.execute("SELECT key FROM answers"))
+    finally:
+        connection.close()
+
+
+def test_cache_key_ignores_case_spacing_and_punctuation():
+    assert make_cache_key("Does software support SSO ?", "v1") == make_cache_key("does software  support sso", "v1")
+    assert make_cache_key("Does software support SSO ?", "v1") != make_cache_key("Does software support SSO ?", "v2")
+
+
+def test_answers_round_trip(clock, cache_path):
+    assert get_cached_answer("key", cache_path=cache_path) is None
+    store_answer("key", "prompt", {"result": "Yes"}, cache_path=cache_path)
+    assert get_cached_answer("key", cache_path=cache_path) == {"result": "Yes"}
+
+
+def test_expired_answers_are_dropped_on_read(clock, cache_path):
+    store_answer("key", "prompt", {"result": "Yes"}, cache_path=cache_path)
+    clock.now += answer_cache.answer_cache_max_age_days * 24 * 3600 + 1
+    assert get_cached_answer("key", cache_path=cache_path) is None
+    assert stored_keys(cache_path) == []
+
+
+def test_evict_keeps_the_most_recently_used_entries(clock, cache_path):
+    for key in ("a", "b", "c", "d"):
+        clock.now += 1
+        store_answer(key, key, {"result": key}, cache_path=cache_path)
+    # reading a makes it the most recently used entry
+    clock.now += 1
+    get_cached_answer("a", cache_path=cache_path)
+    evict(max_entries=2, cache_path=cache_path)
+    assert stored_keys(cache_path) == ["a", "d"]
+
+
+def test_evict_drops_old_entries(clock, cache_path):
+    store_answer("old", "old", {"result": "old"}, cache_path=cache_path)
+    clock.now += 2 * 24 * 3600
+    store_answer("new", "new", {"result": "new"}, cache_path=cache_path)
+    # reading an entry does not make it younger, age counts from when it was stored
+    get_cached_answer("old", cache_path=cache_path)
+    evict(max_age_days=1, cache_path=cache_path)
+    assert stored_keys(cache_path) == ["new"]
+
+
+def test_eviction_runs_every_eviction_interval_writes(clock, cache_path, monkeypatch):
+    evictions = []
+    monkeypatch.setattr(answer_cache, "eviction_interval", 3)
+    monkeypatch.setattr(answer_cache, "evict", lambda cache_path: evictions.append(cache_path))
+    for number in range(7):
+        store_answer(str(number), "prompt", {"result": "Yes"}, cache_path=cache_path)
+    assert evictions == [cache_path, cache_path]
+
+
+def test_disabled_cache_stores_nothing(clock, cache_path, monkeypatch):
+    monkeypatch.setattr(answer_cache, "answer_cache_enabled", False)
+    store_answer("key", "prompt", {"result": "Yes"}, cache_path=cache_path)
+    assert get_cached_answer("key", cache_path=cache_path) is None
+    monkeypatch.setattr(answer_cache, "answer_cache_enabled", True)
+    assert get_cached_answer("key", cache_path=cache_path) is None
+
+
+def test_clear_cache_command_drops_every_answer(clock, tmp_path, monkeypatch):
+    # the command clears the cache at its default path, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    store_answer("key", "prompt", {"result": "Yes"})
+    assert rfp.main(["clear-cache"]) == 0
+    assert get_cached_answer("key") is None
+    assert stored_keys(answer_cache.answer_cache_path) == []
@@ -0,0 +1,110 @@
+# basic imports
+import threading
+
+import pytest
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+import api
+
+
+def make_response(question, route):
+    return {"query": question, "result": f"Yes, {question}.", "route": route,
+            "source_documents": [Document(page_content="", metadata={"source": "manual"})]}
+
+
+class Router:
+    # records every batch, questions about XML need the LLM, the others are answered from the cache
+    def __init__(self):
+        self.batches = []
+        self.answered_by_llm = []
+        # the LLM answers wait for this, so the questions stay in flight
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def route_batch(self, questions):
+        self.batches.append(list(questions))
+        if self.error is not None:
+            raise self.error
+        answered = [(index, make_response(question, "cache")) for index, question in enumerate(questions)
+                    if "XML" not in question]
+        pending = [(index, lambda question=question: self.answer(question)) for index, question in enumerate(questions)
+                   if "XML" in question]
+        return answered, pending
+
+    def answer(self, question):
+        self.release.wait(10)
+        self.answered_by_llm.append(question)
+        return make_response(question, "llm")
+
+
+@pytest.fixture
+def router():
+    return Router()
+
+
+@pytest.fixture
+def batcher(router):
+    # a long wait, so every question submitted by the test lands in the same batch
+    return api.AnswerBatcher(route_batch=router.route_batch, batch_wait=0.3, llm_workers=2)
+
+
+def test_concurrent_questions_are_routed_as_one_batch(router, batcher):
+    questions = ["track operators", "export XML files", "monitor alarms"]
+    futures = [batcher.submit(question) for question in questions]
+    responses = [future.result(timeout=10) for future in futures]
+    assert router.batches == [questions]
+    assert [response["route"] for response in responses] == ["cache", "llm", "cache"]
+    assert [response["query"] for response in responses] == questions
+    assert router.answered_by_llm == ["export XML files"]
+
+
+def test_batches_are_split_at_max_batch(router):
+    batcher = api.AnswerBatcher(route_batch=router.route_batch, batch_wait=0.3, max_batch=2)
+    futures = [batcher.submit(question) for question in ("track operators", "monitor alarms", "schedule batches")]
+    for future in futures:
+        future.result(timeout=10)
+    assert sorted(len(batch) for batch in router.batches) == [1, 2]
+
+
+def test_the_same_question_in_flight_is_answered_once(router, batcher):
+    router.release.clear()
+    first = batcher.submit("Export XML files?")
+    second = batcher.submit("export  xml FILES")
+    assert second is first
+    router.release.set()
+    assert first.result(timeout=10)["route"] == "llm"
+    assert router.batches == [["Export XML files?"]]
+    assert router.answered_by_llm == ["Export XML files?"]
+
+    # once answered, asking again starts a new answer
+    assert batcher.submit("export XML files").result(timeout=10)["route"] == "llm"
+    assert len(router.answered_by_llm) == 2
+
+
+def test_a_failed_batch_fails_every_question_in_it(router, batcher):
+    router.error = RuntimeError("the vector store is gone")
+    futures = [batcher.submit(question) for question in ("track operators", "export XML files")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="the vector store is gone"):
+            future.result(timeout=10)
+    # the failed questions are not left in flight
+    router.error = None
+    assert batcher.submit("track operators").result(timeout=10)["route"] == "cache"
+
+
+def test_bulk_answers_keep_the_order_of_the_questions(router, batcher):
+    client = api.create_app(batcher).test_client()
+    reply = client.post("/answer/bulk", json={"questions": ["export XML files", "track operators", "export XML files"]})
+    assert reply.status_code == 200
+    answers = reply.get_json()["answers"]
+    assert [answer["question"] for answer in answers] == ["export XML files", "track operators", "export XML files"]
+    assert [answer["compliance"] for answer in answers] == ["Yes", "Yes", "Yes"]
+    assert answers[0]["sources"] == ["manual"]
+    # the repeated question was answered once
+    assert router.answered_by_llm == ["export XML files"]
+
+    assert client.post("/answer", json={"question": "  "}).status_code == 400
@@ -0,0 +1,144 @@
+# basic imports
+import csv
+import threading
+import time
+
+import pytest
+from openai.error import RateLimitError
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+import model
+from utils import jobs
+from utils.rfp_processor import ResponseWriter
+
+
+def make_response(query):
+    return {"query": query, "result": f"Yes, software can {query}.", "route": "llm",
+            "source_documents": [Document(page_content="", metadata={"source": "manual"})]}
+
+
+def read_prompts(file_path):
+    # the prompts of the answered rows, without the header and the end of file separators
+    with open(file_path, newline='') as file:
+        return [row[0] for row in csv.reader(file) if row[0] != "prompt" and not row[0].startswith("-----")]
+
+
+def test_rows_are_written_in_order_as_they_finish(tmp_path):
+    response_file_path = str(tmp_path / "responses.csv")
+    history_file_path = str(tmp_path / "history.csv")
+    writer = ResponseWriter(response_file_path, history_file_path)
+    writer.add(1, make_response("b"))
+    # row 1 waits for row 0
+    assert read_prompts(response_file_path) == []
+    writer.add(0, make_response("a"))
+    assert read_prompts(response_file_path) == ["Doessoftwarea ?", "Doessoftwareb ?"]
+    writer.add(3, make_response("d"))
+    writer.add(2, make_response("c"))
+    writer.close()
+    expected = ["Doessoftwarea ?", "Doessoftwareb ?", "Doessoftwarec ?", "Doessoftwared ?"]
+    assert read_prompts(response_file_path) == expected
+    assert read_prompts(history_file_path) == expected
+
+
+def test_resumed_writer_does_not_repeat_history_rows(tmp_path):
+    response_file_path = str(tmp_path / "responses.csv")
+    history_file_path = str(tmp_path / "history.csv")
+    first = ResponseWriter(response_file_path, history_file_path)
+    first.add(0, make_response("a"))
+    # the run stops, row 2 was answered but never written since row 1 was missing
+    done = {0: make_response("a"), 2: make_response("c")}
+    second = ResponseWriter(response_file_path, history_file_path, done, history_written=first.history_written)
+    second.add(1, make_response("b"))
+    second.close()
+    expected = ["Doessoftwarea ?", "Doessoftwareb ?", "Doessoftwarec ?"]
+    assert read_prompts(response_file_path) == expected
+    assert read_prompts(history_file_path) == expected
+
+
+@pytest.fixture
+def jobs_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "get_corpus_version", lambda: "corpus")
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def test_killed_job_leaves_its_answered_rows_and_resumes(tmp_path, jobs_path, monkeypatch):
+    history_file_path = str(tmp_path / "history.csv")
+    rows = ["a", "b", "c", "d"]
+    calls = []
+
+    def crashing_answer_rows(rows, db, history_file_path, done, on_token):
+        calls.append(sorted(done))
+        # rows finish out of order and the process dies after the third one
+        for index in (1, 0, 3):
+            yield index, make_response(rows[index])
+        raise RuntimeError("killed")
+
+    monkeypatch.setattr(jobs, "answer_rows", crashing_answer_rows)
+    job_id = jobs.submit_job(rows, str(tmp_path), path=jobs_path)
+    response_file_path = jobs.get_job(job_id, path=jobs_path)["response_file_path"]
+    with pytest.raises(RuntimeError):
+        jobs.run_job(job_id, None, history_file_path, path=jobs_path)
+    # row 3 waits for row 2, the first two rows are in both files
+    assert read_prompts(response_file_path) == ["Doessoftwarea ?", "Doessoftwareb ?"]
+    assert read_prompts(history_file_path) == ["Doessoftwarea ?", "Doessoftwareb ?"]
+
+    def remaining_answer_rows(rows, db, history_file_path, done, on_token):
+        calls.append(sorted(done))
+        yield 2, make_response(rows[2])
+
+    monkeypatch.setattr(jobs, "answer_rows", remaining_answer_rows)
+    jobs.run_job(job_id, None, history_file_path, path=jobs_path)
+    assert calls == [[], [0, 1, 3]]
+    expected = ["Doessoftwarea ?", "Doessoftwareb ?", "Doessoftwarec ?", "Doessoftwared ?"]
+    assert read_prompts(response_file_path) == expected
+    assert read_prompts(history_file_path) == expected
+    assert jobs.get_job(job_id, path=jobs_path)["status"] == "done"
+
+
+def test_rate_limited_prompts_are_retried_with_backoff(monkeypatch):
+    attempts = []
+    sleeps = []
+
+    def flaky_generate_response(query, db, callbacks=None):
+        attempts.append(query)
+        if len(attempts) < 3:
+            raise RateLimitError("rate limited")
+        return make_response(query)
+
+    monkeypatch.setattr(model, "generate_response", flaky_generate_response)
+    monkeypatch.setattr(model.time, "sleep", sleeps.append)
+    assert model.generate_response_with_retries("a", None, max_retries=5)["query"] == "a"
+    assert len(attempts) == 3
+    # exponential backoff with up to a second of jitter
+    assert model.retry_base_delay <= sleeps[0] < model.retry_base_delay + 1
+    assert 2 * model.retry_base_delay <= sleeps[1] < 2 * model.retry_base_delay + 1
+
+    attempts.clear()
+    with pytest.raises(RateLimitError):
+        model.generate_response_with_retries("a", None, max_retries=1)
+    assert len(attempts) == 2
+
+
+def test_prompts_are_answered_concurrently_within_the_limit(monkeypatch):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow_answer(query, db, max_retries, callbacks):
+        with lock:
+            running.append(query)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(query)
+        return make_response(query)
+
+    queries = [f"prompt {number}" for number in range(10)]
+    monkeypatch.setattr(model, "route_queries", lambda queries, db: ([], list(range(len(queries))), [None] * len(queries)))
+    monkeypatch.setattr(model, "generate_response_with_retries", slow_answer)
+    answered = dict(model.generate_responses(queries, None, max_workers=3))
+    assert [answered[index]["query"] for index in range(len(queries))] == queries
+    assert max(peak) == 3
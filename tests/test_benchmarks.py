@@ -0,0 +1,74 @@
+# basic imports
+import filecmp
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# user defined imports
+import ingest
+import model
+from benchmarks import bench_pipeline
+from benchmarks.compare_reports import compare
+from benchmarks.synthetic import FakeChatLLM, HashEmbeddings, write_dataset
+
+
+def test_the_same_seed_writes_the_same_data(tmp_path):
+    for name, seed in (("first", 0), ("second", 0), ("other", 1)):
+        write_dataset(str(tmp_path / name), num_pages=3, page_sentences=10, num_records=20, num_prompts=15, seed=seed)
+    for file_path in ("ION-manual/manual.json", "Airtable_data/records.json", "Airtable_data/airtable.json", "rfps/rfp_0.csv"):
+        assert filecmp.cmp(tmp_path / "first" / file_path, tmp_path / "second" / file_path, shallow=False)
+    assert not filecmp.cmp(tmp_path / "first" / "rfps/rfp_0.csv", tmp_path / "other" / "rfps/rfp_0.csv", shallow=False)
+
+
+def test_fake_embeddings_are_deterministic_and_similar_for_shared_words():
+    first, second = HashEmbeddings(dimension=64), HashEmbeddings(dimension=64)
+    texts = ["ION can track work orders", "ION can track operators", "approve recipes per shift"]
+    vectors = np.array(first.embed_documents(texts))
+    assert np.array_equal(vectors, np.array(second.embed_documents(texts)))
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_fake_llm_answers_depend_only_on_the_question():
+    llm = FakeChatLLM()
+    answers = {llm(f"Context: {context}\nQuestion: does ION export XML?") for context in ("page 1", "page 2")}
+    assert len(answers) == 1
+    assert answers.pop().split(",")[0] in ("Yes", "No")
+
+
+def report(**stages):
+    return {"stages": stages}
+
+
+def test_only_changes_above_the_threshold_and_the_noise_floor_are_regressions():
+    baseline = report(embed={"seconds": 1.0, "peak_mb": 10.0}, answer={"seconds": 0.01, "peak_mb": 1.0},
+                      nlp={"skipped": "no spaCy model"})
+    candidate = report(embed={"seconds": 1.5, "peak_mb": 10.5}, answer={"seconds": 0.03, "peak_mb": 1.0},
+                       nlp={"seconds": 2.0})
+    lines, regressions = compare(baseline, candidate, threshold=0.25, min_seconds=0.05, min_mb=1.0)
+    # answer tripled but by less than the noise floor, embed memory grew by less than the threshold
+    assert len(regressions) == 1
+    assert regressions[0].startswith("embed      seconds")
+    assert any(line.startswith("nlp        not compared") for line in lines)
+    assert compare(baseline, baseline, 0.25, 0.05, 1.0)[1] == []
+
+
+def test_two_pipeline_runs_give_the_same_answers(tmp_path, monkeypatch):
+    # run_pipeline replaces the API clients and changes the working directory, monkeypatch restores them
+    for module, name in ((ingest, "load_embedding_function"), (model, "load_embedding_function"), (model, "load_llm")):
+        monkeypatch.setattr(module, name, getattr(module, name))
+    monkeypatch.chdir(tmp_path)
+    args = SimpleNamespace(pages=3, page_sentences=10, records=20, prompts=15, seed=0, dimension=64,
+                           embed_call_ms=0, embed_text_ms=0, llm_ms=0, memory=False)
+    runs = []
+    for name in ("first", "second"):
+        os.makedirs(tmp_path / name)
+        runs.append(bench_pipeline.run_pipeline(args, str(tmp_path / name)))
+    assert runs[0]["answers_sha256"] == runs[1]["answers_sha256"]
+    assert runs[0]["chunks"] == runs[1]["chunks"]
+    assert sum(runs[0]["routes"].values()) == 15
+    for stage in ("load", "split", "embed", "index", "retrieve", "answer", "extract", "write"):
+        assert runs[0]["stages"][stage]["items"] > 0
+    assert "nlp" in runs[0]["stages"]
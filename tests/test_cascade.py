@@ -0,0 +1,91 @@
+# basic imports
+from types import SimpleNamespace
+
+import numpy as np
+
+# user defined imports
+import model
+from utils.cascade import build_statement_index, classify, statement_polarity
+
+
+class FakeCollection:
+    # stands in for the chroma collection, get() returns the stored Airtable chunks
+    def __init__(self, documents, embeddings):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.wheres = []
+
+    def get(self, where=None, include=None):
+        self.wheres.append(where)
+        return {"documents": self.documents, "metadatas": [{"title": "Airtable data"}] * len(self.documents),
+                "embeddings": self.embeddings}
+
+
+def test_statement_polarity():
+    assert statement_polarity("ION does track work orders") is True
+    assert statement_polarity("ION does not track work orders") is False
+    assert statement_polarity("ION does not provide audit logs") is False
+    assert statement_polarity("ION has secure login") is True
+    assert statement_polarity("softwaredoes not: export XML") is False
+    # the rest of a long requirement split into several chunks
+    assert statement_polarity("and keeps them for ten years") is None
+
+
+def test_only_statements_are_indexed():
+    collection = FakeCollection(["ION does track work orders", "and keeps them for ten years", "ION does not export XML"],
+                                [[1, 0], [0, 1], [3, 4]])
+    statements, polarities, vectors = build_statement_index(collection)
+    assert [statement["page_content"] for statement in statements] == ["ION does track work orders",
+                                                                       "ION does not export XML"]
+    assert polarities.tolist() == [True, False]
+    assert np.allclose(vectors, [[1, 0], [0.6, 0.8]])
+    assert collection.wheres == [{"title": "Airtable data"}]
+
+
+def statement_index(*rows):
+    # (text, polarity, vector) of every statement
+    statements = [{"page_content": text, "metadata": {}} for text, _, _ in rows]
+    vectors = np.array([vector for _, _, vector in rows], dtype=np.float32)
+    return statements, np.array([polarity for _, polarity, _ in rows]), vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_confident_matches_are_answered_and_the_rest_goes_to_the_llm():
+    statements, polarities, vectors = statement_index(("ION does track work orders", True, [1, 0, 0]),
+                                                      ("ION does not export XML", False, [0, 1, 0]))
+    prompts = np.array([[1, 0.1, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+    results = classify(prompts, statements, polarities, vectors, threshold=0.9)
+    assert [(statement and statement["page_content"], polarity) for statement, polarity, _ in results] == [
+        ("ION does track work orders", True), ("ION does not export XML", False), (None, None)]
+    assert results[0][2] > 0.99 and results[2][2] == 0.0
+
+
+def test_match_is_uncertain_when_the_opposite_statement_is_almost_as_similar():
+    statements, polarities, vectors = statement_index(("ION does track operators", True, [1, 0.01]),
+                                                      ("ION does not track operators", False, [1, 0]))
+    statement, polarity, confidence = classify(np.array([[1, 0.005]]), statements, polarities, vectors,
+                                               threshold=0.9)[0]
+    assert statement is None and confidence < 0.02
+    # nothing to match against
+    assert classify(np.array([[1, 0]]), [], np.array([], dtype=bool), np.zeros((0, 2))) == [(None, None, 0.0)]
+
+
+def test_route_queries_answers_confident_prompts_without_the_llm(monkeypatch):
+    statements, polarities, vectors = statement_index(("ION does track work orders", True, [1, 0]))
+    monkeypatch.setattr(model, "answer_mode", "cascade")
+    monkeypatch.setattr(model, "get_qa_chain", lambda db: SimpleNamespace(retriever=None))
+    monkeypatch.setattr(model, "find_retriever", lambda retriever, retriever_type: None)
+    monkeypatch.setattr(model, "prefetch_query_embeddings", lambda queries: [[1, 0], [0, 1]])
+    monkeypatch.setattr(model, "get_statement_index", lambda db: (statements, polarities, vectors))
+
+    answered, pending, confidences = model.route_queries(["Track work orders", "Export XML"], db=None)
+    assert pending == [1]
+    [(index, response)] = answered
+    assert index == 0
+    assert response["result"] == "Yes, according to the requirements list: ION does track work orders"
+    assert response["route"] == "classifier"
+    assert response["source_documents"][0].page_content == "ION does track work orders"
+    assert confidences[0] > 0.99 and confidences[1] < 0.5
+
+    # in llm mode every prompt goes to the LLM
+    monkeypatch.setattr(model, "answer_mode", "llm")
+    assert model.route_queries(["Track work orders", "Export XML"], db=None) == ([], [0, 1], [None, None])
@@ -0,0 +1,77 @@
+# basic imports
+import csv
+import json
+import os
+
+import pytest
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+import rfp
+
+
+def fake_answer_rows(rows, db, history_file_path, done=None, on_token=None):
+    # answers the rows last to first, prompts about XML are not supported
+    for index in reversed(range(len(rows))):
+        answer = "No, ION does not export XML." if "XML" in rows[index] else "Yes, ION does that."
+        yield index, {"query": rows[index], "result": answer, "route": "cache" if index == 0 else "llm",
+                      "source_documents": [Document(page_content="", metadata={"source": "manual"})]}
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(rfp, "get_vector_store", lambda wait_for_ingest=False: "store")
+    monkeypatch.setattr(rfp, "answer_rows", fake_answer_rows)
+    return tmp_path
+
+
+def write_rfp(path, prompts):
+    # the app's input format: a header, then one prompt per row ending with a comma
+    with open(path, "w") as file:
+        file.write("prompt,\n" + "".join(f"{prompt},\n" for prompt in prompts))
+    return str(path)
+
+
+def run(argv, capsys):
+    exit_code = rfp.main(argv)
+    return exit_code, json.loads(capsys.readouterr().out)
+
+
+def test_files_get_responses_and_summaries(batch, capsys):
+    first = write_rfp(batch / "first.csv", ["track operators", "export XML files", "monitor alarms"])
+    second = write_rfp(batch / "second.csv", ["schedule batches"])
+    out = str(batch / "out")
+    history = str(batch / "history.csv")
+    exit_code, stats = run(["process", first, second, "--out", out, "--history", history, "--workers", "2"], capsys)
+
+    assert exit_code == 0
+    assert (stats["files"], stats["failed"], stats["prompts"]) == (2, 0, 4)
+    assert [result["input"] for result in stats["results"]] == [first, second]
+    with open(os.path.join(out, "first_summary.json")) as file:
+        summary = json.load(file)
+    assert (summary["yes"], summary["no"], summary["n/a"]) == (2, 1, 0)
+    assert summary["compliance_score"] == pytest.approx(66.67)
+    assert summary["routes"] == {"cache": 1, "llm": 2}
+
+    # the rows are in prompt order although they were answered last to first
+    with open(os.path.join(out, "first_responses.csv"), newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0][:2] == ["prompt", "response"]
+    assert [row[0] for row in rows[1:]] == ["Doessoftwaretrack operators ?", "Doessoftwareexport XML files ?",
+                                            "Doessoftwaremonitor alarms ?"]
+    assert os.path.getsize(history) > 0
+
+
+def test_a_failed_file_does_not_stop_the_others(batch, capsys):
+    empty = str(batch / "empty.csv")
+    open(empty, "w").close()
+    good = write_rfp(batch / "good.csv", ["track operators"])
+    exit_code, stats = run(["process", empty, good, "--out", str(batch / "out"), "--history", str(batch / "history.csv")],
+                           capsys)
+    assert exit_code == 1
+    assert stats["failed"] == 1
+    assert stats["results"][0] == {"input": empty, "error": "ValueError: the file is empty"}
+    assert stats["results"][1]["prompts"] == 1
+    assert os.path.exists(batch / "out" / "good_responses.csv")
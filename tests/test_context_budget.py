@@ -0,0 +1,86 @@
+# basic imports
+from typing import List
+
+import pytest
+
+# langchain imports
+from langchain.schema import BaseRetriever, Document
+
+# user defined imports
+from utils import context_budget
+from utils.context_budget import ContextBudgetRetriever, drop_near_duplicates, merge_adjacent, trim_to_budget
+
+page_text = " ".join(f"word{number}" for number in range(60))
+
+
+def chunk(start, end, source="https://docs.example.com/page", start_index=True):
+    # the characters start:end of page_text, cut the way the text splitter does
+    metadata = {"source": source, "title": "Page"}
+    if start_index:
+        metadata["start_index"] = start
+    return Document(page_content=page_text[start:end], metadata=metadata)
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    # one token per word, independent of the tiktoken encoding
+    monkeypatch.setattr(context_budget, "count_tokens", lambda text, model_name: len(text.split()))
+    monkeypatch.setattr(context_budget, "truncate_tokens",
+                        lambda text, max_tokens, model_name: " ".join(text.split()[:max_tokens]))
+
+
+def test_near_duplicates_of_higher_ranked_chunks_are_dropped():
+    text = "ION tracks work orders across every plant and every shift, from the first operation to the final inspection"
+    first = Document(page_content=text, metadata={})
+    repeated = Document(page_content=text + ".", metadata={})
+    different = Document(page_content="ION exports XML files of the batch records", metadata={})
+    assert drop_near_duplicates([first, repeated, different]) == [first, different]
+
+
+def test_neighbouring_chunks_are_merged_in_place_of_the_best_ranked_one():
+    other = chunk(0, 50, source="https://docs.example.com/other")
+    # ranked second part first, the merged chunk starts where the first part starts
+    merged = merge_adjacent([chunk(80, 200), other, chunk(0, 100)])
+    assert [doc.page_content for doc in merged] == [page_text[0:200], other.page_content]
+    assert merged[0].metadata["start_index"] == 0
+    # chunks of the same page that don't touch stay apart
+    assert len(merge_adjacent([chunk(0, 50), chunk(150, 200)])) == 2
+
+
+def test_chunks_without_start_index_are_merged_by_their_shared_text():
+    merged = merge_adjacent([chunk(0, 100, start_index=False), chunk(70, 200, start_index=False)])
+    assert [doc.page_content for doc in merged] == [page_text[0:200]]
+
+
+def test_chunks_without_a_source_are_never_merged():
+    docs = [chunk(0, 100, source=""), chunk(70, 200, source="")]
+    assert merge_adjacent(docs) == docs
+
+
+def test_context_is_trimmed_to_the_budget(word_tokens):
+    docs = [Document(page_content=" ".join(["first"] * 40), metadata={}),
+            Document(page_content=" ".join(["second"] * 100), metadata={}),
+            Document(page_content=" ".join(["third"] * 10), metadata={})]
+    # the first chunk that doesn't fit is cut short, the rest is dropped
+    trimmed = trim_to_budget(docs, max_tokens=100)
+    assert [len(doc.page_content.split()) for doc in trimmed] == [40, 60]
+    # too little budget left to be worth a cut chunk
+    assert [len(doc.page_content.split()) for doc in trim_to_budget(docs, max_tokens=60)] == [40]
+    # no budget keeps every chunk
+    assert trim_to_budget(docs, max_tokens=0) == docs
+
+
+class FixedRetriever(BaseRetriever):
+    docs: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+def test_retriever_assembles_the_context(word_tokens):
+    docs = [chunk(0, 100), chunk(0, 100), chunk(80, 200)]
+    retriever = ContextBudgetRetriever(retriever=FixedRetriever(docs=docs), max_tokens=0)
+    assert [doc.page_content for doc in retriever.get_relevant_documents("prompt")] == [page_text[0:200]]
@@ -0,0 +1,98 @@
+# basic imports
+import multiprocessing
+import os
+
+import numpy as np
+
+# user defined imports
+from benchmarks.synthetic import HashEmbeddings
+from utils.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(HashEmbeddings):
+    # records every text sent to the embedding API
+    def __init__(self):
+        super().__init__(dimension=16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def open_cache(cache_path, **kwargs):
+    return CachedEmbeddings(CountingEmbeddings(), "hash-16", cache_path=str(cache_path), **kwargs)
+
+
+def test_texts_are_embedded_once_and_kept_on_disk(tmp_path):
+    cache = open_cache(tmp_path)
+    vectors = cache.embed_documents(["alpha", "beta", "alpha"])
+    assert cache.embeddings.embedded == ["alpha", "beta"]
+    assert vectors[0] == vectors[2]
+    assert cache.embed_documents(["beta", "gamma"])[0] == vectors[1]
+    assert cache.embeddings.embedded == ["alpha", "beta", "gamma"]
+
+    # another process opening the cache later finds every vector without the API
+    reopened = open_cache(tmp_path)
+    assert reopened.embed_documents(["alpha", "beta", "gamma"])[:2] == vectors[:2]
+    assert reopened.embeddings.embedded == []
+    assert reopened.uncached(["alpha", "delta"]) == ["delta"]
+
+
+def test_caches_of_the_same_directory_see_each_others_rows(tmp_path):
+    first = open_cache(tmp_path)
+    second = open_cache(tmp_path)
+    first.embed_documents(["alpha", "beta"])
+    # second appends after the rows first wrote, it doesn't overwrite them
+    second.embed_documents(["beta", "gamma"])
+    assert second.embeddings.embedded == ["gamma"]
+    first.embed_documents(["gamma"])
+    assert first.embeddings.embedded == ["alpha", "beta"]
+    expected = HashEmbeddings(dimension=16).embed_documents(["alpha", "beta", "gamma"])
+    assert np.allclose(open_cache(tmp_path).embed_documents(["alpha", "beta", "gamma"]), expected)
+
+
+def append_texts(cache_path, texts):
+    open_cache(cache_path).embed_documents(texts)
+
+
+def test_processes_appending_at_the_same_time(tmp_path):
+    context = multiprocessing.get_context("fork")
+    # overlapping texts, every process embeds some that others embed too
+    batches = [[f"text {number}" for number in range(start, start + 40)] for start in range(0, 120, 20)]
+    processes = [context.Process(target=append_texts, args=(str(tmp_path), texts)) for texts in batches]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    cache = open_cache(tmp_path)
+    texts = [f"text {number}" for number in range(140)]
+    assert cache.uncached(texts) == []
+    assert np.allclose(cache.embed_documents(texts), HashEmbeddings(dimension=16).embed_documents(texts))
+
+
+def test_index_rows_without_vectors_are_ignored(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.embed_documents(["alpha", "beta", "gamma"])
+    # an interrupted write: the last vector is cut short
+    vectors_path = os.path.join(cache.directory, "vectors.f32")
+    os.truncate(vectors_path, os.path.getsize(vectors_path) - 8)
+    damaged = open_cache(tmp_path)
+    assert damaged.uncached(["alpha", "beta", "gamma"]) == ["gamma"]
+    damaged.embed_documents(["gamma", "delta"])
+    expected = HashEmbeddings(dimension=16).embed_documents(["alpha", "beta", "gamma", "delta"])
+    assert np.allclose(open_cache(tmp_path).embed_documents(["alpha", "beta", "gamma", "delta"]), expected)
+
+
+def test_prompts_are_only_cached_in_memory(tmp_path):
+    cache = open_cache(tmp_path, query_cache_size=2)
+    cache.embed_queries(["first prompt", "second prompt"])
+    cache.embed_query("first prompt")
+    assert cache.embeddings.embedded == ["first prompt", "second prompt"]
+    # the least recently used prompt is dropped
+    cache.embed_query("third prompt")
+    cache.embed_query("second prompt")
+    assert cache.embeddings.embedded == ["first prompt", "second prompt", "third prompt", "second prompt"]
+    assert not os.path.exists(os.path.join(cache.directory, "index.txt"))
@@ -0,0 +1,156 @@
+# basic imports
+import json
+import os
+import threading
+import time
+
+import pytest
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+import ingest
+from benchmarks.synthetic import HashEmbeddings
+from utils import embedding_pipeline
+from utils.embedding_pipeline import TokenBudget, batched, embed_in_batches
+
+
+class Clock:
+    # time.monotonic and time.sleep of the budget, sleeping moves the clock forward
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_pipeline.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(embedding_pipeline.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_budget_waits_for_the_window_to_free_up(clock):
+    budget = TokenBudget(100)
+    budget.acquire(60)
+    clock.now += 10
+    budget.acquire(40)
+    assert clock.sleeps == []
+    # the first 60 tokens leave the window 60 seconds after they were spent
+    budget.acquire(50)
+    assert clock.now == pytest.approx(1060)
+    # a batch larger than the budget waits for an empty window instead of forever
+    budget.acquire(500)
+    assert clock.now == pytest.approx(1120)
+
+
+def test_batched_reads_lazily():
+    read = []
+
+    def numbers():
+        for number in range(7):
+            read.append(number)
+            yield number
+
+    batches = batched(numbers(), batch_size=3)
+    assert next(batches) == [0, 1, 2]
+    assert read == [0, 1, 2]
+    assert list(batches) == [[3, 4, 5], [6]]
+
+
+class SlowEmbeddings(HashEmbeddings):
+    # counts the batches in flight, texts in cached are not sent to the API
+    def __init__(self, cached=()):
+        super().__init__(dimension=8)
+        self.cached = set(cached)
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def uncached(self, texts):
+        return [text for text in texts if text not in self.cached]
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+        return super().embed_documents(texts)
+
+
+def test_batches_are_embedded_in_parallel_within_the_budget(monkeypatch):
+    monkeypatch.setattr(embedding_pipeline, "count_tokens", lambda text, model_name: len(text.split()))
+    embeddings = SlowEmbeddings(cached={"cached text"})
+    batches = [(number, [f"text number {number}", "cached text"]) for number in range(12)]
+    messages = []
+    results = dict(embed_in_batches(iter(batches), embeddings, max_workers=3, progress_callback=messages.append))
+    assert sorted(results) == list(range(12))
+    assert results[5] == HashEmbeddings(dimension=8).embed_documents(["text number 5", "cached text"])
+    assert embeddings.peak == 3
+    assert messages[-1].startswith("Embedded 24 chunks")
+
+
+class FailingEmbeddings(HashEmbeddings):
+    # fails on the first batch with a broken text, once the other batches are checkpointed
+    def __init__(self, log_path, checkpoints):
+        super().__init__(dimension=16)
+        self.model_name = "hash-16"
+        self.embedded = []
+        self.failed = False
+        self.log_path = log_path
+        self.checkpoints = checkpoints
+
+    def embed_documents(self, texts):
+        if not self.failed and any("broken" in text for text in texts):
+            self.failed = True
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline and self.checkpoints_written() < self.checkpoints:
+                time.sleep(0.01)
+            raise RuntimeError("the embedding API went away")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+    def checkpoints_written(self):
+        if not os.path.exists(self.log_path):
+            return 0
+        with open(self.log_path) as file:
+            return sum(1 for line in file if line.endswith("\n"))
+
+
+def test_interrupted_ingest_resumes_from_the_manifest_log(tmp_path):
+    # three batches of new chunks, the last one fails
+    documents = [Document(page_content=f"Chunk {number} about work order {number}" + (" broken" if number == 299 else ""),
+                          metadata={"source": "manual", "title": "Manual"}) for number in range(300)]
+    embeddings = FailingEmbeddings(str(tmp_path / ingest.manifest_log_file_name), checkpoints=2)
+    with pytest.raises(RuntimeError):
+        ingest.get_or_create_chromadb(str(tmp_path), ingest.collection_name, documents, embeddings)
+    # the finished batches were checkpointed without rewriting the manifest
+    with open(tmp_path / ingest.manifest_file_name) as file:
+        assert json.load(file)["chunks"] == {}
+    assert len(ingest.load_manifest(str(tmp_path))["chunks"]) == 256
+
+    embeddings.embedded.clear()
+    db = ingest.get_or_create_chromadb(str(tmp_path), ingest.collection_name, documents, embeddings)
+    assert embeddings.embedded == [doc.page_content for doc in documents[256:]]
+    assert db._collection.count() == 300
+    # the checkpoints were compacted into the manifest
+    assert not (tmp_path / ingest.manifest_log_file_name).exists()
+    assert len(ingest.load_manifest(str(tmp_path))["chunks"]) == 300
+
+
+def test_cut_short_checkpoint_is_ignored(tmp_path):
+    ingest.save_manifest(str(tmp_path), {"collection": ingest.collection_name, "chunks": {"a": {"source": "", "hash": "1"}}})
+    ingest.append_manifest_checkpoint(str(tmp_path), added={"b": {"source": "", "hash": "2"}}, removed=["a"])
+    with open(tmp_path / ingest.manifest_log_file_name, "a") as file:
+        file.write('{"added": {"c": ')
+    assert ingest.load_manifest(str(tmp_path))["chunks"] == {"b": {"source": "", "hash": "2"}}
@@ -0,0 +1,120 @@
+# basic imports
+import threading
+
+import pytest
+
+# user defined imports
+from utils import gitbook_crawler
+from utils.gitbook_crawler import crawl_manual
+
+base_url = "https://manual.example.io"
+
+
+class FakeResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.encoding = None
+        self.apparent_encoding = "utf-8"
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise gitbook_crawler.requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeSite:
+    """
+    Stands in for the pooled session of the manual site: a sitemap, pages with an ETag per version
+    and 304 answers to requests that send the current ETag.
+    """
+
+    def __init__(self, pages):
+        # path -> (title, text)
+        self.pages = pages
+        self.versions = {path: 1 for path in pages}
+        self.down = set()
+        self.requests = []
+        self.not_modified = []
+        self.lock = threading.Lock()
+
+    def change(self, path, title, text):
+        self.pages[path] = (title, text)
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+    def get(self, url, headers=None, timeout=None):
+        path = url[len(base_url):]
+        with self.lock:
+            self.requests.append((path, dict(headers or {})))
+        if path == "/sitemap.xml":
+            locs = "".join(f"<url><loc>{base_url}{page_path}</loc></url>" for page_path in self.pages)
+            return FakeResponse(200, f"<urlset>{locs}</urlset>")
+        if path in self.down:
+            return FakeResponse(503)
+        if path not in self.pages:
+            return FakeResponse(404)
+        etag = f'"{path}-{self.versions[path]}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            self.not_modified.append(path)
+            return FakeResponse(304)
+        title, text = self.pages[path]
+        html = f"<html><nav>Menu</nav><main><h1>{title}</h1><p>{text}</p></main></html>"
+        return FakeResponse(200, html, {"ETag": etag, "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"})
+
+
+@pytest.fixture
+def site(monkeypatch):
+    site = FakeSite({"/": ("Welcome", "ION tracks work orders."), "/alarms": ("Alarms", "ION monitors alarms.")})
+    monkeypatch.setattr(gitbook_crawler, "get_session", lambda: site)
+    return site
+
+
+def crawl(cache_path):
+    return crawl_manual(base_url, cache_path=cache_path, max_workers=4)
+
+
+def test_pages_keep_the_manual_json_shape(site, tmp_path):
+    pages = crawl(str(tmp_path / "page_cache.json"))
+    assert pages == [
+        {"page_content": "Welcome\nION tracks work orders.", "metadata": {"source": f"{base_url}/", "title": "Welcome"}},
+        {"page_content": "Alarms\nION monitors alarms.", "metadata": {"source": f"{base_url}/alarms", "title": "Alarms"}},
+    ]
+
+
+def test_recrawl_sends_the_validators_and_keeps_unchanged_pages(site, tmp_path):
+    cache_path = str(tmp_path / "page_cache.json")
+    first = crawl(cache_path)
+    site.requests.clear()
+    site.change("/alarms", "Alarms", "ION monitors and escalates alarms.")
+    site.change("/batches", "Batches", "ION records batches.")
+
+    pages = crawl(cache_path)
+    assert pages[0] == first[0]
+    assert [page["page_content"] for page in pages[1:]] == ["Alarms\nION monitors and escalates alarms.",
+                                                            "Batches\nION records batches."]
+    headers = dict(site.requests)
+    assert headers["/"]["If-None-Match"] == '"/-1"'
+    assert headers["/"]["If-Modified-Since"] == "Mon, 05 Oct 2026 10:00:00 GMT"
+    assert site.not_modified == ["/"]
+    # a page crawled for the first time has nothing to validate
+    assert headers["/batches"] == {}
+
+
+def test_failed_page_keeps_its_cached_copy(site, tmp_path):
+    cache_path = str(tmp_path / "page_cache.json")
+    first = crawl(cache_path)
+    site.down.add("/alarms")
+    assert crawl(cache_path) == first
+    # a page that never came through can't be kept
+    site.change("/batches", "Batches", "ION records batches.")
+    site.down.add("/batches")
+    with pytest.raises(gitbook_crawler.requests.HTTPError):
+        crawl(cache_path)
+
+
+def test_pages_removed_from_the_sitemap_are_dropped(site, tmp_path):
+    cache_path = str(tmp_path / "page_cache.json")
+    crawl(cache_path)
+    del site.pages["/alarms"]
+    assert [page["metadata"]["title"] for page in crawl(cache_path)] == ["Welcome"]
+    assert list(gitbook_crawler.load_page_cache(cache_path)) == [f"{base_url}/"]
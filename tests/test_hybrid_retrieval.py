@@ -0,0 +1,102 @@
+# basic imports
+from typing import List
+
+# langchain imports
+from langchain.schema import BaseRetriever, Document
+
+# user defined imports
+from utils.bm25 import BM25Builder, load_bm25_index, tokenize
+from utils.hybrid_retriever import HybridRetriever
+
+
+class ListRetriever(BaseRetriever):
+    # stands in for the vector retriever, always returns the same ranking
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+class FakeCollection:
+    # the part of the chroma collection API the retriever uses
+    def __init__(self, chunks):
+        # chunk id -> Document
+        self.chunks = chunks
+
+    def get(self, ids, include):
+        found = [chunk_id for chunk_id in ids if chunk_id in self.chunks]
+        return {"ids": found, "documents": [self.chunks[chunk_id].page_content for chunk_id in found],
+                "metadatas": [self.chunks[chunk_id].metadata for chunk_id in found]}
+
+
+def build_index(chunks):
+    builder = BM25Builder()
+    for chunk_id, document in chunks.items():
+        builder.add(chunk_id, document.page_content)
+    return builder.build()
+
+
+chunks = {
+    "a": Document(page_content="ION exports work orders as XML files", metadata={"source": "manual/a"}),
+    "b": Document(page_content="Operators track work orders per shift", metadata={"source": "manual/b"}),
+    "c": Document(page_content="Machines connect over OPC-UA to the gateway", metadata={"source": "manual/c"}),
+    "d": Document(page_content="Dashboards show the KPIs of every station", metadata={"source": "manual/d"}),
+}
+
+
+def test_tokenize_keeps_compound_terms_and_their_parts():
+    assert tokenize("Supports OPC-UA and SSO.") == ["supports", "opc-ua", "opc", "ua", "and", "sso"]
+
+
+def test_bm25_ranks_chunks_with_rare_terms_first():
+    index = build_index(chunks)
+    hits = index.search("XML work orders", k=6)
+    # "xml" only appears in a, "work orders" in a and b, c and d don't match at all
+    assert [chunk_id for chunk_id, _ in hits] == ["a", "b"]
+    assert hits[0][1] > hits[1][1] > 0
+    assert [chunk_id for chunk_id, _ in index.search("opc ua", k=6)] == ["c"]
+    assert [chunk_id for chunk_id, _ in index.search("XML work orders", k=1)] == ["a"]
+    assert index.search("nothing matches here") == []
+
+
+def test_bm25_index_round_trips(tmp_path):
+    assert load_bm25_index(str(tmp_path)) is None
+    index = build_index(chunks)
+    index.save(str(tmp_path))
+    assert load_bm25_index(str(tmp_path)).search("KPIs station") == index.search("KPIs station")
+
+
+def make_retriever(vector_ranking, k=3, **kwargs):
+    return HybridRetriever(vector_retriever=ListRetriever(documents=vector_ranking), lexical_index=build_index(chunks),
+                           collection=FakeCollection(chunks), k=k, **kwargs)
+
+
+def test_fusion_sums_reciprocal_ranks():
+    retriever = make_retriever([chunks["d"], chunks["b"]])
+    # b is second in both rankings, d first in the vector one only, a first in the lexical one only
+    fused = retriever.fuse([chunks["d"], chunks["b"]], [chunks["a"], chunks["b"]])
+    assert fused == [chunks["b"], chunks["d"], chunks["a"]]
+    assert retriever.fuse([], []) == []
+
+
+def test_fusion_weights_and_k():
+    retriever = make_retriever([], k=2, lexical_weight=2.0)
+    assert retriever.fuse([chunks["d"], chunks["c"]], [chunks["a"]]) == [chunks["a"], chunks["d"]]
+
+
+def test_fusion_merges_copies_of_the_same_chunk():
+    retriever = make_retriever([])
+    # the chroma result and the lexical one are different objects with the same source and text
+    copy = Document(page_content=chunks["a"].page_content, metadata=dict(chunks["a"].metadata))
+    fused = retriever.fuse([chunks["c"], copy], [chunks["a"]])
+    assert fused == [chunks["a"], chunks["c"]]
+
+
+def test_lexical_hits_are_added_to_the_vector_results():
+    retriever = make_retriever([chunks["d"], chunks["b"]])
+    documents = retriever.get_relevant_documents("export XML")
+    assert chunks["a"] in documents
+    assert len(documents) == 3
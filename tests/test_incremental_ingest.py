@@ -0,0 +1,71 @@
+# basic imports
+import pytest
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+import ingest
+from benchmarks.synthetic import HashEmbeddings
+
+
+class CountingEmbeddings(HashEmbeddings):
+    # records every text sent to the embedding API
+    def __init__(self, model_name="hash-32"):
+        super().__init__(dimension=32)
+        self.model_name = model_name
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def page(number, text=None):
+    return Document(page_content=text or f"Page {number} explains how ION handles work order {number}.",
+                    metadata={"source": f"https://docs.example.com/page-{number}", "title": f"Page {number}"})
+
+
+def sync(directory_path, documents, embeddings):
+    db = ingest.get_or_create_chromadb(str(directory_path), ingest.collection_name, documents, embeddings)
+    stored = db._collection.get(include=["documents"])
+    return sorted(stored["documents"])
+
+
+def test_only_new_and_changed_chunks_are_embedded(tmp_path):
+    embeddings = CountingEmbeddings()
+    documents = [page(number) for number in range(5)]
+    assert sync(tmp_path, documents, embeddings) == sorted(doc.page_content for doc in documents)
+    assert len(embeddings.embedded) == 5
+
+    # page 1 changed, page 4 was deleted, page 5 is new
+    embeddings.embedded.clear()
+    documents = [page(0), page(1, "Page 1 now explains batch records."), page(2), page(3), page(5)]
+    assert sync(tmp_path, documents, embeddings) == sorted(doc.page_content for doc in documents)
+    assert sorted(embeddings.embedded) == ["Page 1 now explains batch records.", page(5).page_content]
+
+    # nothing changed, nothing is embedded
+    embeddings.embedded.clear()
+    sync(tmp_path, documents, embeddings)
+    assert embeddings.embedded == []
+
+
+def test_chunk_ids_do_not_depend_on_the_position_in_the_files():
+    documents = [page(0), page(1), page(2)]
+    ids = [chunk_id for chunk_id, _, _ in ingest.iter_chunk_ids(documents)]
+    reordered = [chunk_id for chunk_id, _, _ in ingest.iter_chunk_ids(documents[::-1])]
+    assert sorted(ids) == sorted(reordered)
+    # the same text twice in a page (e.g. a repeated footer) gets two ids
+    repeated = [chunk_id for chunk_id, _, _ in ingest.iter_chunk_ids([page(0), page(0)])]
+    assert len(set(repeated)) == 2
+
+
+@pytest.mark.parametrize("change", ["embedding model", "manifest"])
+def test_store_is_rebuilt_when_the_manifest_can_not_be_trusted(tmp_path, change):
+    documents = [page(number) for number in range(3)]
+    sync(tmp_path, documents, CountingEmbeddings())
+    embeddings = CountingEmbeddings("hash-32-v2" if change == "embedding model" else "hash-32")
+    if change == "manifest":
+        (tmp_path / ingest.manifest_file_name).unlink()
+    assert sync(tmp_path, documents, embeddings) == sorted(doc.page_content for doc in documents)
+    assert len(embeddings.embedded) == 3
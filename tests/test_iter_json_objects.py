@@ -0,0 +1,52 @@
+# basic imports
+import json
+
+import pytest
+
+# user defined imports
+from ingest import iter_json_objects
+
+documents = [
+    {"page_content": "ION exports XML files, see [the manual]", "metadata": {"source": "", "title": "Airtable data"}},
+    {"page_content": "Überwachung der Alarme in Echtzeit", "metadata": {"source": "https://docs.example.com/a"}},
+    {"page_content": "", "metadata": {"numbers": [1, 2.5, -3e2], "flag": None}},
+]
+
+
+def write_file(tmp_path, text):
+    file_path = tmp_path / "documents.json"
+    file_path.write_text(text)
+    return str(file_path)
+
+
+# every read size cuts the objects at a different place, 1 cuts every one of them at every character
+@pytest.mark.parametrize("read_size", [1, 3, 17, 1 << 16])
+def test_reads_a_json_array(tmp_path, read_size):
+    file_path = write_file(tmp_path, json.dumps(documents, indent=2))
+    assert list(iter_json_objects(file_path, read_size=read_size)) == documents
+
+
+@pytest.mark.parametrize("read_size", [1, 3, 17, 1 << 16])
+def test_reads_json_lines(tmp_path, read_size):
+    file_path = write_file(tmp_path, "".join(json.dumps(document) + "\n" for document in documents))
+    assert list(iter_json_objects(file_path, read_size=read_size)) == documents
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 1 << 16])
+def test_numbers_cut_at_the_end_of_a_block_are_read_whole(tmp_path, read_size):
+    file_path = write_file(tmp_path, "[12345, 678, 9]")
+    assert list(iter_json_objects(file_path, read_size=read_size)) == [12345, 678, 9]
+
+
+@pytest.mark.parametrize("text", ["", "[]", " [ ] \n", "\n\n"])
+def test_empty_files(tmp_path, text):
+    assert list(iter_json_objects(write_file(tmp_path, text), read_size=2)) == []
+
+
+def test_truncated_file_raises(tmp_path):
+    file_path = write_file(tmp_path, json.dumps(documents)[:-20])
+    objects = iter_json_objects(file_path, read_size=8)
+    assert next(objects) == documents[0]
+    assert next(objects) == documents[1]
+    with pytest.raises(json.JSONDecodeError):
+        next(objects)
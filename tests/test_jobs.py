@@ -0,0 +1,137 @@
+# basic imports
+import time
+
+import pytest
+
+# user defined imports
+from utils import jobs
+
+
+@pytest.fixture
+def jobs_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "get_corpus_version", lambda: "v1")
+    monkeypatch.setattr(jobs, "job_runner", None)
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def submit(rows, tmp_path, jobs_path):
+    return jobs.submit_job(rows, str(tmp_path), path=jobs_path)
+
+
+def job_columns(job_id, jobs_path, columns):
+    connection = jobs.connect(jobs_path)
+    try:
+        return connection.execute(f"SELECT {columns} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        connection.close()
+
+
+def set_job_columns(job_id, jobs_path, **values):
+    connection = jobs.connect(jobs_path)
+    try:
+        with connection:
+            for column, value in values.items():
+                connection.execute(f"UPDATE jobs SET {column} = ? WHERE job_id = ?", (value, job_id))
+    finally:
+        connection.close()
+
+
+def test_the_same_file_is_one_job(tmp_path, jobs_path):
+    job_id = submit(["track operators", "export XML"], tmp_path, jobs_path)
+    assert submit(["track operators", "export XML"], tmp_path, jobs_path) == job_id
+    assert submit(["export XML", "track operators"], tmp_path, jobs_path) != job_id
+    job = jobs.get_job(job_id, path=jobs_path)
+    assert (job["status"], job["total"], job["answered"]) == ("queued", 2, 0)
+
+
+def test_jobs_are_claimed_oldest_first_and_only_once(tmp_path, jobs_path):
+    first = submit(["track operators"], tmp_path, jobs_path)
+    second = submit(["export XML"], tmp_path, jobs_path)
+    set_job_columns(second, jobs_path, created=time.time() - 60)
+    assert jobs.claim_job(jobs_path, owner="host:1") == second
+    assert jobs.claim_job(jobs_path, owner="host:2") == first
+    assert jobs.claim_job(jobs_path, owner="host:3") is None
+    status, owner, heartbeat = job_columns(first, jobs_path, "status, owner, heartbeat")
+    assert (status, owner) == ("running", "host:2")
+    assert heartbeat == pytest.approx(time.time(), abs=5)
+
+
+def test_only_jobs_with_a_stale_heartbeat_are_taken_over(tmp_path, jobs_path):
+    live = submit(["track operators"], tmp_path, jobs_path)
+    stale = submit(["export XML"], tmp_path, jobs_path)
+    assert jobs.claim_job(jobs_path, owner="host:1") == live
+    assert jobs.claim_job(jobs_path, owner="host:2") == stale
+    set_job_columns(stale, jobs_path, heartbeat=time.time() - jobs.job_stale_after - 1)
+
+    # another process starts: the job of the live process is left alone, the stale one continues here
+    assert jobs.claim_job(jobs_path, owner="host:3") == stale
+    assert job_columns(live, jobs_path, "status, owner") == ("running", "host:1")
+    assert job_columns(stale, jobs_path, "status, owner") == ("running", "host:3")
+    assert jobs.claim_job(jobs_path, owner="host:4") is None
+
+
+def test_heartbeats_keep_only_the_owners_jobs_alive(tmp_path, jobs_path):
+    job_id = submit(["track operators"], tmp_path, jobs_path)
+    jobs.claim_job(jobs_path, owner="host:1")
+    set_job_columns(job_id, jobs_path, heartbeat=0)
+    jobs.beat_jobs([job_id], jobs_path, owner="host:2")
+    assert job_columns(job_id, jobs_path, "heartbeat") == (0,)
+    jobs.beat_jobs([job_id], jobs_path, owner="host:1")
+    assert job_columns(job_id, jobs_path, "heartbeat")[0] == pytest.approx(time.time(), abs=5)
+
+
+def test_starting_a_runner_does_not_requeue_live_jobs(tmp_path, jobs_path):
+    job_id = submit(["track operators"], tmp_path, jobs_path)
+    jobs.claim_job(jobs_path, owner="host:1")
+    jobs.JobRunner(lambda: None, str(tmp_path / "history.csv"), num_workers=0, path=jobs_path, owner="host:2")
+    assert job_columns(job_id, jobs_path, "status, owner") == ("running", "host:1")
+
+
+def test_failed_jobs_are_resumed(tmp_path, jobs_path):
+    job_id = submit(["track operators"], tmp_path, jobs_path)
+    jobs.claim_job(jobs_path)
+    jobs.set_job_status(job_id, "failed", "RateLimitError: slow down", path=jobs_path)
+    assert jobs.get_job(job_id, path=jobs_path)["error"] == "RateLimitError: slow down"
+    jobs.resume_job(job_id, path=jobs_path)
+    job = jobs.get_job(job_id, path=jobs_path)
+    assert (job["status"], job["error"]) == ("queued", None)
+    # uploading the file again resumes it too
+    jobs.claim_job(jobs_path)
+    jobs.set_job_status(job_id, "failed", "Timeout", path=jobs_path)
+    submit(["track operators"], tmp_path, jobs_path)
+    assert jobs.get_job(job_id, path=jobs_path)["status"] == "queued"
+
+
+def test_old_finished_jobs_are_pruned_with_their_rows(tmp_path, jobs_path):
+    done = submit(["track operators"], tmp_path, jobs_path)
+    running = submit(["export XML"], tmp_path, jobs_path)
+    recent = submit(["monitor alarms"], tmp_path, jobs_path)
+    jobs.set_job_status(done, "done", path=jobs_path)
+    jobs.set_job_status(recent, "done", path=jobs_path)
+    jobs.set_job_status(running, "running", path=jobs_path)
+    old = time.time() - 8 * 24 * 3600
+    set_job_columns(done, jobs_path, updated=old)
+    set_job_columns(running, jobs_path, updated=old)
+
+    jobs.prune_jobs(max_age_days=7, path=jobs_path)
+    assert jobs.get_job(done, path=jobs_path) is None
+    assert jobs.get_job(running, path=jobs_path)["status"] == "running"
+    assert jobs.get_job(recent, path=jobs_path)["status"] == "done"
+    connection = jobs.connect(jobs_path)
+    try:
+        assert connection.execute("SELECT COUNT(*) FROM job_rows WHERE job_id = ?", (done,)).fetchone() == (0,)
+    finally:
+        connection.close()
+
+
+def test_databases_of_older_versions_get_the_new_columns(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    connection = jobs.sqlite3.connect(path)
+    connection.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT, total INTEGER, response_file_path TEXT, "
+                       "error TEXT, created REAL, updated REAL)")
+    connection.execute("INSERT INTO jobs VALUES ('old', 'running', 1, 'old.csv', NULL, 0, 0)")
+    connection.commit()
+    connection.close()
+    # a running job of an older version has no heartbeat, it is taken over
+    assert jobs.claim_job(path, owner="host:1") == "old"
+    assert job_columns("old", path, "written, owner") == (0, "host:1")
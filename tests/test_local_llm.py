@@ -0,0 +1,124 @@
+# basic imports
+import itertools
+import queue
+import threading
+from concurrent.futures import TimeoutError
+from types import SimpleNamespace
+
+import pytest
+
+# user defined imports
+from utils import local_llm
+from utils.local_llm import LocalLLMServer, serve
+
+
+class FakeModel:
+    # stands in for LlamaCpp, records the prompts of every generate() call
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate(self, prompts, stop=None):
+        self.calls.append((list(prompts), stop))
+        self.release.wait(10)
+        if any("fail" in prompt for prompt in prompts):
+            raise ValueError("prompt too long")
+        return SimpleNamespace(generations=[[SimpleNamespace(text=f"answer to {prompt}")] for prompt in prompts])
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    fake_model = FakeModel()
+    loads = []
+
+    def load_local_model(model_path, n_ctx):
+        loads.append((model_path, n_ctx))
+        return fake_model
+
+    monkeypatch.setattr(local_llm, "load_local_model", load_local_model)
+    fake_model.loads = loads
+    return fake_model
+
+
+def test_waiting_prompts_are_answered_in_batches(fake_model):
+    requests = queue.Queue()
+    replies = queue.Queue()
+    for request in [(0, "a", None), (1, "b", ["\n"]), (2, "c", None), (3, "d", ["\n"]), (4, "e", None), None]:
+        requests.put(request)
+    serve(requests, replies, "model.bin", 2048, batch_size=4)
+
+    # the model is loaded once, the first four prompts go in one batch split by their stop words
+    assert fake_model.loads == [("model.bin", 2048)]
+    assert sorted(fake_model.calls, key=repr) == [(["a", "c"], None), (["b", "d"], ["\n"]), (["e"], None)]
+    answers = [replies.get_nowait() for _ in range(6)]
+    assert answers[0] == ("ready", None, None)
+    assert sorted(answers[1:]) == [(number, f"answer to {prompt}", None) for number, prompt in enumerate("abcde")]
+
+
+def test_failed_batches_reply_with_the_error(fake_model):
+    requests = queue.Queue()
+    replies = queue.Queue()
+    for request in [(0, "fail", None), None]:
+        requests.put(request)
+    serve(requests, replies, "model.bin", 2048, batch_size=4)
+    replies.get_nowait()
+    assert replies.get_nowait() == (0, None, "ValueError: prompt too long")
+
+
+def start_server(batch_size=4):
+    # the client side of LocalLLMServer with the worker running in a thread instead of a process
+    server = LocalLLMServer.__new__(LocalLLMServer)
+    server.requests = queue.Queue()
+    server.replies = queue.Queue()
+    server.pending = {}
+    server.lock = threading.Lock()
+    server.ids = itertools.count()
+    server.ready = threading.Event()
+    server.process = threading.Thread(target=serve, args=(server.requests, server.replies, "model.bin", 2048, batch_size),
+                                      daemon=True)
+    server.process.start()
+    server.dispatcher = threading.Thread(target=server.dispatch, daemon=True)
+    server.dispatcher.start()
+    return server
+
+
+def test_callers_get_their_own_answers(fake_model):
+    server = start_server()
+    try:
+        assert server.generate("track operators", timeout=10) == "answer to track operators"
+        with pytest.raises(RuntimeError, match="prompt too long"):
+            server.generate("fail", timeout=10)
+        assert server.ready.is_set()
+    finally:
+        server.shutdown()
+    assert server.pending == {}
+
+
+def test_timed_out_requests_are_forgotten(fake_model):
+    server = start_server()
+    try:
+        server.ready.wait(10)
+        fake_model.release.clear()
+        with pytest.raises(TimeoutError):
+            server.generate("slow prompt", timeout=0.1)
+        assert server.pending == {}
+        # the late reply is dropped and the next caller still gets its answer
+        fake_model.release.set()
+        assert server.generate("next prompt", timeout=10) == "answer to next prompt"
+    finally:
+        server.shutdown()
+
+
+def test_pending_requests_fail_when_the_worker_stops(fake_model):
+    server = start_server()
+    server.ready.wait(10)
+    fake_model.release.clear()
+    _, future = server.submit("slow prompt")
+    server.fail_pending("The local LLM worker process was stopped")
+    with pytest.raises(RuntimeError, match="stopped"):
+        future.result(timeout=1)
+    fake_model.release.set()
+    server.shutdown()
+    with pytest.raises(RuntimeError, match="not running"):
+        server.submit("another prompt")
@@ -0,0 +1,102 @@
+# basic imports
+import threading
+
+import pytest
+
+# user defined imports
+from utils import migrate
+
+endpoint = "https://api.airtable.example/v0/base/Requirement"
+
+
+def test_pages_are_fetched_in_order_following_the_offsets(airtable):
+    for number in range(4, 8):
+        airtable.records[f"rec{number}"] = ({"Requirement": f"requirement {number}"}, "2026-01-01T00:00:00+00:00")
+    pages = list(migrate.iter_record_pages(endpoint))
+    assert [[record["id"] for record in page] for page in pages] == [["rec1", "rec2"], ["rec3", "rec4"],
+                                                                     ["rec5", "rec6"], ["rec7"]]
+    assert [params.get("offset") for params in airtable.requests] == [None, "2", "4", "6"]
+
+
+def test_every_page_keeps_the_filter(airtable):
+    params = {"filterByFormula": "IS_AFTER(LAST_MODIFIED_TIME(), '2000-01-01T00:00:00.000Z')"}
+    assert [record["id"] for record in migrate.iter_records(endpoint, params)] == ["rec1", "rec2", "rec3"]
+    assert all(request["filterByFormula"] == params["filterByFormula"] for request in airtable.requests)
+    # the caller's params are not changed by the offsets
+    assert "offset" not in params
+
+
+def test_fetching_stops_when_the_consumer_stops(airtable, monkeypatch):
+    monkeypatch.setattr(migrate, "airtable_prefetch_pages", 2)
+    airtable.page_size = 1
+    for number in range(4, 100):
+        airtable.records[f"rec{number:03}"] = ({"Requirement": f"requirement {number}"}, "2026-01-01T00:00:00+00:00")
+    threads = threading.active_count()
+    pages = migrate.iter_record_pages(endpoint)
+    next(pages)
+    pages.close()
+    # the fetcher was at most a few pages ahead and has exited
+    assert len(airtable.requests) <= 5
+    assert threading.active_count() == threads
+
+
+def test_rate_limited_requests_are_retried(airtable):
+    airtable.fail(429, headers={"Retry-After": "30"})
+    airtable.fail(503)
+    records = migrate.get_all_records(endpoint)
+    assert [record["id"] for record in records] == ["rec1", "rec2", "rec3"]
+    # the 429 waits at least Retry-After seconds, the 503 backs off exponentially
+    assert len(airtable.sleeps) == 2
+    assert airtable.sleeps[0] >= 30
+    assert 4 <= airtable.sleeps[1] < 5
+
+
+def test_dropped_connections_are_retried_on_the_page_that_failed(airtable):
+    migrate.send_request(endpoint, None)
+    airtable.fail(error=migrate.requests.ConnectionError("connection reset"))
+    airtable.fail(error=migrate.requests.Timeout("read timed out"))
+    assert [record["id"] for record in migrate.send_request(endpoint, "2")["records"]] == ["rec3"]
+    assert [params.get("offset") for params in airtable.requests] == [None, "2", "2", "2"]
+    assert len(airtable.sleeps) == 2
+
+
+def test_gives_up_after_max_retries(airtable, monkeypatch):
+    monkeypatch.setattr(migrate, "airtable_max_retries", 2)
+    for _ in range(3):
+        airtable.fail(429, headers={"Retry-After": "1"})
+    with pytest.raises(migrate.requests.HTTPError):
+        migrate.get_all_records(endpoint)
+    assert len(airtable.sleeps) == 2
+
+    for _ in range(3):
+        airtable.fail(error=migrate.requests.ConnectionError("connection reset"))
+    with pytest.raises(migrate.requests.ConnectionError):
+        migrate.get_all_records(endpoint)
+
+
+def test_every_request_uses_the_same_pooled_session(monkeypatch):
+    monkeypatch.setenv("AT_TOKEN", "secret")
+    migrate.get_session.cache_clear()
+    try:
+        session = migrate.get_session()
+        assert migrate.get_session() is session
+        assert session.headers["Authorization"] == "Bearer secret"
+        assert session.get_adapter("https://api.airtable.com")._pool_maxsize == 4
+    finally:
+        migrate.get_session.cache_clear()
+
+
+def test_requests_are_spaced_by_the_rate_limit(monkeypatch):
+    now = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(migrate.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(migrate.time, "sleep", sleep)
+    monkeypatch.setattr(migrate, "last_request_time", 0.0)
+    for _ in range(3):
+        migrate.wait_for_rate_limit()
+    assert sleeps == [pytest.approx(1 / migrate.airtable_requests_per_second)] * 2
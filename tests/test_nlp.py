@@ -0,0 +1,92 @@
+# basic imports
+from types import SimpleNamespace
+
+import pytest
+
+# user defined imports
+from utils import nlp
+from utils.input_file_cleanup import input_apply_nlp
+from utils.migrate import iter_apply_nlp_with_records
+
+# part-of-speech tags of the fake pipeline
+tags = {"Track": "VERB", "Export": "VERB", "Audit": "NOUN", "Secure": "ADJ", "monitor": "VERB", "reports": "NOUN"}
+
+
+class FakePipeline:
+    # stands in for the spaCy pipeline, records the texts of every pipe() call
+    def __init__(self):
+        self.calls = []
+
+    def make_doc(self, text):
+        return [SimpleNamespace(text=word, pos_=tags.get(word, "X")) for word in text.split(" ")]
+
+    def pipe(self, texts, batch_size, n_process, as_tuples=False):
+        self.calls.append(batch_size)
+        for item in texts:
+            if as_tuples:
+                text, context = item
+                yield self.make_doc(text), context
+            else:
+                yield self.make_doc(item)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    loads = []
+    pipeline = FakePipeline()
+
+    def load(name, disable):
+        loads.append((name, disable))
+        return pipeline
+
+    monkeypatch.setattr(nlp.spacy, "load", load)
+    nlp.load_nlp.cache_clear()
+    pipeline.loads = loads
+    yield pipeline
+    nlp.load_nlp.cache_clear()
+
+
+def record(requirement, opt_in=True):
+    fields = {"Requirement": requirement}
+    if opt_in:
+        fields["Opt In"] = "Yes"
+    return {"id": requirement, "fields": fields}
+
+
+def test_the_pipeline_is_loaded_once_without_the_slow_components(pipeline):
+    list(iter_apply_nlp_with_records([record("Track operators")]))
+    input_apply_nlp(["Export XML files"])
+    assert len(pipeline.loads) == 1
+    name, disable = pipeline.loads[0]
+    assert name == "en_core_web_sm"
+    # the tagger is kept, it sets token.pos_
+    assert "tagger" not in disable and "parser" in disable
+
+
+def test_airtable_records_are_tagged_in_one_pipe(pipeline):
+    records = [record("Track operators"), record("Export XML", opt_in=False), record("Audit trails"),
+               record("Audit logs", opt_in=False), record("Secure login"), record("Unknown words here", opt_in=False)]
+    processed = [text for _, text in iter_apply_nlp_with_records(iter(records))]
+    assert processed == ["ION does Track operators", "ION does not Export XML", "ION provides Audit trails",
+                         "ION does not provide Audit logs", "ION has Secure login",
+                         "softwaredoes not: Unknown words here"]
+    assert pipeline.calls == [nlp.nlp_batch_size]
+
+
+def test_records_are_read_lazily(pipeline):
+    read = []
+
+    def records():
+        for requirement in ("Track operators", "Audit trails", "Secure login"):
+            read.append(requirement)
+            yield record(requirement)
+
+    tagged = iter_apply_nlp_with_records(records())
+    _, processed = next(tagged)
+    assert processed == "ION does Track operators"
+    assert read == ["Track operators"]
+
+
+def test_input_prompts_keep_their_order(pipeline):
+    assert input_apply_nlp(["monitor alarms", "reports by site", "SSO login"]) == [
+        "have ability to monitor alarms", "have reports by site", "provide sso  login"]
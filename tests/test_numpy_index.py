@@ -0,0 +1,99 @@
+# basic imports
+import numpy as np
+
+# user defined imports
+from utils.numpy_index import NumpyIndex, NumpyRetriever, build_numpy_index, load_numpy_index, normalize_rows
+
+
+class FakeCollection:
+    # the paged get() of the chroma collection that build_numpy_index reads
+    def __init__(self, vectors):
+        self.ids = [f"chunk-{row}" for row in range(len(vectors))]
+        self.vectors = vectors
+
+    def get(self, include, limit, offset):
+        rows = range(offset, min(offset + limit, len(self.ids)))
+        return {"ids": [self.ids[row] for row in rows], "embeddings": [self.vectors[row].tolist() for row in rows],
+                "documents": [f"text {row}" for row in rows], "metadatas": [{"source": f"page-{row}"} for row in rows]}
+
+
+class FakeEmbeddings:
+    # maps every query to a fixed vector and counts the embedding calls
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def embed_queries(self, texts):
+        self.calls += 1
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+
+def make_index(num_rows=50, dimension=8, seed=0):
+    vectors = normalize_rows(np.random.default_rng(seed).normal(size=(num_rows, dimension)).astype(np.float32))
+    return NumpyIndex(vectors, [f"chunk-{row}" for row in range(num_rows)], [f"text {row}" for row in range(num_rows)],
+                      [{"source": f"page-{row}"} for row in range(num_rows)])
+
+
+def test_search_returns_the_top_k_rows_best_first():
+    index = make_index()
+    queries = np.random.default_rng(1).normal(size=(5, 8))
+    rows, scores = index.search(queries, k=6)
+    assert rows.shape == scores.shape == (5, 6)
+    expected_scores = normalize_rows(queries.astype(np.float32)) @ index.vectors.T
+    for query_rows, query_scores, expected in zip(rows, scores, expected_scores):
+        assert list(query_rows) == list(np.argsort(-expected)[:6])
+        assert np.allclose(query_scores, expected[query_rows])
+        assert all(np.diff(query_scores) <= 0)
+
+
+def test_search_caps_k_at_the_number_of_rows():
+    index = make_index(num_rows=3)
+    rows, _ = index.search(index.vectors[1], k=6)
+    assert rows.shape == (1, 3)
+    assert rows[0][0] == 1
+    empty = NumpyIndex(np.zeros((0, 8), dtype=np.float32), [], [], [])
+    rows, scores = empty.search(np.ones(8), k=6)
+    assert rows.shape == scores.shape == (1, 0)
+
+
+def test_mmr_skips_near_duplicates():
+    # rows 0 and 1 are almost the same vector, row 2 is less related to the query but unlike row 0
+    vectors = normalize_rows(np.array([[1, 0, 0], [0.99, 0.01, 0], [0.6, -0.8, 0], [0, 0, 1]], dtype=np.float32))
+    index = NumpyIndex(vectors, ["a", "b", "c", "d"], ["a", "b", "c", "d"], [{}, {}, {}, {}])
+    query = np.array([1, -0.05, 0], dtype=np.float32)
+    rows, _ = index.search(query, k=4)
+    assert list(rows[0][:2]) == [0, 1]
+    assert index.mmr(query, rows[0], k=2, lambda_mult=0.5) == [0, 2]
+    # with lambda_mult=1 it's the plain similarity ranking
+    assert index.mmr(query, rows[0], k=2, lambda_mult=1.0) == [0, 1]
+    assert index.mmr(query, [], k=2) == []
+
+
+def test_index_round_trips_through_the_export(tmp_path):
+    index = make_index(num_rows=7)
+    build_numpy_index(FakeCollection(index.vectors * 3), str(tmp_path), batch_size=2)
+    loaded = load_numpy_index(str(tmp_path))
+    assert loaded.ids == index.ids
+    assert loaded.document(4).metadata == {"source": "page-4"}
+    # the export normalizes the rows
+    assert np.allclose(loaded.vectors, index.vectors, atol=1e-6)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["numpy_chunks.jsonl", "numpy_vectors.f32"]
+    assert load_numpy_index(str(tmp_path / "missing")) is None
+
+
+def test_prefetched_queries_are_not_searched_again():
+    index = make_index()
+    embeddings = FakeEmbeddings({"first": index.vectors[3], "second": index.vectors[7]})
+    retriever = NumpyRetriever(index=index, embedding_function=embeddings, k=4)
+    retriever.prefetch(["first", "second"])
+    assert embeddings.calls == 1
+    documents = retriever.get_relevant_documents("second")
+    assert len(documents) == 4
+    assert documents[0].page_content == "text 7"
+    assert embeddings.calls == 1
+    # a prefetched result is used once, the next call embeds and searches
+    assert retriever.get_relevant_documents("second") == documents
+    assert embeddings.calls == 2
@@ -0,0 +1,59 @@
+# basic imports
+import threading
+import time
+
+import pytest
+
+# user defined imports
+import model
+
+
+class FakeStore:
+    # stands in for the chroma handle, the registry only looks at its identity
+    pass
+
+
+@pytest.fixture
+def built(monkeypatch):
+    # every chain qa_bot builds, as (db, k) pairs
+    chains = []
+
+    def fake_qa_bot(db, model_name, temperature, k, search_type):
+        # building a chain is slow (LLM client, retrievers, indexes), long enough for threads to race
+        time.sleep(0.05)
+        chains.append((db, k))
+        return object()
+
+    monkeypatch.setattr(model, "qa_bot", fake_qa_bot)
+    monkeypatch.setattr(model, "qa_chain_registry", {})
+    return chains
+
+
+def test_chain_is_built_once_per_store_and_settings(built):
+    db = FakeStore()
+    chain = model.get_qa_chain(db)
+    assert model.get_qa_chain(db) is chain
+    # other retriever settings get their own chain
+    assert model.get_qa_chain(db, k=2) is not chain
+    assert model.get_qa_chain(db) is chain
+    assert built == [(db, model.retriever_k), (db, 2)]
+
+
+def test_chains_of_an_older_store_are_dropped(built):
+    old_db, new_db = FakeStore(), FakeStore()
+    old_chain = model.get_qa_chain(old_db)
+    new_chain = model.get_qa_chain(new_db)
+    assert new_chain is not old_chain
+    assert [db for db, _ in model.qa_chain_registry.values()] == [new_db]
+
+
+def test_sessions_asking_at_the_same_time_share_one_chain(built):
+    db = FakeStore()
+    chains = []
+    threads = [threading.Thread(target=lambda: chains.append(model.get_qa_chain(db))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert all(chain is chains[0] for chain in chains)
@@ -0,0 +1,50 @@
+# basic imports
+import numpy as np
+import pytest
+
+# user defined imports
+import model
+from benchmarks.synthetic import HashEmbeddings
+from utils.embedding_cache import CachedEmbeddings
+
+
+class RecordingEmbeddings(HashEmbeddings):
+    # records every call to the embedding API
+    def __init__(self):
+        super().__init__(dimension=16)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def embedding_function(tmp_path, monkeypatch):
+    embedding_function = CachedEmbeddings(RecordingEmbeddings(), "hash-16", cache_path=str(tmp_path))
+    monkeypatch.setattr(model, "load_embeddings", lambda: embedding_function)
+    return embedding_function
+
+
+def test_prompts_are_embedded_in_batches(embedding_function):
+    prompts = [f"prompt {number}" for number in range(7)]
+    vectors = model.prefetch_query_embeddings(prompts, batch_size=3)
+    assert embedding_function.embeddings.calls == [prompts[0:3], prompts[3:6], prompts[6:]]
+    assert np.allclose(vectors, HashEmbeddings(dimension=16).embed_documents(prompts))
+
+
+def test_the_retriever_finds_the_prefetched_vectors(embedding_function):
+    prompts = ["track operators", "export XML", "track operators"]
+    vectors = model.prefetch_query_embeddings(prompts)
+    # a repeated prompt is only sent once
+    assert embedding_function.embeddings.calls == [["track operators", "export XML"]]
+    assert vectors[0] == vectors[2]
+    for prompt, vector in zip(prompts, vectors):
+        assert embedding_function.embed_query(prompt) == vector
+    assert len(embedding_function.embeddings.calls) == 1
+    # the prompts are not written to the on-disk cache of the chunks
+    assert embedding_function.uncached(prompts) == prompts
@@ -0,0 +1,91 @@
+# basic imports
+import numpy as np
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+from benchmarks.synthetic import HashEmbeddings
+from utils.rfp_processor import append_to_history
+from utils.semantic_dedup import build_history_index, find_duplicates, key_terms, load_history_entries
+
+
+class CountingEmbeddings(HashEmbeddings):
+    # counts the prompts sent to the embedding API
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.embedded = []
+
+    def embed_queries(self, texts):
+        self.embedded.extend(texts)
+        return self.embed_documents(texts)
+
+
+def same_vectors(count):
+    # the worst case for the guard: the embeddings can't tell the prompts apart at all
+    return np.ones((count, 8), dtype=np.float32)
+
+
+def test_near_miss_prompts_are_not_reused():
+    prompts = ["track operators", "track documents", "export XML files", "not export XML files", "connect to SAP ERP",
+               "connect to Oracle ERP"]
+    assert find_duplicates(prompts, same_vectors(len(prompts))) == [None] * len(prompts)
+
+
+def test_paraphrases_reuse_the_first_answer():
+    prompts = ["Track the operators", "track operator", "tracks operators in all sites", "track operators in sites"]
+    assert find_duplicates(prompts, same_vectors(len(prompts))) == [None, ("row", 0), None, ("row", 2)]
+    assert key_terms("Connect to the ERP systems") == key_terms("connect with ERP system")
+
+
+def test_the_most_similar_prompt_with_the_same_terms_wins():
+    prompts = ["monitor alarms", "monitor alarm levels", "monitor the alarms"]
+    vectors = np.array([[1, 0], [1, 0.01], [1, 0.02]], dtype=np.float32)
+    # prompt 2 is closer to prompt 1 but only prompt 0 names the same terms
+    assert find_duplicates(prompts, vectors) == [None, None, ("row", 0)]
+    # below the threshold nothing is reused, even with the same terms
+    vectors = np.array([[1, 0], [0, 1], [0, 1]], dtype=np.float32)
+    assert find_duplicates(prompts, vectors) == [None, None, None]
+
+
+def test_answers_of_the_file_are_preferred_over_the_history():
+    entries = [{"query": "track documents", "result": "No"}, {"query": "track operators", "result": "Yes"},
+               {"query": "monitor alarms", "result": "No"}]
+    prompts = ["monitor alarms", "track operators", "monitor alarm"]
+    duplicates = find_duplicates(prompts, same_vectors(3), entries[:2], same_vectors(2))
+    assert duplicates == [None, ("history", entries[1]), ("row", 0)]
+    # when the history has the answer, no prompt of the file is answered and every near-duplicate reuses it
+    duplicates = find_duplicates(prompts, same_vectors(3), entries[1:], same_vectors(2))
+    assert duplicates == [("history", entries[2]), ("history", entries[1]), ("history", entries[2])]
+
+
+def write_history(history_file_path, answers):
+    # (query, route, version) of every answered prompt
+    append_to_history([{"query": query, "result": f"Yes, {query}", "route": route, "version": version,
+                        "source_documents": [Document(page_content="", metadata={"source": "manual"})]}
+                       for query, route, version in answers], history_file_path)
+
+
+def test_history_only_offers_llm_answers_of_the_current_version(tmp_path):
+    history_file_path = str(tmp_path / "history.csv")
+    write_history(history_file_path, [("track operators", "llm", "v1"), ("export XML", "llm", "v2"),
+                                      ("monitor alarms", "reused", "v2"), ("connect to ERP", "classifier", "v2"),
+                                      ("schedule batches", "cache", "v2")])
+    entries = load_history_entries(history_file_path, "v2")
+    assert [entry["query"] for entry in entries] == ["export XML", "schedule batches"]
+    assert entries[0]["sources"] == ["manual"]
+    assert len(load_history_entries(history_file_path)) == 5
+
+
+def test_history_index_only_embeds_new_prompts(tmp_path):
+    history_file_path = str(tmp_path / "history.csv")
+    index_path = str(tmp_path / "history_index")
+    embeddings = CountingEmbeddings()
+    write_history(history_file_path, [("track operators", "llm", "v1"), ("export XML", "llm", "v1")])
+    entries, vectors = build_history_index(history_file_path, embeddings, "v1", index_path)
+    assert vectors.shape == (2, 64)
+    write_history(history_file_path, [("monitor alarms", "llm", "v1")])
+    entries, vectors = build_history_index(history_file_path, embeddings, "v1", index_path)
+    assert [entry["query"] for entry in entries] == ["track operators", "export XML", "monitor alarms"]
+    assert embeddings.embedded == ["track operators", "export XML", "monitor alarms"]
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
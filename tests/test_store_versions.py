@@ -0,0 +1,160 @@
+# basic imports
+import functools
+import json
+import os
+import time
+
+import pytest
+
+# user defined imports
+import ingest
+from benchmarks.synthetic import HashEmbeddings
+from utils import embedding_pipeline
+
+
+class FlakyEmbeddings(HashEmbeddings):
+    # records every text sent to the embedding API, fails on broken texts while failing is set
+    def __init__(self):
+        super().__init__(dimension=32)
+        self.model_name = "hash-32"
+        self.embedded = []
+        self.failing = False
+
+    def embed_documents(self, texts):
+        if self.failing and any("broken" in text for text in texts):
+            raise RuntimeError("the embedding API went away")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embeddings(tmp_path, monkeypatch):
+    # the app's layout, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    for directory in ("ION-manual", "Airtable_data", ingest.chromadb_path):
+        os.makedirs(directory)
+    embeddings = FlakyEmbeddings()
+    monkeypatch.setattr(ingest, "load_embedding_function", lambda: embeddings)
+    monkeypatch.setattr(ingest, "vector_store", None)
+    # small batches embedded one after another, so a failure leaves the batches before it checkpointed
+    monkeypatch.setattr(ingest, "batched", functools.partial(embedding_pipeline.batched, batch_size=2))
+    monkeypatch.setattr(ingest, "embed_in_batches", functools.partial(embedding_pipeline.embed_in_batches, max_workers=1))
+    return embeddings
+
+
+def write_data(pages, statements=("ION does track work orders",)):
+    # one chunk per page and statement
+    manual = [{"page_content": text, "metadata": {"source": f"https://docs.example.com/{number}", "title": f"Page {number}"}}
+              for number, text in enumerate(pages)]
+    airtable = [{"page_content": text, "metadata": {"source": "", "title": "Airtable data"}} for text in statements]
+    for file_path, objects in ((ingest.manual_file_path, manual), (ingest.airtable_file_path, airtable)):
+        # a later mtime, as if the file was parsed again
+        mtime = os.path.getmtime(file_path) + 10 if os.path.exists(file_path) else time.time()
+        with open(file_path, "w") as file:
+            json.dump(objects, file)
+        os.utime(file_path, (mtime, mtime))
+
+
+def version_names():
+    return sorted(name for name in os.listdir(ingest.chromadb_path) if name.startswith("v"))
+
+
+def live_name():
+    return os.path.basename(ingest.get_current_store_path())
+
+
+def test_unchanged_chunks_keep_the_live_version(embeddings):
+    write_data(["ION tracks work orders.", "ION exports XML files."])
+    db = ingest.ingest_docs()
+    assert len(version_names()) == 1
+
+    # the files are written again with the same content, their corpus version changes
+    write_data(["ION tracks work orders.", "ION exports XML files."])
+    embeddings.embedded.clear()
+    assert ingest.ingest_docs() is db
+    assert len(version_names()) == 1
+    assert embeddings.embedded == []
+    assert ingest.get_store_version() == ingest.get_expected_store_version()
+
+    # a changed page gets a new version
+    write_data(["ION tracks work orders.", "ION exports CSV files."])
+    ingest.ingest_docs()
+    assert len(version_names()) == 2
+    assert embeddings.embedded == ["ION exports CSV files."]
+
+
+def test_failed_ingest_continues_from_its_checkpoints(embeddings):
+    write_data(["ION tracks work orders."])
+    ingest.ingest_docs()
+    live = live_name()
+
+    pages = ["ION tracks work orders."] + [f"ION handles case {number}." for number in range(4)] + [
+        "ION handles a broken case.", "ION handles the last case."]
+    write_data(pages)
+    embeddings.failing = True
+    embeddings.embedded.clear()
+    with pytest.raises(RuntimeError):
+        ingest.ingest_docs()
+    # the live version stays, the unfinished one is kept with the two batches it finished
+    assert live_name() == live
+    [unfinished] = [name for name in version_names() if name != live]
+    assert embeddings.embedded == pages[1:5]
+
+    embeddings.failing = False
+    embeddings.embedded.clear()
+    db = ingest.ingest_docs()
+    assert live_name() == unfinished
+    assert version_names() == sorted([live, unfinished])
+    assert embeddings.embedded == pages[5:]
+    assert db._collection.count() == len(pages) + 1
+
+
+def make_version(root, name, target=None, age_hours=0):
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    if target is not None:
+        with open(os.path.join(path, ingest.target_version_file_name), "w") as file:
+            file.write(target)
+    mtime = time.time() - age_hours * 3600
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_only_unlocked_leftovers_of_the_same_data_are_continued(tmp_path):
+    root = str(tmp_path)
+    make_version(root, "v1", target="corpus-a")
+    name, _, build_lock = ingest.create_store_version(root, "corpus-b")
+    assert name != "v1"
+    build_lock.close()
+
+    # another process is continuing v1, this build starts a new version for the same data
+    other_build = ingest.lock_store_version(os.path.join(root, "v1"))
+    newer, _, newer_build = ingest.create_store_version(root, "corpus-a")
+    assert newer != "v1"
+    other_build.close()
+
+    # the newest unfinished version that isn't being built is continued
+    name, path, build_lock = ingest.create_store_version(root, "corpus-a")
+    assert name == "v1"
+    assert ingest.read_target_version(path) == "corpus-a"
+    build_lock.close()
+    newer_build.close()
+    name, _, build_lock = ingest.create_store_version(root, "corpus-a")
+    assert name == newer
+    build_lock.close()
+
+
+def test_old_versions_are_removed_after_the_retention_time(tmp_path):
+    root = str(tmp_path)
+    for name, age_hours in (("v1", 48), ("v2", 30), ("v3", 30), ("v4", 2), ("v5", 48), ("v6", 0)):
+        make_version(root, name, age_hours=age_hours)
+    now = time.time()
+    ingest.save_retired_versions(root, {"v1": now - 48 * 3600, "v2": now - 2 * 3600})
+    # v3 and v5 were never live, v5 is still being built by another process
+    other_build = ingest.lock_store_version(os.path.join(root, "v5"))
+    try:
+        ingest.remove_old_store_versions(root, "v6", retention_hours=24)
+    finally:
+        other_build.close()
+    assert sorted(name for name in os.listdir(root) if name.startswith("v")) == ["v2", "v4", "v5", "v6"]
+    assert ingest.load_retired_versions(root) == {"v2": pytest.approx(now - 2 * 3600)}
@@ -0,0 +1,75 @@
+# basic imports
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# user defined imports
+import model
+from model import TokenStreamHandler, TokenUsageHandler
+from utils.compliance import extract_partial
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    # one token per word, independent of the tiktoken encoding
+    monkeypatch.setattr(model, "count_tokens", lambda text, model_name: len(text.split()))
+
+
+def stream(handler, prompt, tokens):
+    # the callbacks an LLM run makes while it streams its answer
+    handler.on_llm_start({}, [prompt])
+    for token in tokens:
+        handler.on_llm_new_token(token)
+    text = "".join(tokens)
+    handler.on_llm_end(SimpleNamespace(generations=[[SimpleNamespace(text=text)]]), run_id=None)
+
+
+def test_stream_handler_passes_the_text_so_far():
+    texts = []
+    handler = TokenStreamHandler(texts.append)
+    stream(handler, "prompt", ["Yes", ",", " ION", " does"])
+    assert texts == ["Yes", "Yes,", "Yes, ION", "Yes, ION does"]
+    # a retried prompt starts over
+    texts.clear()
+    stream(handler, "prompt", ["No", "."])
+    assert texts == ["No", "No."]
+
+
+def test_usage_handler_counts_streamed_and_whole_answers(word_tokens):
+    usage = TokenUsageHandler()
+    stream(usage, "System: answer\nHuman: does ION track operators", ["Yes", ",", " it", " does"])
+    assert (usage.prompt_tokens, usage.completion_tokens) == (7, 3)
+    # a backend that doesn't stream only reports the text at the end
+    usage.on_llm_start({}, ["Human: does ION export XML"])
+    usage.on_llm_end(SimpleNamespace(generations=[[SimpleNamespace(text="No, it does not")]]))
+    assert (usage.prompt_tokens, usage.completion_tokens) == (12, 7)
+
+
+def test_yes_no_is_known_once_the_first_word_is_complete():
+    assert extract_partial("Ye") is None
+    assert extract_partial("Yes") is None
+    assert extract_partial("Yes,") == "Yes"
+    assert extract_partial("No ") == "No"
+    assert extract_partial("The manual") == "N/A"
+
+
+def test_tokens_are_passed_on_with_the_index_of_their_prompt(monkeypatch):
+    monkeypatch.setattr(model, "route_queries", lambda queries, db: ([], [0, 1, 2], [None] * 3))
+
+    def generate_response_with_retries(query, db, max_retries, callbacks):
+        for handler in callbacks:
+            stream(handler, query, [query, " answer"])
+        return {"query": query, "result": f"{query} answer"}
+
+    monkeypatch.setattr(model, "generate_response_with_retries", generate_response_with_retries)
+    streamed = {}
+    lock = threading.Lock()
+
+    def on_token(index, text):
+        with lock:
+            streamed.setdefault(index, []).append(text)
+
+    responses = dict(model.generate_responses(["a", "b", "c"], db=None, max_workers=2, on_token=on_token))
+    assert sorted(responses) == [0, 1, 2]
+    assert streamed == {0: ["a", "a answer"], 1: ["b", "b answer"], 2: ["c", "c answer"]}
@@ -0,0 +1,89 @@
+# basic imports
+import threading
+
+import pytest
+
+# user defined imports
+import ingest
+
+
+class Store:
+    # the state of the store on disk: the version of the live store and the expected one
+    def __init__(self, monkeypatch):
+        self.live_version = "v1"
+        self.expected_version = "v1"
+        self.opened = []
+        self.ingests = []
+        self.background_ingests = []
+        monkeypatch.setattr(ingest, "vector_store", None)
+        monkeypatch.setattr(ingest, "background_ingest", None)
+        monkeypatch.setattr(ingest, "background_ingest_failed_at", None)
+        monkeypatch.setattr(ingest, "get_expected_store_version", lambda: self.expected_version)
+        monkeypatch.setattr(ingest, "get_store_version", lambda directory_path=None: self.live_version)
+        monkeypatch.setattr(ingest, "open_vector_store", self.open)
+        monkeypatch.setattr(ingest, "ingest_docs", self.ingest)
+        monkeypatch.setattr(ingest, "run_background_ingest", lambda: self.background_ingests.append(self.expected_version))
+
+    def open(self, directory_path=None):
+        db = object()
+        self.opened.append(db)
+        return db
+
+    def ingest(self, progress_callback=None):
+        self.ingests.append(self.expected_version)
+        self.live_version = self.expected_version
+        ingest.publish_vector_store(self.expected_version, self.open())
+        return ingest.vector_store[1]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    return Store(monkeypatch)
+
+
+def wait_for_background_ingest():
+    if ingest.background_ingest is not None:
+        ingest.background_ingest.join(10)
+
+
+def test_every_session_shares_one_handle(store):
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(ingest.get_vector_store())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store.opened) == 1
+    assert all(handle is store.opened[0] for handle in handles)
+
+
+def test_changed_data_is_ingested_in_the_background(store):
+    live = ingest.get_vector_store()
+    store.expected_version = "v2"
+    # the live handle is returned while the new version is built
+    assert ingest.get_vector_store() is live
+    wait_for_background_ingest()
+    assert store.background_ingests == ["v2"]
+    # once the ingest publishes the new version every session switches to it
+    ingest.publish_vector_store("v2", "new handle")
+    assert ingest.get_vector_store() == "new handle"
+
+
+def test_without_a_store_the_caller_waits_for_the_ingest(store):
+    store.live_version = None
+    db = ingest.get_vector_store()
+    assert store.ingests == ["v1"]
+    assert ingest.get_vector_store() is db
+
+
+def test_no_background_ingest_while_the_data_files_are_rewritten(store):
+    ingest.get_vector_store()
+    store.expected_version = "v2"
+    with ingest.updating_data():
+        ingest.get_vector_store()
+        wait_for_background_ingest()
+        assert store.background_ingests == []
+    assert ingest.data_updates == 0
+    ingest.get_vector_store()
+    wait_for_background_ingest()
+    assert store.background_ingests == ["v2"]
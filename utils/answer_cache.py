@@ -0,0 +1,122 @@
+# basic imports
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# the cache lives outside of the responses folder so "Delete Responses" does not wipe it
+answer_cache_path = os.environ.get("RFP_ANSWER_CACHE_PATH", "cache/answer_cache.sqlite3")
+# set RFP_ANSWER_CACHE=0 to always call the LLM
+answer_cache_enabled = os.environ.get("RFP_ANSWER_CACHE", "1") != "0"
+answer_cache_max_entries = int(os.environ.get("RFP_ANSWER_CACHE_MAX_ENTRIES", 50000))
+answer_cache_max_age_days = float(os.environ.get("RFP_ANSWER_CACHE_MAX_AGE_DAYS", 30))
+# run eviction after this many writes
+eviction_interval = 100
+
+writes_since_eviction = 0
+cache_lock = threading.Lock()
+
+
+def normalize_prompt(prompt):
+    # "Does software support SSO ?" and "does software  support sso" map to the same key
+    prompt = prompt.lower()
+    prompt = re.sub(r"\s+", " ", prompt)
+    return prompt.strip().strip(" ,.?!;:")
+
+
+def make_cache_key(prompt, *versions):
+    # versions are the corpus hash, prompt template, model name, ... any of them changing invalidates the entry
+    key_parts = [normalize_prompt(prompt)] + [str(version) for version in versions]
+    return hashlib.sha256("\x00".join(key_parts).encode("utf-8")).hexdigest()
+
+
+def connect(cache_path=answer_cache_path):
+    # sqlite connections can't be shared between threads, so every call opens its own
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(cache_path, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        "key TEXT PRIMARY KEY, prompt TEXT, answer TEXT, created REAL, last_used REAL)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+    return connection
+
+
+def get_cached_answer(key, cache_path=answer_cache_path):
+    if not answer_cache_enabled:
+        return None
+    connection = connect(cache_path)
+    try:
+        with connection:
+            row = connection.execute(
+                "SELECT answer, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            answer, created = row
+            if time.time() - created > answer_cache_max_age_days * 24 * 3600:
+                connection.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+    finally:
+        connection.close()
+    return json.loads(answer)
+
+
+def store_answer(key, prompt, answer, cache_path=answer_cache_path):
+    global writes_since_eviction
+    if not answer_cache_enabled:
+        return
+    now = time.time()
+    connection = connect(cache_path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO answers (key, prompt, answer, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, prompt, json.dumps(answer), now, now),
+            )
+    finally:
+        connection.close()
+
+    with cache_lock:
+        writes_since_eviction += 1
+        run_eviction = writes_since_eviction >= eviction_interval
+        if run_eviction:
+            writes_since_eviction = 0
+    if run_eviction:
+        evict(cache_path=cache_path)
+
+
+def evict(max_entries=answer_cache_max_entries, max_age_days=answer_cache_max_age_days, cache_path=answer_cache_path):
+    # drop entries older than max_age_days, then the least recently used ones above max_entries
+    logging.info("Evicting old entries from the answer cache")
+    connection = connect(cache_path)
+    try:
+        with connection:
+            connection.execute("DELETE FROM answers WHERE created < ?", (time.time() - max_age_days * 24 * 3600,))
+            connection.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+    finally:
+        connection.close()
+
+
+def clear_answer_cache(cache_path=answer_cache_path):
+    logging.info("Clearing the answer cache")
+    connection = connect(cache_path)
+    try:
+        with connection:
+            connection.execute("DELETE FROM answers")
+    finally:
+        connection.close()
@@ -0,0 +1,98 @@
+# basic imports
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+bm25_file_name = "bm25_index.pkl"
+# standard BM25 parameters
+bm25_k1 = 1.5
+bm25_b = 0.75
+
+token_pattern = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    # "OPC-UA" yields "opc-ua" as well as "opc" and "ua", so both spellings of a product term match
+    tokens = []
+    for token in token_pattern.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Builder:
+    """
+    Collects chunks one at a time (e.g. while they stream into chroma) and builds a BM25Index.
+    Only the chunk ids and term counts are kept, not the text.
+    """
+
+    def __init__(self):
+        self.chunk_ids = []
+        self.term_counts = []
+
+    def add(self, chunk_id, text):
+        self.chunk_ids.append(chunk_id)
+        self.term_counts.append(Counter(tokenize(text)))
+
+    def build(self):
+        num_docs = len(self.chunk_ids)
+        doc_lengths = [sum(counts.values()) for counts in self.term_counts]
+        average_length = sum(doc_lengths) / num_docs if num_docs else 0
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+
+        # the BM25 weight of every (term, chunk) pair is computed here, so a query only adds them up
+        postings = defaultdict(list)
+        for doc_index, (counts, length) in enumerate(zip(self.term_counts, doc_lengths)):
+            norm = bm25_k1 * (1 - bm25_b + bm25_b * length / average_length) if average_length else bm25_k1
+            for term, count in counts.items():
+                idf = math.log(1 + (num_docs - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                postings[term].append((doc_index, idf * count * (bm25_k1 + 1) / (count + norm)))
+        return BM25Index(self.chunk_ids, dict(postings))
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of the vector store, search() returns (chunk id, score) pairs.
+    """
+
+    def __init__(self, chunk_ids, postings):
+        self.chunk_ids = chunk_ids
+        self.postings = postings
+
+    def search(self, query, k=6):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            for doc_index, weight in self.postings.get(term, ()):
+                scores[doc_index] += weight
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunk_ids[doc_index], score) for doc_index, score in best]
+
+    def save(self, directory_path):
+        path = os.path.join(directory_path, bm25_file_name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump({"chunk_ids": self.chunk_ids, "postings": self.postings}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        logging.info(f"Saved the BM25 index over {len(self.chunk_ids)} chunks")
+
+
+def load_bm25_index(directory_path):
+    # returns None if the index was not built yet (e.g. a store ingested before the index existed)
+    path = os.path.join(directory_path, bm25_file_name)
+    try:
+        with open(path, "rb") as file:
+            data = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    return BM25Index(data["chunk_ids"], data["postings"])
@@ -0,0 +1,75 @@
+# basic imports
+import logging
+import os
+
+import numpy as np
+
+# user defined imports
+from utils.semantic_dedup import normalize_rows
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# prompts at least this similar (cosine) to an Airtable statement are answered from the statement
+cascade_threshold = float(os.environ.get("RFP_CASCADE_THRESHOLD", 0.92))
+# a match is uncertain if a statement of the opposite polarity is almost as similar
+cascade_margin = 0.02
+airtable_title = "Airtable data"
+# prefixes written by utils.migrate.iter_apply_nlp_with_records, negative ones first since they are longer
+negative_prefixes = ("ION does not provide ", "ION does not have ", "ION does not ", "softwaredoes not: ")
+positive_prefixes = ("ION provides ", "ION has ", "ION does ", "softwaredoes: ")
+
+
+def statement_polarity(text):
+    # True for "ION does ..." statements, False for "ION does not ..." ones, None for other chunks
+    if text.startswith(negative_prefixes):
+        return False
+    if text.startswith(positive_prefixes):
+        return True
+    return None
+
+
+def build_statement_index(collection):
+    """
+    Read the Airtable statements and their stored embeddings from the chroma collection, chunks of
+    long requirements that don't start with a statement prefix are skipped.
+    Returns (statements, polarities, normalized vectors).
+    """
+    found = collection.get(where={"title": airtable_title}, include=["embeddings", "documents", "metadatas"])
+    statements = []
+    polarities = []
+    vectors = []
+    for text, metadata, vector in zip(found["documents"], found["metadatas"], found["embeddings"]):
+        polarity = statement_polarity(text)
+        if polarity is None:
+            continue
+        statements.append({"page_content": text, "metadata": metadata or {}})
+        polarities.append(polarity)
+        vectors.append(vector)
+    logging.info(f"Loaded {len(statements)} Airtable statements for the answer cascade")
+    return statements, np.array(polarities, dtype=bool), normalize_rows(vectors)
+
+
+def classify(prompt_vectors, statements, polarities, statement_vectors, threshold=cascade_threshold, margin=cascade_margin):
+    """
+    Match every prompt against the Airtable statements. Returns one (statement, polarity, confidence)
+    per prompt, statement is None when the prompt is uncertain and has to go to the LLM. confidence
+    is the similarity of the best statement, lowered to the gap to the best statement of the
+    opposite polarity when that one is almost as similar.
+    """
+    prompt_vectors = normalize_rows(prompt_vectors)
+    if not len(prompt_vectors) or not len(statements):
+        return [(None, None, 0.0)] * len(prompt_vectors)
+    similarities = prompt_vectors @ statement_vectors.T
+    results = []
+    for row in similarities:
+        best = int(row.argmax())
+        confidence = float(row[best])
+        opposite = row[polarities != polarities[best]]
+        if len(opposite) and confidence - float(opposite.max()) < margin:
+            confidence = confidence - float(opposite.max())
+        if confidence >= threshold:
+            results.append((statements[best], bool(polarities[best]), confidence))
+        else:
+            results.append((None, None, confidence))
+    return results
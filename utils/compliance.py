@@ -0,0 +1,62 @@
+# basic imports
+import logging
+import re
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# the Yes/No answers and the compliance score, without streamlit so they can be used outside the app
+
+def extract(response):
+    logging.info('Extracting "Yes"s and "No"s ')
+    toRet=''
+    if len(response) <=3:
+        #if the response is "No."
+        if (response[:2]).lower() == 'no':
+            toRet='No'
+        # if the response is "Yes"
+        elif response.lower() == 'yes':
+            toRet ='Yes'
+    elif len(response)<=4:
+        # if the response is "Yes."
+        if (response[:3]).lower() == 'yes':
+            toRet = 'Yes'
+    else:
+        # if response is longer than 3 characters only check the first 2 and first 3 characters
+        if (response[:2]).lower() == 'no':
+            toRet='No'
+        elif (response[:3]).lower() == 'yes':
+            toRet = 'Yes'
+        else:
+            toRet = 'N/A'
+
+    return toRet
+
+def extract_partial(partial_response):
+    # while an answer is streamed in, the Yes/No is known once its first word is complete
+    first_word = re.match(r"\s*(\w+)\W", partial_response)
+    if first_word is None:
+        return None
+    return extract(partial_response.strip())
+
+def calc_compliance(res_arr):
+
+    logging.info("Calculating compliance score")
+    # total count includes "yes"s and "no"s only, it does not include "N/A" values
+    total_count=0
+    yes_count=0
+    no_count=0
+    percentage=0
+    for res in res_arr:
+
+        if res == 'No':
+            total_count+=1
+            no_count+=1
+        
+        elif res == 'Yes':
+            total_count+=1
+            yes_count+=1
+
+    if total_count != 0:
+        percentage = yes_count/total_count*100
+    return(percentage, yes_count, no_count)
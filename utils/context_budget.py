@@ -0,0 +1,141 @@
+# basic imports
+import logging
+import os
+from typing import List
+
+# langchain imports
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+
+# user defined imports
+from utils.tokens import count_tokens, truncate_tokens
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# maximum number of context tokens stuffed into a prompt, 0 (the default) keeps every retrieved chunk
+context_token_budget = int(os.environ.get("RFP_CONTEXT_TOKENS", 0))
+# chunks whose word 3-grams overlap more than this with a higher ranked chunk are dropped
+duplicate_threshold = 0.8
+# the text splitter overlaps neighbouring chunks by up to 100 characters
+max_chunk_overlap = 200
+min_chunk_overlap = 20
+# a chunk that doesn't fit is cut to the remaining budget, unless less than this is left
+min_trimmed_tokens = 50
+
+
+def shingles(text, size=3):
+    words = text.lower().split()
+    return set(zip(*(words[offset:] for offset in range(size)))) or {tuple(words)}
+
+
+def drop_near_duplicates(docs, threshold=duplicate_threshold):
+    # docs are ranked, a chunk is dropped if it repeats one ranked above it
+    kept = []
+    kept_shingles = []
+    for doc in docs:
+        doc_shingles = shingles(doc.page_content)
+        if any(len(doc_shingles & other) / len(doc_shingles | other) > threshold for other in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(doc_shingles)
+    return kept
+
+
+def overlap_length(first, second):
+    # length of the longest end of first that is also the start of second
+    for length in range(min(len(first), len(second), max_chunk_overlap), min_chunk_overlap - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def merge_position(first, second):
+    """
+    The text of first and second merged, if second was split right after first from the same page:
+    by the start_index the text splitter records, or for chunks ingested without it, by the text the
+    two chunks share. Returns None if they are not neighbours.
+    """
+    first_start = first.metadata.get("start_index")
+    second_start = second.metadata.get("start_index")
+    if first_start is not None and second_start is not None:
+        first_end = first_start + len(first.page_content)
+        if not first_start < second_start <= first_end:
+            return None
+        return first.page_content + second.page_content[first_end - second_start:]
+    overlap = overlap_length(first.page_content, second.page_content)
+    return first.page_content + second.page_content[overlap:] if overlap else None
+
+
+def merge_adjacent(docs):
+    """
+    Merge chunks of the same page that were split next to each other, the text they share is
+    only kept once. A merged chunk takes the place of its highest ranked part. Chunks without a
+    source (the Airtable statements) are never merged.
+    """
+    merged = []
+    for doc in docs:
+        key = (doc.metadata.get("source", ""), doc.metadata.get("title", ""))
+        if not key[0]:
+            merged.append(doc)
+            continue
+        for index, other in enumerate(merged):
+            if (other.metadata.get("source", ""), other.metadata.get("title", "")) != key:
+                continue
+            text = merge_position(other, doc)
+            # the merged chunk starts where the earlier of the two starts
+            metadata = other.metadata
+            if text is None:
+                text = merge_position(doc, other)
+                metadata = doc.metadata
+            if text is None:
+                continue
+            merged[index] = Document(page_content=text, metadata=metadata)
+            break
+        else:
+            merged.append(doc)
+    return merged
+
+
+def trim_to_budget(docs, max_tokens=context_token_budget, model_name="gpt-3.5-turbo"):
+    # keep the best ranked chunks that fit into max_tokens, the first one that doesn't fit is cut short
+    if not max_tokens:
+        return docs
+    kept = []
+    remaining = max_tokens
+    for doc in docs:
+        tokens = count_tokens(doc.page_content, model_name)
+        if tokens <= remaining:
+            kept.append(doc)
+            remaining -= tokens
+            continue
+        if remaining >= min_trimmed_tokens:
+            kept.append(Document(page_content=truncate_tokens(doc.page_content, remaining, model_name), metadata=doc.metadata))
+        break
+    return kept
+
+
+def assemble_context(docs, max_tokens=context_token_budget, model_name="gpt-3.5-turbo"):
+    assembled = trim_to_budget(merge_adjacent(drop_near_duplicates(docs)), max_tokens, model_name)
+    logging.info(f"Context: {len(docs)} chunks retrieved, {len(assembled)} passed to the LLM "
+                 f"({sum(count_tokens(doc.page_content, model_name) for doc in assembled)} tokens)")
+    return assembled
+
+
+class ContextBudgetRetriever(BaseRetriever):
+    """
+    Sits between the retriever and the "stuff" chain: drops near-duplicate chunks, merges
+    neighbouring chunks of the same page and trims the context to max_tokens.
+    """
+
+    retriever: BaseRetriever
+    max_tokens: int = context_token_budget
+    model_name: str = "gpt-3.5-turbo"
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        return assemble_context(docs, self.max_tokens, self.model_name)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs = await self.retriever.aget_relevant_documents(query, callbacks=run_manager.get_child())
+        return assemble_context(docs, self.max_tokens, self.model_name)
@@ -0,0 +1,201 @@
+# basic imports
+import collections
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+# langchain imports
+from langchain.embeddings.base import Embeddings
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+embedding_cache_path = os.environ.get("RFP_EMBEDDING_CACHE_PATH", "cache/embeddings")
+# prompts change with every RFP, their vectors are only kept in memory, for this many prompts per process
+query_cache_max_entries = int(os.environ.get("RFP_QUERY_EMBEDDING_CACHE_SIZE", 10000))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding function and keeps every document vector it returns on disk, so a text is
+    only sent to the embedding API once per model.
+    The vectors are appended to a float32 file that is read through a memory map, index.txt holds
+    the text hash of every row of that file. The app, the command line and the API can share the
+    cache: appends are serialized with a lock file and every process picks up the rows the others
+    appended. Prompts (embed_query, embed_queries) are cached in memory only.
+    """
+
+    def __init__(self, embeddings, model_name, cache_path=embedding_cache_path, query_cache_size=query_cache_max_entries):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.directory = os.path.join(cache_path, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.index_path = os.path.join(self.directory, "index.txt")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, "lock")
+        self.lock = threading.Lock()
+        self.rows = {}
+        # rows of vectors.f32 this process knows about and the bytes of index.txt it has read
+        self.num_rows = 0
+        self.index_offset = 0
+        self.dimension = None
+        self.vectors = None
+        self.queries = collections.OrderedDict()
+        self.query_cache_size = query_cache_size
+        self.load()
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self.refresh()
+        logging.info(f"Loaded {len(self.rows)} cached embeddings for {self.model_name}")
+
+    def read_dimension(self):
+        if self.dimension is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as file:
+                self.dimension = json.load(file)["dimension"]
+        return self.dimension
+
+    def refresh(self):
+        # read the index rows appended since the last call, by this or another process, call with self.lock held
+        if self.read_dimension() is None or not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as file:
+            file.seek(self.index_offset)
+            data = file.read()
+        # a line without its newline is still being written, it's read on the next call
+        complete = data[:data.rfind(b"\n") + 1]
+        hashes = complete.decode("ascii").split()
+        # the vectors are written before the index, rows without their vector are left from a damaged file
+        available_rows = os.path.getsize(self.vectors_path) // (self.dimension * 4) if os.path.exists(self.vectors_path) else 0
+        if self.num_rows + len(hashes) > available_rows:
+            logging.warning(f"The embedding cache index has {self.num_rows + len(hashes) - available_rows} rows without vectors, ignoring them")
+            hashes = hashes[:max(0, available_rows - self.num_rows)]
+            complete = b"".join(hash_value.encode("ascii") + b"\n" for hash_value in hashes)
+        for hash_value in hashes:
+            self.rows.setdefault(hash_value, self.num_rows)
+            self.num_rows += 1
+        self.index_offset += len(complete)
+        if hashes:
+            self.remap()
+
+    def remap(self):
+        if self.num_rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(self.num_rows, self.dimension))
+
+    def append(self, hashes, vectors):
+        # call with self.lock held, the lock file keeps other processes out meanwhile
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.read_dimension() is None:
+                    self.dimension = int(vectors.shape[1])
+                    with open(self.meta_path + ".tmp", "w") as file:
+                        json.dump({"model": self.model_name, "dimension": self.dimension}, file)
+                    os.replace(self.meta_path + ".tmp", self.meta_path)
+                # rows appended by other processes, the new rows go after them
+                self.refresh()
+                new = [(hash_value, vector) for hash_value, vector in zip(hashes, vectors) if hash_value not in self.rows]
+                if not new:
+                    return
+                # the index is the source of truth, rows of vectors.f32 past it are leftovers of an
+                # interrupted write and are overwritten
+                with open(self.index_path, "ab") as file:
+                    index_size = file.tell()
+                if index_size != self.index_offset:
+                    # an unterminated line of an interrupted write
+                    os.truncate(self.index_path, self.index_offset)
+                with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as file:
+                    file.seek(self.num_rows * self.dimension * 4)
+                    file.write(np.stack([vector for _, vector in new]).tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+                with open(self.index_path, "ab") as file:
+                    file.write("".join(hash_value + "\n" for hash_value, _ in new).encode("ascii"))
+                self.refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def lookup(self, hashes, refresh=False):
+        with self.lock:
+            if refresh and any(hash_value not in self.rows for hash_value in hashes):
+                self.refresh()
+            return [self.vectors[self.rows[hash_value]].tolist() if hash_value in self.rows else None
+                    for hash_value in hashes]
+
+    def uncached(self, texts):
+        # the texts that would have to be sent to the embedding API
+        with self.lock:
+            self.refresh()
+            return [text for text in texts if text_hash(text) not in self.rows]
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        # another process may have embedded the missing texts already
+        vectors = self.lookup(hashes, refresh=True)
+        # embed every missing text once, even if it appears several times
+        missing = {}
+        for text, hash_value, vector in zip(texts, hashes, vectors):
+            if vector is None:
+                missing.setdefault(hash_value, text)
+        if missing:
+            logging.info(f"Embedding {len(missing)} of {len(texts)} texts, the rest are cached")
+            # round to float32 right away so fresh and cached vectors are identical
+            new_vectors = np.asarray(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32).tolist()
+            with self.lock:
+                self.append(list(missing), new_vectors)
+            by_hash = dict(zip(missing, new_vectors))
+            vectors = [by_hash[hash_value] if vector is None else vector
+                       for hash_value, vector in zip(hashes, vectors)]
+        return vectors
+
+    def remember_queries(self, hashes, vectors):
+        with self.lock:
+            for hash_value, vector in zip(hashes, vectors):
+                self.queries[hash_value] = vector
+                self.queries.move_to_end(hash_value)
+            while len(self.queries) > self.query_cache_size:
+                self.queries.popitem(last=False)
+
+    def embed_queries(self, texts):
+        """
+        Embed prompts in one batched call, like embed_documents, but keep their vectors in memory
+        instead of the disk cache, embed_query finds them there.
+        """
+        hashes = [text_hash(text) for text in texts]
+        with self.lock:
+            vectors = [self.queries.get(hash_value) for hash_value in hashes]
+        missing = {}
+        for text, hash_value, vector in zip(texts, hashes, vectors):
+            if vector is None:
+                missing.setdefault(hash_value, text)
+        if missing:
+            new_vectors = np.asarray(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32).tolist()
+            by_hash = dict(zip(missing, new_vectors))
+            vectors = [by_hash[hash_value] if vector is None else vector
+                       for hash_value, vector in zip(hashes, vectors)]
+        self.remember_queries(hashes, vectors)
+        return vectors
+
+    def embed_query(self, text):
+        hash_value = text_hash(text)
+        with self.lock:
+            vector = self.queries.get(hash_value)
+        if vector is None:
+            vector = self.lookup([hash_value])[0]
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32).tolist()
+        self.remember_queries([hash_value], [vector])
+        return vector
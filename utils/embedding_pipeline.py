@@ -0,0 +1,116 @@
+# basic imports
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# user defined imports
+from utils.tokens import count_tokens
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+embedding_model_name = "text-embedding-ada-002"
+# number of chunks sent to the embedding API in one request
+embedding_batch_size = int(os.environ.get("RFP_EMBEDDING_BATCH_SIZE", 128))
+# number of embedding requests in flight at once
+embedding_workers = int(os.environ.get("RFP_EMBEDDING_WORKERS", 4))
+# tokens the embedding API may receive per minute, keep it below the account's limit
+embedding_tokens_per_minute = int(os.environ.get("RFP_EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+
+
+class TokenBudget:
+    """
+    Sliding one-minute window of spent tokens, acquire() blocks until the tokens fit in the window.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.tokens_per_minute = tokens_per_minute
+        self.spent = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        # a batch larger than the whole budget still goes through, it just waits for an empty window
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.spent and now - self.spent[0][0] >= 60:
+                    self.spent.popleft()
+                in_window = sum(spent_tokens for _, spent_tokens in self.spent)
+                if in_window + tokens <= self.tokens_per_minute:
+                    self.spent.append((now, tokens))
+                    return
+                wait_for = 60 - (now - self.spent[0][0])
+            time.sleep(max(wait_for, 0.05))
+
+
+def batched(items, batch_size=embedding_batch_size):
+    # group any iterable into lists of batch_size items without reading it all into memory
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_in_batches(batches, embedding_function, max_workers=embedding_workers,
+                     tokens_per_minute=embedding_tokens_per_minute, progress_callback=None):
+    """
+    Embed batches of texts over a pool of workers without going over the token budget.
+    batches is an iterable of (key, texts) pairs and is read lazily, at most max_workers batches are
+    held in memory at once. Yields (key, vectors) for every finished batch; batches finish out of
+    order, the caller should store each one as it arrives so an interrupted run only has to embed
+    the batches that did not finish.
+    progress_callback, if given, is called with a status message after every batch.
+    """
+    budget = TokenBudget(tokens_per_minute)
+    batches = iter(batches)
+    total_tokens = 0
+    done_texts = 0
+    started = time.monotonic()
+
+    logging.info(f"Embedding batches with {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        exhausted = False
+        try:
+            while not exhausted or pending:
+                # keep at most max_workers batches in flight, each one waits for its share of the budget
+                while not exhausted and len(pending) < max_workers:
+                    try:
+                        key, texts = next(batches)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    # cached texts are not sent to the API and don't count against the budget
+                    to_embed = embedding_function.uncached(texts) if hasattr(embedding_function, "uncached") else texts
+                    batch_tokens = sum(count_tokens(text, embedding_model_name) for text in to_embed)
+                    if batch_tokens:
+                        budget.acquire(batch_tokens)
+                    future = executor.submit(embedding_function.embed_documents, texts)
+                    pending[future] = (key, len(texts), batch_tokens)
+
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, batch_length, batch_tokens = pending.pop(future)
+                    vectors = future.result()
+                    done_texts += batch_length
+                    total_tokens += batch_tokens
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    message = (f"Embedded {done_texts} chunks "
+                               f"({done_texts / elapsed:.1f} chunks/s, {total_tokens / elapsed:.0f} tokens/s)")
+                    logging.info(message)
+                    if progress_callback is not None:
+                        progress_callback(message)
+                    yield key, vectors
+        finally:
+            for future in pending:
+                future.cancel()
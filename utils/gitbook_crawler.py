@@ -0,0 +1,144 @@
+# basic imports
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+manual_base_url = "https://manual.company_name.io/"
+# url -> etag, last modified header and parsed content of every crawled page
+page_cache_path = "ION-manual/page_cache.json"
+crawler_workers = int(os.environ.get("RFP_CRAWLER_WORKERS", 8))
+crawler_timeout = 30 # seconds
+# same selector GitbookLoader uses for the page content
+content_selector = "main"
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    # one pooled session shared by all crawler workers
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=crawler_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+    })
+    return session
+
+
+def load_page_cache(cache_path=page_cache_path):
+    try:
+        with open(cache_path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_page_cache(cache, cache_path=page_cache_path):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(cache, file)
+    os.replace(tmp_path, cache_path)
+
+
+def get_page_urls(base_url):
+    # every page of the manual is listed in its sitemap
+    base_url = base_url.rstrip("/")
+    res = get_session().get(f"{base_url}/sitemap.xml", timeout=crawler_timeout)
+    res.raise_for_status()
+    soup = BeautifulSoup(res.text, "html.parser")
+    return [urljoin(base_url, urlparse(loc.text).path) for loc in soup.find_all("loc")]
+
+
+def parse_page(html):
+    # same output as GitbookLoader: the text of the main element and the first h1 as the title
+    soup = BeautifulSoup(html, "html.parser")
+    page_content_raw = soup.find(content_selector)
+    if not page_content_raw:
+        return None
+    title_if_exists = page_content_raw.find("h1")
+    return {
+        "page_content": page_content_raw.get_text(separator="\n").strip(),
+        "title": title_if_exists.text if title_if_exists else "",
+    }
+
+
+def fetch_page(url, cached):
+    """
+    Fetch one page, sending the validators of the cached copy so unchanged pages come back as 304.
+    Returns (cache entry or None, True if the page content changed).
+    """
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        res = get_session().get(url, headers=headers, timeout=crawler_timeout)
+        if res.status_code == 304:
+            return cached, False
+        res.raise_for_status()
+    except requests.RequestException as error:
+        if cached is None:
+            raise
+        # keep the last good copy of the page instead of dropping it from the manual
+        logging.warning(f"Could not fetch {url} ({error}), keeping the cached copy")
+        return cached, False
+
+    res.encoding = res.apparent_encoding
+    page = parse_page(res.text)
+    if page is None:
+        return None, cached is not None
+    entry = {
+        "etag": res.headers.get("ETag"),
+        "last_modified": res.headers.get("Last-Modified"),
+        "page_content": page["page_content"],
+        "title": page["title"],
+    }
+    changed = cached is None or (cached["page_content"], cached["title"]) != (entry["page_content"], entry["title"])
+    return entry, changed
+
+
+def crawl_manual(base_url=manual_base_url, cache_path=page_cache_path, max_workers=crawler_workers):
+    """
+    Crawl every page of the manual over a pool of workers, re-crawls only download pages that changed.
+    Returns the pages in sitemap order in the page_content/metadata shape of manual.json. The ingest
+    finds the changed chunks by their content hashes, so unchanged pages cost nothing there either.
+    """
+    logging.info(f"Crawling the manual at {base_url}")
+    cache = load_page_cache(cache_path)
+    urls = get_page_urls(base_url)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda url: fetch_page(url, cache.get(url)), urls))
+
+    new_cache = {}
+    pages = []
+    crawled = set(urls)
+    # new, changed or removed since the last crawl
+    changed_count = sum(1 for url in cache if url not in crawled)
+    for url, (entry, changed) in zip(urls, results):
+        changed_count += changed
+        if entry is None:
+            continue
+        new_cache[url] = entry
+        pages.append({
+            "page_content": entry["page_content"],
+            "metadata": {
+                "source": url,
+                "title": entry["title"],
+            },
+        })
+    save_page_cache(new_cache, cache_path)
+    logging.info(f"Crawled {len(urls)} pages, {changed_count} changed")
+    return pages
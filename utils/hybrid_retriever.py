@@ -0,0 +1,62 @@
+# basic imports
+import logging
+from typing import Any, List
+
+# langchain imports
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combines the vector retriever with a BM25 index over the same chunks using reciprocal rank fusion,
+    so chunks that contain the exact product terms of the question (XML, OPC-UA, SSO, ...) are found
+    even when their embedding is not among the closest ones.
+    """
+
+    vector_retriever: BaseRetriever
+    # BM25Index from utils.bm25 and the chroma collection its chunk ids point into
+    lexical_index: Any
+    collection: Any
+    k: int = 6
+    vector_weight: float = 1.0
+    lexical_weight: float = 1.0
+    # rank constant of reciprocal rank fusion, larger values flatten the difference between ranks
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def lexical_documents(self, query):
+        hits = self.lexical_index.search(query, self.k)
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        found = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def fuse(self, vector_docs, lexical_docs):
+        scores = {}
+        docs = {}
+        for weight, ranked in ((self.vector_weight, vector_docs), (self.lexical_weight, lexical_docs)):
+            for rank, doc in enumerate(ranked):
+                key = (doc.metadata.get("source", ""), doc.page_content)
+                docs.setdefault(key, doc)
+                scores[key] = scores.get(key, 0) + weight / (self.rrf_k + rank + 1)
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [docs[key] for key in best]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vector_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        return self.fuse(vector_docs, self.lexical_documents(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = await self.vector_retriever.aget_relevant_documents(query, callbacks=run_manager.get_child())
+        return self.fuse(vector_docs, self.lexical_documents(query))
@@ -3,23 +3,23 @@ import spacy
 import textacy
 
 from utils.csv_reader import read_csv
+from utils.nlp import pipe
 
 def input_apply_nlp(rfps_arr):
     logging.info('Applying NLP to input file data')
     toRet = []
     processed=''
 
-    for record in rfps_arr:
-        nlp = spacy.load("en_core_web_sm")
+    # tag the first word of every record in batches
+    docs = pipe(record.split(" ")[0] for record in rfps_arr)
+
+    for record, doc in zip(rfps_arr, docs):
 
         # we only need maximum upto 3 words
         first_word = record.split(" ")[0]
         rest = record.split(" ")[1:]
         rest= " ".join(rest)
 
-        # join the list of the 3 words as a string
-        doc= nlp("".join(first_word))
-
         # check if the first word is a noun, verb or adj
         verb = [token.text for token in doc if token.pos_ == "VERB"]
         noun = [token.text for token in doc if token.pos_ == "NOUN"] 
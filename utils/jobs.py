@@ -0,0 +1,346 @@
+# basic imports
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+from ingest import get_corpus_version
+from utils.rfp_processor import answer_rows, ResponseWriter
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# RFP files are processed as jobs by background threads, so switching tabs or reloading the page doesn't stop them
+jobs_path = os.environ.get("RFP_JOBS_PATH", "cache/jobs.sqlite3")
+# number of files processed at the same time, every file already answers several prompts at once
+job_workers = int(os.environ.get("RFP_JOB_WORKERS", 1))
+# seconds an idle worker waits before it looks for queued jobs again
+job_poll_interval = 5
+# finished jobs (done or failed) are deleted with their rows after this many days without an update
+job_max_age_days = float(os.environ.get("RFP_JOB_MAX_AGE_DAYS", 7))
+# seconds between the heartbeats a runner writes for its running jobs
+job_heartbeat_interval = 15
+# a running job whose heartbeat is older than this lost its runner (the app stopped) and is queued again
+job_stale_after = 120
+# identifies the process running a job, several app processes can share the jobs database
+job_owner = f"{socket.gethostname()}:{os.getpid()}"
+
+# (job id, row index) -> text of an answer that is being streamed in, kept in memory only
+partial_answers = {}
+partial_answers_lock = threading.Lock()
+
+job_runner = None
+job_runner_lock = threading.Lock()
+
+
+def connect(path=jobs_path):
+    # sqlite connections can't be shared between threads, so every call opens its own
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    # written is the number of rows, in row order, that are in the response and history files
+    # owner is the process running the job, it updates heartbeat while the job runs
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "job_id TEXT PRIMARY KEY, status TEXT, total INTEGER, response_file_path TEXT, error TEXT, created REAL, updated REAL, "
+        "written INTEGER DEFAULT 0, owner TEXT, heartbeat REAL)"
+    )
+    add_missing_columns(connection, "jobs", {"written": "INTEGER DEFAULT 0", "owner": "TEXT", "heartbeat": "REAL"})
+    # response is NULL until the row is answered, answered rows are the checkpoints a job resumes from
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS job_rows ("
+        "job_id TEXT, row_index INTEGER, prompt TEXT, response TEXT, PRIMARY KEY (job_id, row_index))"
+    )
+    return connection
+
+
+def add_missing_columns(connection, table, columns):
+    # jobs databases created by an older version of the app lack the newer columns
+    existing = set(row[1] for row in connection.execute(f"PRAGMA table_info({table})"))
+    for name, definition in columns.items():
+        if name not in existing:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def make_job_id(rows, corpus_version):
+    # the same file uploaded again (another user, a reload) against the same data is the same job
+    job_hash = hashlib.sha256(corpus_version.encode("utf-8"))
+    for row in rows:
+        job_hash.update(b"\x00" + row.encode("utf-8"))
+    return job_hash.hexdigest()
+
+
+def response_to_record(response):
+    record = {key: value for key, value in response.items() if key != "source_documents"}
+    record["source_documents"] = [
+        {"page_content": doc.page_content, "metadata": doc.metadata} for doc in response["source_documents"]
+    ]
+    return json.dumps(record)
+
+
+def response_from_record(record):
+    response = json.loads(record)
+    response["source_documents"] = [
+        Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in response["source_documents"]
+    ]
+    return response
+
+
+def submit_job(rows, response_folder_path, path=jobs_path):
+    """
+    Queue the prompts of an RFP file and return the job id. A job that already exists for the
+    same file is not queued again, a failed one is resumed from its answered rows.
+    """
+    job_id = make_job_id(rows, get_corpus_version())
+    now = time.time()
+    connection = connect(path)
+    try:
+        with connection:
+            row = connection.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                logging.info(f"Queueing job {job_id[:12]} with {len(rows)} prompts")
+                response_file_path = os.path.join(response_folder_path, f"job_{job_id[:16]}.csv")
+                connection.execute(
+                    "INSERT INTO jobs (job_id, status, total, response_file_path, error, created, updated) VALUES (?, 'queued', ?, ?, NULL, ?, ?)",
+                    (job_id, len(rows), response_file_path, now, now),
+                )
+                connection.executemany(
+                    "INSERT INTO job_rows (job_id, row_index, prompt, response) VALUES (?, ?, ?, NULL)",
+                    [(job_id, index, row) for index, row in enumerate(rows)],
+                )
+            elif row[0] == "failed":
+                logging.info(f"Resuming failed job {job_id[:12]}")
+                connection.execute("UPDATE jobs SET status = 'queued', error = NULL, updated = ? WHERE job_id = ?", (now, job_id))
+    finally:
+        connection.close()
+    if job_runner is not None:
+        job_runner.wake()
+    return job_id
+
+
+def resume_job(job_id, path=jobs_path):
+    # queue a failed job again, it continues after its answered rows
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("UPDATE jobs SET status = 'queued', error = NULL, updated = ? WHERE job_id = ? AND status = 'failed'",
+                               (time.time(), job_id))
+    finally:
+        connection.close()
+    logging.info(f"Resuming failed job {job_id[:12]}")
+    if job_runner is not None:
+        job_runner.wake()
+
+
+def prune_jobs(max_age_days=job_max_age_days, path=jobs_path):
+    # drop finished jobs that were not updated for max_age_days, queued and running jobs are kept
+    logging.info("Removing old jobs from the jobs database")
+    connection = connect(path)
+    try:
+        with connection:
+            cutoff = time.time() - max_age_days * 24 * 3600
+            connection.execute(
+                "DELETE FROM job_rows WHERE job_id IN ("
+                "SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND updated < ?)", (cutoff,)
+            )
+            connection.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,))
+    finally:
+        connection.close()
+
+
+def get_job(job_id, path=jobs_path):
+    # status (queued, running, done or failed), number of prompts and answered prompts, error and response file
+    connection = connect(path)
+    try:
+        row = connection.execute(
+            "SELECT status, total, error, response_file_path FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        answered = connection.execute(
+            "SELECT COUNT(*) FROM job_rows WHERE job_id = ? AND response IS NOT NULL", (job_id,)
+        ).fetchone()[0]
+    finally:
+        connection.close()
+    status, total, error, response_file_path = row
+    return {"job_id": job_id, "status": status, "total": total, "answered": answered, "error": error,
+            "response_file_path": response_file_path}
+
+
+def get_job_responses(job_id, start=0, path=jobs_path):
+    # answered rows from row start on, as (row index, response) in row order
+    connection = connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT row_index, response FROM job_rows WHERE job_id = ? AND row_index >= ? AND response IS NOT NULL ORDER BY row_index",
+            (job_id, start),
+        ).fetchall()
+    finally:
+        connection.close()
+    return [(index, response_from_record(record)) for index, record in rows]
+
+
+def get_partial_answers(job_id):
+    # row index -> text so far of the answers of the job that are being generated
+    with partial_answers_lock:
+        return {index: text for (partial_job_id, index), text in partial_answers.items() if partial_job_id == job_id}
+
+
+def claim_job(path=jobs_path, owner=job_owner):
+    """
+    Take the oldest queued job for owner, BEGIN IMMEDIATE makes sure two workers never take the same one.
+    Running jobs whose runner stopped sending heartbeats are queued again first, they continue from
+    their checkpoints; jobs that another live process is running are left alone.
+    """
+    connection = connect(path)
+    try:
+        connection.isolation_level = None
+        connection.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        stale = connection.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+            (now - job_stale_after,),
+        ).rowcount
+        if stale:
+            logging.info(f"Queueing {stale} jobs again, their runner stopped")
+        row = connection.execute("SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+        if row is not None:
+            connection.execute("UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, updated = ? WHERE job_id = ?",
+                               (owner, now, now, row[0]))
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+    return None if row is None else row[0]
+
+
+def beat_jobs(job_ids, path=jobs_path, owner=job_owner):
+    # tell the other processes the jobs are still running
+    connection = connect(path)
+    try:
+        with connection:
+            connection.executemany("UPDATE jobs SET heartbeat = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                                   [(time.time(), job_id, owner) for job_id in job_ids])
+    finally:
+        connection.close()
+
+
+def set_job_status(job_id, status, error=None, path=jobs_path):
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE job_id = ?",
+                               (status, error, time.time(), job_id))
+    finally:
+        connection.close()
+
+
+def run_job(job_id, db, history_file_path, path=jobs_path):
+    connection = connect(path)
+    try:
+        response_file_path, written = connection.execute(
+            "SELECT response_file_path, written FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        job_rows = connection.execute(
+            "SELECT row_index, prompt, response FROM job_rows WHERE job_id = ? ORDER BY row_index", (job_id,)
+        ).fetchall()
+        rows = [prompt for _, prompt, _ in job_rows]
+        done = {index: response_from_record(record) for index, _, record in job_rows if record is not None}
+        logging.info(f"Running job {job_id[:12]}, {len(done)} of {len(rows)} prompts answered before")
+        # the rows answered before are written again, the ones already in the history file are not repeated there
+        writer = ResponseWriter(response_file_path, history_file_path, done, history_written=written)
+
+        def on_token(index, text):
+            with partial_answers_lock:
+                partial_answers[(job_id, index)] = text
+
+        for index, response_data in answer_rows(rows, db, history_file_path, done, on_token):
+            # every answered row is a checkpoint, an interrupted job continues after it
+            with connection:
+                connection.execute("UPDATE job_rows SET response = ? WHERE job_id = ? AND row_index = ?",
+                                   (response_to_record(response_data), job_id, index))
+            done[index] = response_data
+            with partial_answers_lock:
+                partial_answers.pop((job_id, index), None)
+            # the row goes to the files once every row above it is answered
+            writer.add(index, response_data)
+            with connection:
+                connection.execute("UPDATE jobs SET written = ? WHERE job_id = ?", (writer.history_written, job_id))
+    finally:
+        connection.close()
+    writer.close()
+    set_job_status(job_id, "done", path=path)
+    logging.info(f"Job {job_id[:12]} done")
+
+
+class JobRunner:
+    """
+    Worker threads that take queued jobs from the jobs database and process them, one job per
+    thread. db_loader returns the vector store the jobs are answered with. A heartbeat thread
+    marks the jobs of the runner as alive; jobs that were running when the app stopped are picked
+    up again from their checkpoints once their heartbeat is stale.
+    """
+
+    def __init__(self, db_loader, history_file_path, num_workers=job_workers, path=jobs_path, owner=job_owner):
+        self.db_loader = db_loader
+        self.history_file_path = history_file_path
+        self.path = path
+        self.owner = owner
+        self.wake_event = threading.Event()
+        self.running = set()
+        self.running_lock = threading.Lock()
+        prune_jobs(path=path)
+        self.heartbeat_thread = threading.Thread(target=self.beat, daemon=True)
+        self.heartbeat_thread.start()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(num_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def wake(self):
+        self.wake_event.set()
+
+    def beat(self):
+        while True:
+            time.sleep(job_heartbeat_interval)
+            with self.running_lock:
+                job_ids = list(self.running)
+            if job_ids:
+                try:
+                    beat_jobs(job_ids, self.path, self.owner)
+                except sqlite3.Error:
+                    logging.exception("Could not update the heartbeat of the running jobs")
+
+    def work(self):
+        while True:
+            job_id = claim_job(self.path, self.owner)
+            if job_id is None:
+                self.wake_event.wait(job_poll_interval)
+                self.wake_event.clear()
+                continue
+            with self.running_lock:
+                self.running.add(job_id)
+            try:
+                run_job(job_id, self.db_loader(), self.history_file_path, self.path)
+            except Exception as error:
+                logging.exception(f"Job {job_id[:12]} failed")
+                set_job_status(job_id, "failed", f"{error.__class__.__name__}: {error}", self.path)
+            finally:
+                with self.running_lock:
+                    self.running.discard(job_id)
+            prune_jobs(path=self.path)
+
+
+def start_job_runner(db_loader, history_file_path):
+    # one runner per process, shared by every streamlit session
+    global job_runner
+    with job_runner_lock:
+        if job_runner is None:
+            job_runner = JobRunner(db_loader, history_file_path)
+    return job_runner
@@ -0,0 +1,188 @@
+# basic imports
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, List, Optional
+
+# langchain imports
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms import LlamaCpp
+from langchain.llms.base import LLM
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# quantized llama model loaded by the worker process, see "Switching to Llama2" in the README
+local_model_path = os.environ.get("RFP_LOCAL_MODEL_PATH", "llama-2-13b-chat.ggmlv3.q4_0.bin")
+# the context window is the main memory cost of the model, prompt and answer have to fit into it
+local_model_n_ctx = int(os.environ.get("RFP_LOCAL_N_CTX", 2048))
+local_model_max_tokens = 256
+local_model_threads = int(os.environ.get("RFP_LOCAL_THREADS", os.cpu_count() or 4))
+# caps that keep the prompt within n_ctx: the number of retrieved chunks and the context tokens
+local_max_k = int(os.environ.get("RFP_LOCAL_MAX_K", 4))
+# about 300 tokens are left for the prompt template and the question
+local_context_token_budget = local_model_n_ctx - local_model_max_tokens - 300
+# at most this many queued prompts are handed to the model at once
+local_batch_size = int(os.environ.get("RFP_LOCAL_BATCH_SIZE", 4))
+# how long the worker waits for more prompts before it starts a batch
+local_batch_wait = 0.05 # seconds
+# seconds a prompt may take before the caller gives up, the model answers one prompt after another on CPU
+local_request_timeout = 600
+
+
+def load_local_model(model_path, n_ctx):
+    # CPU only: no layers are offloaded, so the app runs on machines without a GPU (and in docker)
+    return LlamaCpp(
+        model_path=model_path,
+        temperature=0,
+        n_ctx=n_ctx,
+        n_gpu_layers=0,
+        n_batch=512,
+        n_threads=local_model_threads,
+        max_tokens=local_model_max_tokens,
+        f16_kv=True,
+        verbose=False,
+    )
+
+
+def serve(requests, replies, model_path, n_ctx, batch_size):
+    """
+    Body of the worker process: loads the model once and answers prompts from the requests queue
+    until it receives None. Prompts that are waiting at the same time are passed to the model as one
+    batch, replies are (request id, text, error message).
+    """
+    llm = load_local_model(model_path, n_ctx)
+    replies.put(("ready", None, None))
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        batch = [request]
+        while len(batch) < batch_size:
+            try:
+                request = requests.get(timeout=local_batch_wait)
+            except queue.Empty:
+                break
+            if request is None:
+                requests.put(None)
+                break
+            batch.append(request)
+
+        # prompts with the same stop words can go through one generate() call
+        for stop, group in itertools.groupby(sorted(batch, key=lambda item: repr(item[2])), key=lambda item: item[2]):
+            group = list(group)
+            try:
+                result = llm.generate([prompt for _, prompt, _ in group], stop=stop)
+            except Exception as error:
+                for request_id, _, _ in group:
+                    replies.put((request_id, None, f"{error.__class__.__name__}: {error}"))
+                continue
+            for (request_id, _, _), generations in zip(group, result.generations):
+                replies.put((request_id, generations[0].text, None))
+
+
+class LocalLLMServer:
+    """
+    Client side of the worker process. Every streamlit session and worker thread of the app
+    submits its prompts here, a dispatcher thread hands the replies back to the waiting callers.
+    """
+
+    def __init__(self, model_path=local_model_path, n_ctx=local_model_n_ctx, batch_size=local_batch_size):
+        # spawn instead of fork, the streamlit process has threads running that must not be copied
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.replies = context.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.ready = threading.Event()
+        logging.info(f"Starting the local LLM worker process with {model_path}")
+        self.process = context.Process(target=serve, args=(self.requests, self.replies, model_path, n_ctx, batch_size),
+                                       daemon=True)
+        self.process.start()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def dispatch(self):
+        while True:
+            try:
+                request_id, text, error = self.replies.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    self.fail_pending("The local LLM worker process exited")
+                    return
+                continue
+            if request_id == "ready":
+                logging.info("The local LLM is loaded")
+                self.ready.set()
+                continue
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(text)
+
+    def fail_pending(self, message):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(message))
+
+    def submit(self, prompt, stop=None):
+        # returns the request id and a Future with the generated text
+        future = Future()
+        with self.lock:
+            if not self.process.is_alive():
+                raise RuntimeError("The local LLM worker process is not running")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+        self.requests.put((request_id, prompt, stop))
+        return request_id, future
+
+    def generate(self, prompt, stop=None, timeout=None):
+        # waits for the generated text, after a timeout the request is forgotten and its late reply is dropped
+        request_id, future = self.submit(prompt, stop)
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def shutdown(self):
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout=10)
+        self.fail_pending("The local LLM worker process was stopped")
+
+
+@lru_cache(maxsize=None)
+def get_local_llm_server():
+    # one worker process per app process, the model stays loaded between prompts and sessions
+    server = LocalLLMServer()
+    atexit.register(server.shutdown)
+    return server
+
+
+class LocalLLM(LLM):
+    """
+    LangChain LLM that sends its prompts to the shared local model worker process.
+    """
+
+    timeout: float = local_request_timeout
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-llama-cpp"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None,
+              **kwargs: Any) -> str:
+        return get_local_llm_server().generate(prompt, stop, timeout=self.timeout)
@@ -1,33 +1,63 @@
 # basic imports
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
+import queue
+import random
 import spacy
 import textacy
+import threading
+import time
+import datetime
 import logging
+from functools import lru_cache
 
 # user defined imports
 from dotenv import load_dotenv
+from utils.nlp import pipe
 
 # setting configs
 load_dotenv()
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
 
-def apply_nlp(clean_records):
+# Airtable allows 5 requests per second per base
+airtable_requests_per_second = 5
+airtable_timeout = 30 # seconds
+airtable_max_retries = 5
+# number of fetched pages that may wait for the NLP stage
+airtable_prefetch_pages = 10
+# record id -> last modified time and processed requirement of every synced record
+airtable_sync_state_path = "Airtable_data/sync_state.json"
+# field holding the record's last modified time, the sync time is used if the table has no such field
+airtable_last_modified_field = os.environ.get("AT_LAST_MODIFIED_FIELD", "Last Modified")
+# small field requested when listing record ids to find deleted records
+airtable_id_listing_field = "Opt In"
+# deleted records are only looked for every this many delta syncs, listing every id takes a request per page of the table
+airtable_reconcile_every = int(os.environ.get("AT_RECONCILE_EVERY", 10))
+# records modified this long before the last sync are fetched again, covers clock differences
+airtable_sync_margin = datetime.timedelta(minutes=5)
+
+rate_limit_lock = threading.Lock()
+last_request_time = 0.0
+
+
+def iter_apply_nlp(clean_records):
+    # clean_records can be a generator (e.g. records streamed from the Airtable API), it is read lazily
     logging.info('Applying NLP to Airtable data')
-    toRet = []
 
-    for record in clean_records:
-        nlp = spacy.load("en_core_web_sm")
+    # extract the requirment field, we only need maximum upto 3 words
+    # join the list of the 3 words as a string and tag all of them in batches
+    for record, processed in iter_apply_nlp_with_records(clean_records):
+        yield processed
 
-        # extract the requirment field
-        requirement = record['fields'].get('Requirement')
 
-        # we only need maximum upto 3 words
-        first_3_words = requirement.split(" ")[0:3]
-        
-        # join the list of the 3 words as a string
-        doc= nlp(" ".join(first_3_words))
+def iter_apply_nlp_with_records(clean_records):
+    # same as iter_apply_nlp but yields (record, processed requirement) pairs
+    texts = ((" ".join(record['fields'].get('Requirement').split(" ")[0:3]), record) for record in clean_records)
+
+    for doc, record in pipe(texts, as_tuples=True):
+        first_3_words = record['fields'].get('Requirement').split(" ")[0:3]
 
         # look for verbs, nouns, adjs in those 3 words
         verbs = [token.text for token in doc if token.pos_ == "VERB"]
@@ -68,80 +98,222 @@ def apply_nlp(clean_records):
                 processed =  f"softwaredoes: {record['fields']['Requirement']}"
             else:
                 processed =  f"softwaredoes not: {record['fields']['Requirement']}"
-        toRet.append(processed)
+        yield record, processed
 
-    return toRet
 
+@lru_cache(maxsize=None)
+def get_session():
+    # one pooled session per process, so every page reuses the same connection
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    session.headers.update({
+        'Authorization': f"Bearer {os.environ['AT_TOKEN']}",
+        'Content-Type': 'application/json',
+    })
+    return session
 
-    
 
-def remove_empty_records(records):
-    logging.info('Removing empty records from Airtable data')
-    records=records
-    for record in records:
-        # print(record['fields'])
-        if record['fields'].get('Requirement')is None:
-            records.remove(record)
-    return records
+def wait_for_rate_limit():
+    # space the requests so we never send more than airtable_requests_per_second
+    global last_request_time
+    with rate_limit_lock:
+        wait_for = last_request_time + 1 / airtable_requests_per_second - time.monotonic()
+        if wait_for > 0:
+            time.sleep(wait_for)
+        last_request_time = time.monotonic()
 
 
-def send_request(end_point, offset):
-    logging.info('Sending request to Airtable API')
-    print(f'Fetching records offset: {offset} at: {end_point}')
-    token = os.environ['AT_TOKEN']
-    headers = {
-        'Authorization': f"Bearer {token}",
-        'Content-Type': 'application/json',
-    }
+def send_request(end_point, offset, params=None):
+    logging.info(f'Sending request to Airtable API, offset: {offset}')
+    params = dict(params or {})
     if offset is not None:
-        end_point += f'&offset={offset}'
-    res = requests.get(end_point, headers=headers)
-    print(res)
-    return res.json()
+        params['offset'] = offset
+    attempt = 0
+    while True:
+        wait_for_rate_limit()
+        try:
+            res = get_session().get(end_point, params=params, timeout=airtable_timeout)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            res = None
+            reason = error.__class__.__name__
+        else:
+            reason = res.status_code
+        # retry rate-limited requests, server errors and dropped connections with exponential backoff
+        if res is None or res.status_code == 429 or res.status_code >= 500:
+            attempt += 1
+            if attempt > airtable_max_retries:
+                if res is None:
+                    raise requests.ConnectionError(f"Airtable request failed after {airtable_max_retries} retries")
+                res.raise_for_status()
+            delay = 2 ** attempt + random.uniform(0, 1)
+            # airtable asks clients to wait 30 seconds after a 429
+            if res is not None and res.status_code == 429:
+                delay = max(delay, float(res.headers.get('Retry-After', 30)))
+            logging.warning(f'Airtable request failed ({reason}), retrying in {delay:.1f}s (attempt {attempt}/{airtable_max_retries})')
+            time.sleep(delay)
+            continue
+        res.raise_for_status()
+        return res.json()
 
-def get_all_records(endpoint):
+
+def iter_record_pages(endpoint, params=None):
+    """
+    Yield the records of every page of the table as soon as the page arrives. Pages are fetched by a
+    background thread that follows the offsets as fast as the rate limit allows, up to
+    airtable_prefetch_pages pages ahead of the consumer.
+    """
     logging.info("Getting all Airtable records")
-    records = []
-    contains_more_items = True
-    offset = None
-    while contains_more_items:
-        data = send_request(endpoint, offset)
-        # Airtable returns an offset with the value of the record id
-        offset = data.get('offset')
-        if offset is None:
-            contains_more_items = False
-        records.extend(data['records'])
-        print(f'Length of records: {len(records)}')
-
-    return records
+    pages = queue.Queue(maxsize=airtable_prefetch_pages)
+    stop = threading.Event()
+    done = object()
+
+    def fetch_pages():
+        offset = None
+        try:
+            while not stop.is_set():
+                data = send_request(endpoint, offset, params)
+                pages.put(data['records'])
+                # Airtable returns an offset with the value of the record id
+                offset = data.get('offset')
+                if offset is None:
+                    break
+            pages.put(done)
+        except Exception as error:
+            pages.put(error)
+
+    fetcher = threading.Thread(target=fetch_pages, daemon=True)
+    fetcher.start()
+    num_records = 0
+    try:
+        while True:
+            page = pages.get()
+            if page is done:
+                break
+            if isinstance(page, Exception):
+                raise page
+            num_records += len(page)
+            logging.info(f'Length of records: {num_records}')
+            yield page
+    finally:
+        # the consumer stopped early, let the fetcher finish its current request and exit
+        stop.set()
+        while fetcher.is_alive():
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def iter_records(endpoint, params=None):
+    for page in iter_record_pages(endpoint, params):
+        yield from page
+
+
+def get_all_records(endpoint):
+    return list(iter_records(endpoint))
+
 
 def parse_airtable(airtable_data, file_path):
     logging.info("Converting airtable records to JSON objects and saving them to airtable_file_path")
-    json_list = []
-    for row in airtable_data:
-        json_object = {
-            "page_content": row,
-            "metadata": {
-                "source": "",
-                "title": "Airtable data",
-            },
-        }
-        json_list.append(json_object)
-
-    with open(file_path, "w") as file:
-        json.dump(json_list, file)
+    # airtable_data can be a generator, the objects are written as a JSON array one at a time
+    # to a temporary file that replaces file_path once it's complete
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        file.write("[")
+        for num, row in enumerate(airtable_data):
+            json_object = {
+                "page_content": row,
+                "metadata": {
+                    "source": "",
+                    "title": "Airtable data",
+                },
+            }
+            if num:
+                file.write(", ")
+            json.dump(json_object, file)
+        file.write("]")
+    os.replace(tmp_path, file_path)
 
 
 def process_airtable(airtable_file_path):
-    logging.info("Airtable parsing started")
-    # fetch all data from Requirement Airtable
-    records = get_all_records('')
-    
-    # remove empty rows
-    clean_records= remove_empty_records(records)
-    
-    # apply nlp to requirements
-    results=apply_nlp(clean_records)
-    
+    # full refresh, downloads every record and records the sync state for later delta syncs
+    sync_airtable(airtable_file_path, full=True)
+
+
+def load_sync_state(state_path=airtable_sync_state_path):
+    try:
+        with open(state_path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_sync_state(state, state_path=airtable_sync_state_path):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, state_path)
+
+
+def sync_airtable(airtable_file_path, endpoint='', full=False, state_path=airtable_sync_state_path):
+    """
+    Bring airtable_file_path up to date with the Requirement table. Unless full is set (or there is no
+    sync state yet), only records modified since the last sync are downloaded and run through NLP.
+    Records deleted from the table are dropped by a full sync and by every airtable_reconcile_every-th
+    delta sync, which lists the ids of the table. Unchanged records keep their processed text, so
+    ingest_docs() only embeds the chunks of the changed records.
+    Returns the number of changed and deleted records.
+    """
+    state = load_sync_state(state_path)
+    full = full or state is None or not os.path.exists(airtable_file_path) or not os.path.getsize(airtable_file_path)
+    sync_started = datetime.datetime.now(datetime.timezone.utc)
+
+    if full:
+        logging.info("Airtable parsing started (full sync)")
+        state = {"last_sync": None, "records": {}, "runs_since_reconcile": 0}
+        params = None
+        reconcile = False
+    else:
+        since = datetime.datetime.fromisoformat(state["last_sync"]) - airtable_sync_margin
+        logging.info(f"Airtable delta sync started, fetching records modified since {since.isoformat()}")
+        params = {"filterByFormula": f"IS_AFTER(LAST_MODIFIED_TIME(), '{since.strftime('%Y-%m-%dT%H:%M:%S.000Z')}')"}
+        runs_since_reconcile = state.get("runs_since_reconcile", 0) + 1
+        reconcile = runs_since_reconcile >= airtable_reconcile_every
+        state["runs_since_reconcile"] = 0 if reconcile else runs_since_reconcile
+
+    synced = state["records"]
+    changed = 0
+    deleted = 0
+
+    def drop_empty_records(records):
+        # records without a requirement are skipped, those whose requirement was emptied are also dropped from the state
+        nonlocal deleted
+        for record in records:
+            if record['fields'].get('Requirement') is None:
+                if synced.pop(record['id'], None) is not None:
+                    deleted += 1
+                continue
+            yield record
+
+    # stream the (changed) data from Requirement Airtable, pages go through the next steps as they arrive
+    records = drop_empty_records(iter_records(endpoint, params))
+    for record, processed in iter_apply_nlp_with_records(records):
+        modified = record['fields'].get(airtable_last_modified_field, sync_started.isoformat())
+        synced[record['id']] = {"modified": modified, "page_content": processed}
+        changed += 1
+
+    if reconcile:
+        # list the ids of every record with a single small field to find the deleted ones
+        logging.info("Airtable reconcile, looking for deleted records")
+        existing_ids = set(record['id'] for record in iter_records(endpoint, {"fields[]": airtable_id_listing_field}))
+        for record_id in [record_id for record_id in synced if record_id not in existing_ids]:
+            del synced[record_id]
+            deleted += 1
+
     # save airtable data to airtable_file_path
-    parse_airtable(results, airtable_file_path)
+    parse_airtable((entry["page_content"] for entry in synced.values()), airtable_file_path)
+    state["last_sync"] = sync_started.isoformat()
+    save_sync_state(state, state_path)
+    logging.info(f"Airtable sync done, {changed} records changed, {deleted} records deleted")
+    return changed, deleted
@@ -0,0 +1,27 @@
+# basic imports
+import os
+import logging
+from functools import lru_cache
+
+import spacy
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# number of texts tagged per batch and number of processes used by nlp.pipe
+nlp_batch_size = int(os.environ.get("RFP_NLP_BATCH_SIZE", 256))
+nlp_processes = int(os.environ.get("RFP_NLP_PROCESSES", 1))
+
+
+@lru_cache(maxsize=None)
+def load_nlp():
+    # loaded once per process, we only need part-of-speech tags so the slow components are disabled
+    # (the tagger and attribute_ruler set token.pos_)
+    logging.info("Loading the spaCy pipeline")
+    return spacy.load("en_core_web_sm", disable=["ner", "lemmatizer", "parser"])
+
+
+def pipe(texts, batch_size=nlp_batch_size, n_process=nlp_processes, as_tuples=False):
+    # tag many texts at once, much faster than calling nlp() on every text
+    # texts is read lazily, with as_tuples=True it holds (text, context) pairs and (doc, context) pairs are returned
+    return load_nlp().pipe(texts, batch_size=batch_size, n_process=n_process, as_tuples=as_tuples)
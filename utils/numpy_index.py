@@ -0,0 +1,214 @@
+# basic imports
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, List
+
+import numpy as np
+
+# langchain imports
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+from pydantic import Field
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# "numpy" searches the memory-mapped vector matrix exported at ingest time instead of querying chroma,
+# the export is only built when it's enabled
+vector_backend = os.environ.get("RFP_VECTOR_BACKEND", "chroma")
+# the normalized chunk vectors (float32, one row per chunk) and the ids, texts and metadata of the rows,
+# one JSON line per row after a first line with the dimension
+vectors_file_name = "numpy_vectors.f32"
+chunks_file_name = "numpy_chunks.jsonl"
+# number of chunks read from the chroma collection at once while building the index
+export_batch_size = 5000
+# number of prefetched results kept per retriever, prefetches of prompts that were never asked are dropped past it
+max_prefetched_results = 10000
+# number of queries scored in one matrix product, bounds the (queries x chunks) score matrix
+query_batch_size = 256
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def build_numpy_index(collection, directory_path, batch_size=export_batch_size):
+    """
+    Export every chunk of the chroma collection into a normalized float32 matrix on disk, so
+    NumpyIndex can memory-map it. The chunks are written batch by batch, only one batch is held in
+    memory. Both files are replaced atomically once they are complete.
+    """
+    vectors_path = os.path.join(directory_path, vectors_file_name)
+    chunks_path = os.path.join(directory_path, chunks_file_name)
+    count = 0
+    dimension = 0
+    # the dimension is only known after the first batch, the chunk lines go to their own file until then
+    with open(vectors_path + ".tmp", "wb") as vectors_file, open(chunks_path + ".rows.tmp", "w") as chunks_file:
+        while True:
+            found = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=count)
+            if not found["ids"]:
+                break
+            vectors = normalize_rows(np.asarray(found["embeddings"], dtype=np.float32))
+            vectors_file.write(vectors.astype(np.float32).tobytes())
+            dimension = vectors.shape[1]
+            for chunk_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                chunks_file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata or {}}) + "\n")
+            count += len(found["ids"])
+    with open(chunks_path + ".tmp", "w") as file, open(chunks_path + ".rows.tmp", "r") as rows_file:
+        file.write(json.dumps({"dimension": dimension}) + "\n")
+        shutil.copyfileobj(rows_file, file)
+    os.remove(chunks_path + ".rows.tmp")
+    os.replace(vectors_path + ".tmp", vectors_path)
+    os.replace(chunks_path + ".tmp", chunks_path)
+    logging.info(f"Saved the numpy vector index over {count} chunks")
+
+
+def remove_numpy_index(directory_path):
+    # a store version copied from the previous one may carry an export that is out of date
+    for file_name in (vectors_file_name, chunks_file_name):
+        try:
+            os.remove(os.path.join(directory_path, file_name))
+        except FileNotFoundError:
+            pass
+
+
+def load_numpy_index(directory_path):
+    # returns None if the index was not built (the numpy backend was off at ingest time)
+    ids, documents, metadatas = [], [], []
+    try:
+        with open(os.path.join(directory_path, chunks_file_name), "r") as file:
+            header = json.loads(file.readline())
+            for line in file:
+                chunk = json.loads(line)
+                ids.append(chunk["id"])
+                documents.append(chunk["document"])
+                metadatas.append(chunk["metadata"])
+    except FileNotFoundError:
+        return None
+    shape = (len(ids), header["dimension"])
+    if not shape[0]:
+        vectors = np.zeros(shape, dtype=np.float32)
+    else:
+        vectors = np.memmap(os.path.join(directory_path, vectors_file_name), dtype=np.float32, mode="r", shape=shape)
+    return NumpyIndex(vectors, ids, documents, metadatas)
+
+
+class NumpyIndex:
+    """
+    All chunk vectors in one contiguous normalized matrix. A query (or a batch of queries) is a
+    single matrix product, the rows are normalized so the product is the cosine similarity.
+    """
+
+    def __init__(self, vectors, ids, documents, metadatas):
+        self.vectors = vectors
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+
+    def __len__(self):
+        return len(self.ids)
+
+    def document(self, row):
+        return Document(page_content=self.documents[row], metadata=dict(self.metadatas[row]))
+
+    def search(self, query_vectors, k=6):
+        """
+        Top-k rows for every query vector, returns (rows, scores), both of shape (queries, k),
+        best first.
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        k = min(k, len(self))
+        if not k:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(int), empty
+        scores = queries @ self.vectors.T
+        # argpartition finds the k best rows without sorting all of them
+        rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        row_scores = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-row_scores, axis=1)
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(row_scores, order, axis=1)
+
+    def mmr(self, query_vector, candidates, k=6, lambda_mult=0.5):
+        """
+        Maximal marginal relevance over the candidate rows of one query (e.g. its top fetch_k rows),
+        picks k rows that are relevant to the query but not similar to each other.
+        """
+        candidates = np.asarray(candidates)
+        if not len(candidates):
+            return []
+        query = normalize_rows(np.atleast_2d(np.asarray(query_vector, dtype=np.float32)))[0]
+        candidate_vectors = np.asarray(self.vectors[candidates])
+        relevance = candidate_vectors @ query
+        pairwise = candidate_vectors @ candidate_vectors.T
+        selected = [int(np.argmax(relevance))]
+        # highest similarity of every candidate to the rows selected so far
+        redundancy = pairwise[selected[0]].copy()
+        while len(selected) < min(k, len(candidates)):
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            scores[selected] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, pairwise[best])
+        return [int(candidates[index]) for index in selected]
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Retriever over a NumpyIndex with the same search types and defaults as the chroma retriever.
+    prefetch() answers the retrieval of many prompts with one matrix product, the chain then
+    picks the prefetched documents up instead of searching again.
+    """
+
+    index: Any
+    embedding_function: Any
+    k: int = 6
+    search_type: str = "similarity"
+    # same defaults as Chroma.max_marginal_relevance_search
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    # query -> documents found by prefetch()
+    prefetched: dict = Field(default_factory=dict)
+    prefetched_lock: Any = Field(default_factory=threading.Lock)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def documents_for_vectors(self, query_vectors):
+        # one list of documents per query vector
+        fetch_k = self.fetch_k if self.search_type == "mmr" else self.k
+        rows, _ = self.index.search(query_vectors, max(fetch_k, self.k))
+        results = []
+        for query_vector, candidates in zip(query_vectors, rows):
+            if self.search_type == "mmr":
+                selected = self.index.mmr(query_vector, candidates, self.k, self.lambda_mult)
+            else:
+                selected = candidates[:self.k]
+            results.append([self.index.document(row) for row in selected])
+        return results
+
+    def prefetch(self, queries, query_vectors=None):
+        # query_vectors, if given, are the embeddings of queries (e.g. from model.prefetch_query_embeddings)
+        if query_vectors is None:
+            query_vectors = self.embedding_function.embed_queries(list(queries))
+        results = []
+        for start in range(0, len(queries), query_batch_size):
+            results.extend(self.documents_for_vectors(query_vectors[start:start + query_batch_size]))
+        with self.prefetched_lock:
+            if len(self.prefetched) + len(queries) > max_prefetched_results:
+                self.prefetched.clear()
+            self.prefetched.update(zip(queries, results))
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with self.prefetched_lock:
+            documents = self.prefetched.pop(query, None)
+        if documents is not None:
+            return documents
+        return self.documents_for_vectors([self.embedding_function.embed_query(query)])[0]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self._get_relevant_documents(query, run_manager=run_manager)
@@ -0,0 +1,183 @@
+# basic imports
+import csv
+import datetime
+import logging
+import threading
+
+# langchain imports
+from langchain.schema import Document
+
+# user defined imports
+from model import generate_responses, load_embeddings, prefetch_query_embeddings, get_answer_version
+from utils.semantic_dedup import dedup_enabled, build_history_index, find_duplicates
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# reused_from links a reused answer to the row (or history.csv row) it was copied from
+# route is how the prompt was answered (classifier, cache, llm or reused), confidence is the cascade's statement match
+# version is the vector store version the answer was given with, only answers of the current version are reused
+response_file_header = ['prompt', 'response', 'sources', 'reused_from', 'route', 'confidence', 'version']
+
+
+def find_reusable_answers(rows, history_file_path, version):
+    # embed every prompt in one batch and look for prompts that were already answered in this file or in the history
+    if not dedup_enabled or not rows:
+        return [None] * len(rows)
+    logging.info('Looking for near-duplicate prompts')
+    # the prompt vectors are cached, so the retriever won't embed these prompts again
+    prompt_vectors = prefetch_query_embeddings(rows)
+    # a re-ingest changes the version, answers of the previous data are not reused
+    history_entries, history_vectors = build_history_index(history_file_path, load_embeddings(), version)
+    return find_duplicates(rows, prompt_vectors, history_entries, history_vectors)
+
+
+def reused_response(query, original, reused_from):
+    return {
+        "query": query,
+        "result": original["result"],
+        "source_documents": original["source_documents"],
+        "reused_from": reused_from,
+        "route": "reused",
+    }
+
+
+def reused_history_response(query, entry):
+    source_documents = [Document(page_content="", metadata={"source": source}) for source in entry["sources"]]
+    original = {"result": entry["result"], "source_documents": source_documents}
+    return reused_response(query, original, f"history.csv row {entry['history_row']}")
+
+
+def answer_rows(rows, db, history_file_path, done=None, on_token=None):
+    """
+    Answer every row of an RFP file that is not in done (row index -> response of an earlier,
+    interrupted run). Near-duplicates reuse the answer of an earlier row or of the history file,
+    the remaining rows go through generate_responses (answer cache, cascade, LLM).
+    Yields (row index, response) as the rows finish, not in row order.
+    on_token, if given, is called with (row index, text so far) while an answer is streamed in.
+    """
+    done = done or {}
+    version = get_answer_version(db)
+    duplicates = find_reusable_answers(rows, history_file_path, version)
+    # only the original prompts are sent to the LLM, their near-duplicates are filled in when they finish
+    originals = [index for index, duplicate in enumerate(duplicates) if duplicate is None]
+    reused_by = {index: [] for index in originals}
+    for index, duplicate in enumerate(duplicates):
+        if duplicate is None or index in done:
+            continue
+        kind, original = duplicate
+        if kind == "history":
+            yield index, dict(reused_history_response(rows[index], original), version=version)
+        elif original in done:
+            yield index, dict(reused_response(rows[index], done[original], f"row {original + 1}"), version=version)
+        else:
+            reused_by[original].append(index)
+    logging.info(f'Reusing answers for {len(rows) - len(originals)} of {len(rows)} prompts')
+
+    pending = [index for index in originals if index not in done]
+    logging.info(f'{len(pending)} prompts left to answer, {len(done)} answered by an earlier run')
+    stream = None if on_token is None else lambda position, text: on_token(pending[position], text)
+    for position, response_data in generate_responses([rows[index] for index in pending], db, on_token=stream):
+        index = pending[position]
+        response_data["version"] = version
+        yield index, response_data
+        for duplicate_index in reused_by[index]:
+            yield duplicate_index, dict(reused_response(rows[duplicate_index], response_data, f"row {index + 1}"), version=version)
+
+
+def response_row(response_data):
+    # the row of the response and history files for one answered prompt
+    sources = set(doc.metadata['source'] for doc in response_data["source_documents"])
+    confidence = response_data.get("confidence")
+    return [f"Doessoftware{response_data['query']} ?", response_data["result"], sources,
+            response_data.get("reused_from", ""), response_data.get("route", ""),
+            "" if confidence is None else f"{confidence:.3f}", response_data.get("version", "")]
+
+
+def is_history_empty(history_file_path):
+    try:
+        with open(history_file_path, 'r', newline='') as file:
+            first_row = next(csv.reader(file))
+    except (FileNotFoundError, StopIteration):
+        return True
+    # Check if the first row contains strings (header)
+    return len(first_row) == 0 or first_row[0].replace(" ", "") == ""
+
+
+def write_response_file(responses, response_file_path):
+    # the answers of one file in row order
+    with open(response_file_path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(response_file_header)
+        for response_data in responses:
+            writer.writerow(response_row(response_data))
+
+
+def append_history_rows(responses, history_file_path):
+    # if history file is empty, write the header first
+    history_is_empty = is_history_empty(history_file_path)
+    with open(history_file_path, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        if history_is_empty:
+            writer.writerow(response_file_header)
+        for response_data in responses:
+            writer.writerow(response_row(response_data))
+
+
+def end_history_file(history_file_path):
+    with open(history_file_path, mode='a', newline='') as file:
+        # add time date/time to seperate each session
+        csv.writer(file).writerow(["-----------------", f"End of file ----- {str(datetime.datetime.now())}", "-----------------"])
+
+
+def append_to_history(responses, history_file_path):
+    append_history_rows(responses, history_file_path)
+    end_history_file(history_file_path)
+
+
+class ResponseWriter:
+    """
+    Writes the answers of one file to its response file and the history file as the rows finish, in
+    row order: a row that finishes before the rows above it waits until they are written. A run that
+    is interrupted leaves the rows answered so far in both files.
+    done (row index -> response) are the rows of an earlier, interrupted run, the response file is
+    written again from them; history_written is the number of them already in the history file.
+    history_lock, if given, is held while rows are appended to the history file.
+    """
+
+    def __init__(self, response_file_path, history_file_path, done=None, history_written=0, history_lock=None):
+        self.response_file_path = response_file_path
+        self.history_file_path = history_file_path
+        self.history_lock = history_lock or threading.Lock()
+        self.waiting = dict(done or {})
+        self.written = 0
+        self.history_written = history_written
+        write_response_file([], response_file_path)
+        self.write_ready()
+
+    def add(self, index, response_data):
+        self.waiting[index] = response_data
+        self.write_ready()
+
+    def write_ready(self):
+        # the rows that are next in order
+        ready = []
+        while self.written + len(ready) in self.waiting:
+            ready.append(self.waiting.pop(self.written + len(ready)))
+        if not ready:
+            return
+        with open(self.response_file_path, mode='a', newline='') as file:
+            writer = csv.writer(file)
+            for response_data in ready:
+                writer.writerow(response_row(response_data))
+        # rows of an interrupted run may be in the history already
+        skip = max(0, self.history_written - self.written)
+        self.written += len(ready)
+        if ready[skip:]:
+            with self.history_lock:
+                append_history_rows(ready[skip:], self.history_file_path)
+        self.history_written = max(self.history_written, self.written)
+
+    def close(self):
+        with self.history_lock:
+            end_history_file(self.history_file_path)
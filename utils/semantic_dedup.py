@@ -0,0 +1,199 @@
+# basic imports
+import ast
+import csv
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+# user defined imports
+from utils.answer_cache import normalize_prompt
+from utils.bm25 import tokenize
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+# prompts at least this similar (cosine) to an already answered prompt that name the same terms reuse its answer
+similarity_threshold = float(os.environ.get("RFP_DEDUP_THRESHOLD", 0.95))
+# set RFP_DEDUP=0 to send every prompt to the LLM
+dedup_enabled = os.environ.get("RFP_DEDUP", "1") != "0"
+history_index_path = "cache/history_index"
+# words that don't change what a prompt asks for, two prompts that only differ in them can share an answer
+filler_words = {"a", "an", "the", "and", "of", "to", "for", "in", "on", "with", "by", "from", "at", "as", "be", "is",
+                "are", "its", "their", "your", "our", "all", "any"}
+# answers copied from another prompt or from an Airtable statement are not reused again, only answers of the LLM
+not_reusable_routes = ("reused", "classifier")
+# several files (jobs, the command line batch) can update the history index at the same time
+history_index_lock = threading.Lock()
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.size == 0:
+        return vectors.reshape(0, 0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def strip_question(history_prompt):
+    # the history file stores prompts as "Doessoftware{query} ?", the index works on the raw query
+    if history_prompt.startswith("Doessoftware"):
+        history_prompt = history_prompt[len("Doessoftware"):]
+    if history_prompt.endswith(" ?"):
+        history_prompt = history_prompt[:-2]
+    return history_prompt
+
+
+def parse_sources(sources):
+    # sources are written to the csv files as the string of a python set
+    try:
+        parsed = ast.literal_eval(sources)
+    except (ValueError, SyntaxError):
+        return [sources]
+    if isinstance(parsed, (set, list, tuple)):
+        return sorted(parsed)
+    return [str(parsed)]
+
+
+def load_history_entries(history_file_path, version=None):
+    # returns the answered prompts in the history file, the latest answer wins for repeated prompts
+    # with version, only LLM answers given with that version of the vector store are returned
+    entries = {}
+    if not os.path.exists(history_file_path):
+        return []
+    with open(history_file_path, newline='') as file:
+        reader = csv.reader(file)
+        for line_number, row in enumerate(reader, start=1):
+            # skip the header and the end of file separators
+            if len(row) < 3 or row[0] == 'prompt' or row[0].startswith("-----"):
+                continue
+            if version is not None and (len(row) < 7 or row[6] != version or row[4] in not_reusable_routes):
+                continue
+            query = strip_question(row[0])
+            entries[normalize_prompt(query)] = {
+                "query": query,
+                "result": row[1],
+                "sources": parse_sources(row[2]),
+                "history_row": line_number,
+            }
+    return list(entries.values())
+
+
+def load_history_index(index_path=history_index_path):
+    try:
+        vectors = np.load(index_path + ".npy")
+        with open(index_path + ".json") as file:
+            keys = json.load(file)
+    except (FileNotFoundError, ValueError, EOFError):
+        return {}
+    # the two files are replaced one after the other, an index caught in between is embedded again
+    if len(keys) != len(vectors):
+        return {}
+    return dict(zip(keys, vectors))
+
+
+def save_history_index(vectors_by_key, index_path=history_index_path):
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    keys = list(vectors_by_key)
+    vectors = np.array([vectors_by_key[key] for key in keys], dtype=np.float32)
+    # write to temporary files first, a reader never sees a half-written index
+    with open(index_path + ".npy.tmp", "wb") as file:
+        np.save(file, vectors)
+    with open(index_path + ".json.tmp", "w") as file:
+        json.dump(keys, file)
+    os.replace(index_path + ".npy.tmp", index_path + ".npy")
+    os.replace(index_path + ".json.tmp", index_path + ".json")
+
+
+def build_history_index(history_file_path, embedding_function, version=None, index_path=history_index_path):
+    """
+    Embed the prompts of the history file that were answered with version (see load_history_entries),
+    only prompts that are not in the saved index yet are sent to the embedding API.
+    Returns (entries, normalized vectors) with one vector per entry.
+    """
+    logging.info("Updating the history index")
+    entries = load_history_entries(history_file_path, version)
+    keys = [normalize_prompt(entry["query"]) for entry in entries]
+    with history_index_lock:
+        indexed = load_history_index(index_path)
+        missing = [entry["query"] for entry, key in zip(entries, keys) if key not in indexed]
+        if missing:
+            logging.info(f"Embedding {len(missing)} new history prompts")
+            for query, vector in zip(missing, embedding_function.embed_queries(missing)):
+                indexed[normalize_prompt(query)] = vector
+        # prompts removed from the history file (e.g. after "Clear History") or answered with an
+        # older store version are dropped from the index
+        indexed = {key: indexed[key] for key in keys}
+        save_history_index(indexed, index_path)
+    return entries, normalize_rows([indexed[key] for key in keys])
+
+
+def key_terms(prompt):
+    # the words of a prompt that name what it asks for, "Tracks the operators" and "track operator" have the same ones
+    terms = set()
+    for token in tokenize(prompt):
+        if token in filler_words:
+            continue
+        terms.add(token[:-1] if len(token) > 3 and token.endswith("s") else token)
+    return terms
+
+
+def best_match(similarities, candidate_terms, terms, threshold):
+    """
+    Index of the most similar candidate that is at least threshold similar and names the same terms,
+    None if there is none. Prompts that only differ in one product term ("track operators", "track
+    documents") are often more similar than the threshold, their answers must not be swapped.
+    """
+    for j in np.argsort(-similarities, kind="stable"):
+        if similarities[j] < threshold:
+            return None
+        if candidate_terms[j] == terms:
+            return int(j)
+    return None
+
+
+def find_duplicates(prompts, prompt_vectors, history_entries=(), history_vectors=None, threshold=similarity_threshold):
+    """
+    For every prompt, find an earlier prompt of the same file or a prompt in the history
+    whose answer can be reused. Returns a list with one item per prompt:
+      None                   the prompt has to be answered
+      ("row", j)             reuse the answer of prompt j of the same file (j is always an original)
+      ("history", entry)     reuse an answer from the history file
+    """
+    prompt_vectors = normalize_rows(prompt_vectors)
+    duplicates = [None] * len(prompt_vectors)
+    if not len(prompt_vectors):
+        return duplicates
+    terms = [key_terms(prompt) for prompt in prompts]
+
+    # best history match for every prompt
+    history_match = [None] * len(prompt_vectors)
+    if history_vectors is not None and len(history_vectors):
+        history_terms = [key_terms(entry["query"]) for entry in history_entries]
+        similarities = prompt_vectors @ history_vectors.T
+        for i, row in enumerate(similarities):
+            j = best_match(row, history_terms, terms[i], threshold)
+            if j is not None:
+                history_match[i] = history_entries[j]
+
+    originals = []
+    for i, vector in enumerate(prompt_vectors):
+        best_row = None
+        if originals:
+            similarities = prompt_vectors[originals] @ vector
+            j = best_match(similarities, [terms[original] for original in originals], terms[i], threshold)
+            if j is not None:
+                best_row = originals[j]
+        # prefer an answer from the same file, it was generated with the current corpus
+        if best_row is not None:
+            duplicates[i] = ("row", best_row)
+        elif history_match[i] is not None:
+            duplicates[i] = ("history", history_match[i])
+        else:
+            originals.append(i)
+    return duplicates
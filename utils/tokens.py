@@ -0,0 +1,35 @@
+# basic imports
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+# setting configs
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.DEBUG)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    # tiktoken downloads its encodings on first use, fall back to an estimate when that's not possible
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception as error:
+        logging.warning(f"Could not load the tiktoken encoding for {model_name} ({error}), estimating token counts instead")
+        return None
+
+
+def count_tokens(text, model_name="gpt-3.5-turbo"):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        # roughly 4 characters per token for english text
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model_name="gpt-3.5-turbo"):
+    # keep the first max_tokens tokens of text
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:max_tokens])